@@ -14,22 +14,74 @@
 import os
 import sys
 import time
+import errno
+import stat
 import logging
+import logging.handlers
 import datetime
-import subprocess
 import socket
-import smtplib
-from email.message import EmailMessage
-from pathlib import Path
+import json
+import hashlib
+import importlib
+import select
+import signal
+import argparse
+import threading
+import queue
+# subprocess, ctypes, smtplib/email, sqlite3 and gzip are imported where they're used:
+# none of them is needed between start-up and the first HID report
 
-# Configure logging
+def process_start_time():
+    """When this process started, on the time.monotonic() clock - taken from /proc,
+    so interpreter start-up and imports count too"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22, after the parenthesised command name: start time in clock ticks since boot
+            ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        age = time.clock_gettime(time.CLOCK_BOOTTIME) - ticks / os.sysconf("SC_CLK_TCK")
+        return time.monotonic() - max(age, 0.0)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.monotonic()
+
+PROCESS_START = process_start_time()
+
+# Configure logging: records are buffered in memory and written in batches (at once for
+# warnings and errors, and at the end of every run) to a size-bounded log whose rotated
+# files are gzipped - the Pi's SD card sees a few writes per run instead of one per line
 log_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dvr_shutdown.log")
-logging.basicConfig(
-    filename=log_file,
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+LOG_MAX_BYTES = 1024 * 1024  # Rotate the log (and the metrics trace) past this size
+LOG_BACKUP_COUNT = 5         # Compressed rotations kept: dvr_shutdown.log.1.gz ...
+LOG_BUFFER_RECORDS = 500     # Records held in memory between writes
+
+def compress_rotated(source, dest):
+    """Rotator for RotatingFileHandler: gzip the full log into its rotated name"""
+    import gzip
+    import shutil
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+def rotate_file(path, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUP_COUNT):
+    """Shift path.1.gz..path.N.gz up one and compress path into path.1.gz once it's over max_bytes"""
+    try:
+        if os.path.getsize(path) < max_bytes:
+            return
+        for index in range(backups - 1, 0, -1):
+            if os.path.exists(f"{path}.{index}.gz"):
+                os.replace(f"{path}.{index}.gz", f"{path}.{index + 1}.gz")
+        compress_rotated(path, f"{path}.1.gz")
+    except OSError as e:
+        logging.warning(f"Could not rotate {path}: {e}")
+
+log_rotating = logging.handlers.RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES,
+                                                    backupCount=LOG_BACKUP_COUNT, delay=True)
+log_rotating.namer = lambda name: name + ".gz"
+log_rotating.rotator = compress_rotated
+log_rotating.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s',
+                                            datefmt='%Y-%m-%d %H:%M:%S'))
+log_buffer = logging.handlers.MemoryHandler(LOG_BUFFER_RECORDS, flushLevel=logging.WARNING,
+                                            target=log_rotating)
+logging.basicConfig(level=logging.INFO, handlers=[log_buffer])
 
 # Default timeout values (in seconds)
 DEFAULT_OPERATION_TIMEOUT = 5  # Default timeout for individual operations
@@ -37,49 +89,436 @@ STEP_TIMEOUT = 15              # Timeout for completing a step
 SEQUENCE_TIMEOUT = 60          # Total timeout for the entire sequence
 MAX_RETRIES = 3                # Maximum number of retries for operations
 
+# Metrics export: a JSON-lines trace appended per run, and a Prometheus
+# textfile-collector file describing the last run (skipped if the directory is missing)
+METRICS_TRACE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dvr_shutdown_trace.jsonl")
+METRICS_PROM_FILE = "/var/lib/node_exporter/textfile_collector/dvr_automator.prom"
+
+# Run history: one row per run (plus its step timings) in an indexed SQLite file,
+# queried with --history instead of scanning the text log
+RUN_HISTORY_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dvr_runs.sqlite")
+RUN_HISTORY_KEEP = 20000  # Oldest runs beyond this are pruned
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY, started REAL NOT NULL, host TEXT, model TEXT, success INTEGER NOT NULL,
+    seconds REAL, hid_writes INTEGER, retries INTEGER, backoff_seconds REAL, error TEXT);
+CREATE INDEX IF NOT EXISTS runs_started ON runs (started);
+CREATE INDEX IF NOT EXISTS runs_success ON runs (success, started);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE, step TEXT NOT NULL,
+    seconds REAL, count INTEGER, failures INTEGER, PRIMARY KEY (run_id, step)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS steps_step ON steps (step);
+"""
+
+# Histogram buckets for HID write latency (seconds)
+WRITE_LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+class Metrics:
+    """Per-run timing: HID write latency, retries, step durations and time spent
+    blocked in notifications. Kept in memory until export() so the hot path
+    never touches the disk."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, started=None):
+        self.run_start = time.time()
+        self.started = time.monotonic() if started is None else started  # process start or trigger
+        self.first_report = None  # time.monotonic() of the run's first HID report
+        self.write_buckets = [0] * (len(WRITE_LATENCY_BUCKETS) + 1)
+        self.write_count = 0
+        self.write_sum = 0.0
+        self.retries = 0
+        self.backoff_seconds = 0.0
+        self.notify_blocked = 0.0
+        self.steps = {}   # step id -> [total seconds, count, failures]
+        self.events = []  # trace events for this run
+        self.error = None  # last error logged during this run
+
+    def observe_write(self, seconds):
+        self.write_count += 1
+        self.write_sum += seconds
+        for index, bound in enumerate(WRITE_LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.write_buckets[index] += 1
+                return
+        self.write_buckets[-1] += 1
+
+    def record_retry(self, kind, backoff):
+        self.retries += 1
+        self.backoff_seconds += backoff
+        self.events.append({"ts": time.time(), "event": "retry", "kind": kind, "backoff": backoff})
+
+    def record_step(self, step_id, seconds, ok=True):
+        totals = self.steps.setdefault(step_id, [0.0, 0, 0])
+        totals[0] += seconds
+        totals[1] += 1
+        totals[2] += 0 if ok else 1
+        self.events.append({"ts": time.time(), "event": "step", "step": step_id,
+                            "seconds": round(seconds, 6), "ok": ok})
+
+    def timed(self, step_id):
+        return StepTimer(self, step_id)
+
+    def add_notify_blocked(self, seconds):
+        self.notify_blocked += seconds
+
+    def record_error(self, message):
+        self.error = message
+
+    def record_link(self, state):
+        self.events.append({"ts": time.time(), "event": "link", "state": state})
+
+    def first_report_seconds(self):
+        if self.first_report is None:
+            return None
+        return round(self.first_report - self.started, 6)
+
+    def snapshot(self):
+        return {name: value for name, value in vars(self).items() if name not in ("run_start", "error")}
+
+    def merge(self, snapshot, unit):
+        """Fold another process's run (one DVR of several) into this one"""
+        self.write_buckets = [a + b for a, b in zip(self.write_buckets, snapshot["write_buckets"])]
+        self.write_count += snapshot["write_count"]
+        self.write_sum += snapshot["write_sum"]
+        self.retries += snapshot["retries"]
+        self.backoff_seconds += snapshot["backoff_seconds"]
+        self.notify_blocked += snapshot["notify_blocked"]
+        if snapshot["first_report"] is not None:
+            self.first_report = min(self.first_report or snapshot["first_report"], snapshot["first_report"])
+        for step_id, totals in snapshot["steps"].items():
+            self.steps[f"{unit}/{step_id}"] = totals
+        self.events += [dict(event, unit=unit) for event in snapshot["events"]]
+
+    def export(self, success):
+        duration = time.time() - self.run_start
+        summary = {
+            "ts": time.time(), "event": "run", "host": socket.gethostname(), "success": success,
+            "seconds": round(duration, 3), "hid_writes": self.write_count,
+            "hid_write_seconds": round(self.write_sum, 6), "retries": self.retries,
+            "backoff_seconds": round(self.backoff_seconds, 3),
+            "notify_blocked_seconds": round(self.notify_blocked, 6),
+            "first_report_seconds": self.first_report_seconds(),
+        }
+        
+        rotate_file(METRICS_TRACE_FILE)
+        try:
+            with open(METRICS_TRACE_FILE, "a") as f:
+                for event in self.events + [summary]:
+                    f.write(json.dumps(dict(event, run=self.run_start)) + "\n")
+        except OSError as e:
+            logging.warning(f"Could not write metrics trace: {e}")
+        
+        import sqlite3
+        try:
+            self.record_history(summary)
+        except sqlite3.Error as e:
+            logging.warning(f"Could not record run history: {e}")
+        
+        if not os.path.isdir(os.path.dirname(METRICS_PROM_FILE)):
+            return
+        
+        lines = [
+            "# HELP dvr_automator_hid_write_seconds Latency of single HID report writes",
+            "# TYPE dvr_automator_hid_write_seconds histogram",
+        ]
+        cumulative = 0
+        for bound, count in zip(list(WRITE_LATENCY_BUCKETS) + ["+Inf"], self.write_buckets):
+            cumulative += count
+            lines.append(f'dvr_automator_hid_write_seconds_bucket{{le="{bound}"}} {cumulative}')
+        lines += [
+            f"dvr_automator_hid_write_seconds_sum {self.write_sum:.6f}",
+            f"dvr_automator_hid_write_seconds_count {self.write_count}",
+            "# HELP dvr_automator_retries Retries during the last run",
+            "# TYPE dvr_automator_retries gauge",
+            f"dvr_automator_retries {self.retries}",
+            "# HELP dvr_automator_backoff_seconds Time spent in retry backoff during the last run",
+            "# TYPE dvr_automator_backoff_seconds gauge",
+            f"dvr_automator_backoff_seconds {self.backoff_seconds:.3f}",
+            "# HELP dvr_automator_notify_blocked_seconds Time the run spent blocked on notifications",
+            "# TYPE dvr_automator_notify_blocked_seconds gauge",
+            f"dvr_automator_notify_blocked_seconds {self.notify_blocked:.6f}",
+        ]
+        if self.first_report is not None:
+            lines += [
+                "# HELP dvr_automator_first_report_seconds Time from start-up or trigger to the first HID report",
+                "# TYPE dvr_automator_first_report_seconds gauge",
+                f"dvr_automator_first_report_seconds {self.first_report - self.started:.6f}",
+            ]
+        lines += [
+            "# HELP dvr_automator_step_seconds Time spent in each step during the last run",
+            "# TYPE dvr_automator_step_seconds gauge",
+        ]
+        for step_id, (seconds, count, failures) in sorted(self.steps.items()):
+            lines.append(f'dvr_automator_step_seconds{{step="{step_id}"}} {seconds:.6f}')
+        lines += [
+            "# HELP dvr_automator_run_seconds Duration of the last run",
+            "# TYPE dvr_automator_run_seconds gauge",
+            f"dvr_automator_run_seconds {duration:.3f}",
+            "# HELP dvr_automator_run_success Whether the last run shut the DVR down",
+            "# TYPE dvr_automator_run_success gauge",
+            f"dvr_automator_run_success {1 if success else 0}",
+            "# HELP dvr_automator_last_run_timestamp_seconds When the last run started",
+            "# TYPE dvr_automator_last_run_timestamp_seconds gauge",
+            f"dvr_automator_last_run_timestamp_seconds {self.run_start:.0f}",
+        ]
+        
+        # Write atomically so the collector never reads a half-written file
+        try:
+            tmp_file = METRICS_PROM_FILE + ".tmp"
+            with open(tmp_file, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp_file, METRICS_PROM_FILE)
+        except OSError as e:
+            logging.warning(f"Could not write Prometheus metrics: {e}")
+
+    def record_history(self, summary):
+        """Add this run and its step timings to RUN_HISTORY_DB, in one transaction"""
+        db = open_history()
+        try:
+            with db:
+                cursor = db.execute(
+                    "INSERT INTO runs (started, host, model, success, seconds, hid_writes, retries, "
+                    "backoff_seconds, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (self.run_start, summary["host"], DVR_MODEL, int(summary["success"]), summary["seconds"],
+                     self.write_count, self.retries, summary["backoff_seconds"],
+                     None if summary["success"] else self.error))
+                db.executemany("INSERT INTO steps (run_id, step, seconds, count, failures) VALUES (?, ?, ?, ?, ?)",
+                               [(cursor.lastrowid, step_id, round(seconds, 6), count, failures)
+                                for step_id, (seconds, count, failures) in self.steps.items()])
+                db.execute("DELETE FROM runs WHERE id <= ?", (cursor.lastrowid - RUN_HISTORY_KEEP,))
+        finally:
+            db.close()
+
+def open_history():
+    import sqlite3
+    db = sqlite3.connect(RUN_HISTORY_DB, timeout=5)
+    db.execute("PRAGMA foreign_keys = ON")
+    db.executescript(HISTORY_SCHEMA)
+    return db
+
+def show_history(limit=20, failed_only=False, since_days=None, by_step=False):
+    """Print recent runs, or per-step timing across them, from RUN_HISTORY_DB"""
+    if not os.path.exists(RUN_HISTORY_DB):
+        print(f"No run history yet ({RUN_HISTORY_DB})")
+        return 0
+    where, params = [], []
+    if failed_only:
+        where.append("success = 0")
+    if since_days is not None:
+        where.append("started >= ?")
+        params.append(time.time() - since_days * 86400)
+    condition = f"WHERE {' AND '.join(where)}" if where else ""
+    
+    db = open_history()
+    try:
+        if by_step:
+            rows = db.execute(
+                f"SELECT step, COUNT(*), SUM(steps.failures), AVG(steps.seconds / steps.count), MAX(steps.seconds) "
+                f"FROM steps JOIN (SELECT id FROM runs {condition} ORDER BY started DESC LIMIT ?) AS selected "
+                f"ON steps.run_id = selected.id GROUP BY step ORDER BY step", params + [limit]).fetchall()
+            print(f"{'step':<40} {'runs':>6} {'failures':>8} {'avg s':>9} {'max s':>9}")
+            for step, runs, failures, average, longest in rows:
+                print(f"{step:<40} {runs:>6} {failures:>8} {average:>9.3f} {longest:>9.3f}")
+            return 0
+        
+        rows = db.execute(
+            f"SELECT started, host, model, success, seconds, hid_writes, retries, error "
+            f"FROM runs {condition} ORDER BY started DESC LIMIT ?", params + [limit]).fetchall()
+        total, failures = db.execute(f"SELECT COUNT(*), COUNT(*) - TOTAL(success) FROM runs {condition}", params).fetchone()
+    finally:
+        db.close()
+    
+    for started, host, model, success, seconds, writes, retries, error in rows:
+        print(f"{datetime.datetime.fromtimestamp(started).strftime('%Y-%m-%d %H:%M:%S')}  {host:<16} {model:<16} "
+              f"{'ok' if success else 'FAILED':<6} {seconds:>7.1f}s {writes:>6} reports {retries:>3} retries"
+              + (f"  {error}" if error else ""))
+    print(f"{len(rows)} of {total} matching runs shown, {failures:.0f} failed")
+    return 0
+
+class StepTimer:
+    """Context manager that records a step's duration, and whether it raised"""
+
+    def __init__(self, metrics, step_id):
+        self.metrics = metrics
+        self.step_id = step_id
+        self.ok = True  # Callers can mark a step failed without raising
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.record_step(self.step_id, time.monotonic() - self.start, self.ok and exc_type is None)
+        return False
+
+metrics = Metrics()
+
 # Email notification settings
 EMAIL_ENABLED = True  # Set to True to enable email notifications
 EMAIL_TO = "client@domain.com"
+EMAIL_FROM = "DVR Shutdown Script <noreply@localhost>"
 EMAIL_SUBJECT = "DVR Shutdown Alert"
-EMAIL_FILE = "/tmp/dvr_shutdown_email.txt"  # Temporary file for email content
 
-def send_notification(message, level="info"):
-    """Create an email file that can be piped to msmtp"""
-    if not EMAIL_ENABLED:
-        return
-        
-    try:
-        # Create email content with proper headers
-        email_content = f"""To: {EMAIL_TO}
-Subject: {EMAIL_SUBJECT} - {level.upper()}
-From: DVR Shutdown Script <noreply@localhost>
-X-Priority: {1 if level.lower() == "error" else 3}
+# Delivery: "msmtp" pipes the message to msmtp, "smtp" talks to SMTP_HOST directly
+NOTIFY_BACKEND = "msmtp"
+SMTP_HOST = "localhost"
+SMTP_PORT = 25
+SMTP_STARTTLS = False
+SMTP_USER = None
+SMTP_PASSWORD = None
+
+NOTIFY_QUEUE_SIZE = 100   # Events held for the digest; extras are dropped, never waited on
+NOTIFY_TIME_BUDGET = 10   # Hard limit (seconds) for delivering one digest
+
+# Notification priority order, used for the digest subject
+NOTIFY_LEVELS = ["debug", "info", "warning", "error"]
+
+class Notifier:
+    """Collects notifications on a background thread and sends them as one
+    digest per run, so delivery never blocks HID output."""
+
+    def __init__(self):
+        self.events = queue.Queue(maxsize=NOTIFY_QUEUE_SIZE)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.captured = None  # List that collects events instead of sending them (see capture())
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.worker, name="notifier", daemon=True)
+                self.thread.start()
+
+    def capture(self):
+        # A DVR's child process hands its events to the controller, which sends the digest
+        self.captured = []
+
+    def prepare(self):
+        """Load the delivery code and check the transport is there, so the digest at
+        the end of the run doesn't pay for either"""
+        if not EMAIL_ENABLED:
+            return
+        self.start()
+        # Loaded here, off the hot path, so send()'s imports find them already in sys.modules
+        importlib.import_module("email.message")
+        if NOTIFY_BACKEND == "smtp":
+            importlib.import_module("smtplib")
+            try:
+                socket.getaddrinfo(SMTP_HOST, SMTP_PORT, type=socket.SOCK_STREAM)
+            except OSError as e:
+                log_message(f"Notifications may not be delivered: cannot resolve {SMTP_HOST}: {e}", "warning")
+        else:
+            importlib.import_module("subprocess")
+            import shutil
+            if shutil.which("msmtp") is None:
+                log_message("Notifications may not be delivered: msmtp is not installed", "warning")
+
+    def add(self, message, level="info"):
+        if self.captured is not None:
+            self.captured.append((level.lower(), message))
+            return
+        started = time.monotonic()
+        self.start()
+        try:
+            self.events.put_nowait((datetime.datetime.now(), level.lower(), message))
+        except queue.Full:
+            logging.warning(f"Notification queue full, dropping: {message}")
+        metrics.add_notify_blocked(time.monotonic() - started)
+
+    def flush(self, timeout=NOTIFY_TIME_BUDGET):
+        """Send everything collected so far as one digest, waiting at most timeout seconds"""
+        if self.thread is None:
+            return True
+        started = time.monotonic()
+        done = threading.Event()
+        try:
+            self.events.put((None, None, done), timeout=timeout)
+            return done.wait(timeout)
+        except queue.Full:
+            return False
+        finally:
+            metrics.add_notify_blocked(time.monotonic() - started)
 
-{message}
+    def worker(self):
+        digest = []
+        while True:
+            when, level, message = self.events.get()
+            if when is not None:
+                digest.append((when, level, message))
+                continue
+            
+            # Flush marker - message carries the event to signal
+            try:
+                if digest:
+                    self.send(digest)
+            except Exception as e:
+                log_message(f"Failed to send notification: {e}", "warning")
+            digest = []
+            message.set()
+
+    def send(self, digest):
+        # Collapse repeats of the same message into one line with a count
+        counts = {}
+        for when, level, message in digest:
+            key = (level, message)
+            if key in counts:
+                counts[key][1] += 1
+            else:
+                counts[key] = [when, 1]
+        
+        top_level = max((level for _, level, _ in digest),
+                        key=lambda level: NOTIFY_LEVELS.index(level) if level in NOTIFY_LEVELS else 0)
+        lines = [f"{when.strftime('%H:%M:%S')} [{level.upper()}] {message}" + (f" (x{count})" if count > 1 else "")
+                 for (level, message), (when, count) in counts.items()]
+        
+        from email.message import EmailMessage
+        email = EmailMessage()
+        email["To"] = EMAIL_TO
+        email["From"] = EMAIL_FROM
+        email["Subject"] = f"{EMAIL_SUBJECT} - {top_level.upper()}"
+        email["X-Priority"] = "1" if top_level == "error" else "3"
+        email.set_content("\n".join(lines) + f"""
 
 --
 Sent from host: {socket.gethostname()}
 Time: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-"""
+""")
         
-        # Write to file for piping to msmtp
-        with open(EMAIL_FILE, 'w') as f:
-            f.write(email_content)
-        
-        # Execute msmtp to send the email
-        cmd = f"cat {EMAIL_FILE} | msmtp {EMAIL_TO}"
-        result = os.system(cmd)
-        
-        if result == 0:
-            log_message(f"Notification sent to {EMAIL_TO}", "info")
+        if NOTIFY_BACKEND == "smtp":
+            import smtplib
+            with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=NOTIFY_TIME_BUDGET) as smtp:
+                if SMTP_STARTTLS:
+                    smtp.starttls()
+                if SMTP_USER:
+                    smtp.login(SMTP_USER, SMTP_PASSWORD)
+                smtp.send_message(email)
         else:
-            log_message(f"Failed to send notification via msmtp (exit code: {result})", "warning")
-            
-    except Exception as e:
-        log_message(f"Failed to create notification: {e}", "error")
+            import subprocess
+            result = subprocess.run(["msmtp", EMAIL_TO], input=email.as_bytes(),
+                                    capture_output=True, timeout=NOTIFY_TIME_BUDGET)
+            if result.returncode != 0:
+                log_message(f"Failed to send notification via msmtp (exit code: {result.returncode})", "warning")
+                return
+        
+        log_message(f"Notification digest ({len(lines)} events) sent to {EMAIL_TO}", "info")
+
+notifier = Notifier()
+
+def send_notification(message, level="info"):
+    """Queue a message for this run's notification digest"""
+    if not EMAIL_ENABLED:
+        return
+    notifier.add(message, level)
+
+# Prepended to every log line - names the DVR when several are driven at once
+LOG_PREFIX = ""
 
 # Function to log and print messages
 def log_message(message, level="info"):
+    message = LOG_PREFIX + message
     print(message)
     if level.lower() == "info":
         logging.info(message)
@@ -92,6 +531,7 @@ def log_message(message, level="info"):
         
     # For critical errors, also send notification
     if level.lower() == "error":
+        metrics.record_error(message)
         send_notification(message, level)
 
 # Screen dimensions
@@ -102,55 +542,701 @@ SCREEN_HEIGHT = 1080
 current_x = SCREEN_WIDTH // 2
 current_y = SCREEN_HEIGHT // 2
 
-# HID device path
+# HID device path. "unix:/path" or a FIFO points at a virtual sink (see
+# DVRSimulator.py) instead of the gadget, for benchmarks and local testing.
 DEVICE_PATH = "/dev/hidg0"
 
-def reset_gadget():
-    log_message("Resetting USB gadget...")
-    
-    # Create this as a bash script for better execution
-    reset_script = """#!/bin/bash
-echo "" > /sys/kernel/config/usb_gadget/mygadget/UDC
-sleep 0.5
-cd /sys/kernel/config/usb_gadget
-rm -rf mygadget
-mkdir -p mygadget
-cd mygadget
-echo 0x046d > idVendor
-echo 0xc077 > idProduct
-mkdir -p strings/0x409
-echo "RPI Mouse" > strings/0x409/product
-mkdir -p configs/c.1/strings/0x409
-mkdir -p functions/hid.usb0
-echo 2 > functions/hid.usb0/protocol
-echo 1 > functions/hid.usb0/subclass
-echo 8 > functions/hid.usb0/report_length
-echo -ne \\\\x05\\\\x01\\\\x09\\\\x02\\\\xa1\\\\x01\\\\x09\\\\x01\\\\xa1\\\\x00\\\\x05\\\\x09\\\\x19\\\\x01\\\\x29\\\\x03\\\\x15\\\\x00\\\\x25\\\\x01\\\\x95\\\\x03\\\\x75\\\\x01\\\\x81\\\\x02\\\\x95\\\\x01\\\\x75\\\\x05\\\\x81\\\\x03\\\\x05\\\\x01\\\\x09\\\\x30\\\\x09\\\\x31\\\\x15\\\\x81\\\\x25\\\\x7f\\\\x75\\\\x08\\\\x95\\\\x02\\\\x81\\\\x06\\\\xc0\\\\xc0 > functions/hid.usb0/report_desc
-ln -s functions/hid.usb0 configs/c.1/
-if [ -e /sys/class/udc/fe980000.usb ]; then
-    echo fe980000.usb > UDC
-else
-    ls /sys/class/udc | head -n1 > UDC
-fi
-"""
+# Pointer mode for the gadget:
+#   "relative" - boot mouse sending signed 8-bit deltas (needs homing and chunked moves)
+#   "absolute" - tablet-style pointer sending screen coordinates, one report per target
+# Keep "relative" for DVR firmware that ignores absolute pointing devices.
+HID_MODE = "relative"
+
+# Report descriptors for the two modes: 3 buttons + 5 bits padding, then X/Y.
+# Relative: X/Y are signed 8-bit deltas (-127..127)
+RELATIVE_REPORT_DESC = bytes([
+    0x05, 0x01, 0x09, 0x02, 0xa1, 0x01, 0x09, 0x01, 0xa1, 0x00,
+    0x05, 0x09, 0x19, 0x01, 0x29, 0x03, 0x15, 0x00, 0x25, 0x01,
+    0x95, 0x03, 0x75, 0x01, 0x81, 0x02, 0x95, 0x01, 0x75, 0x05, 0x81, 0x03,
+    0x05, 0x01, 0x09, 0x30, 0x09, 0x31, 0x15, 0x81, 0x25, 0x7f,
+    0x75, 0x08, 0x95, 0x02, 0x81, 0x06, 0xc0, 0xc0,
+])
+# Absolute: X/Y are 16-bit little-endian positions scaled to 0..ABSOLUTE_MAX
+ABSOLUTE_MAX = 32767
+ABSOLUTE_REPORT_DESC = bytes([
+    0x05, 0x01, 0x09, 0x02, 0xa1, 0x01, 0x09, 0x01, 0xa1, 0x00,
+    0x05, 0x09, 0x19, 0x01, 0x29, 0x03, 0x15, 0x00, 0x25, 0x01,
+    0x95, 0x03, 0x75, 0x01, 0x81, 0x02, 0x95, 0x01, 0x75, 0x05, 0x81, 0x03,
+    0x05, 0x01, 0x09, 0x30, 0x09, 0x31, 0x15, 0x00, 0x26, 0xff, 0x7f,
+    0x75, 0x10, 0x95, 0x02, 0x81, 0x02, 0xc0, 0xc0,
+])
+
+def gadget_hid_settings():
+    # (protocol, subclass, report descriptor) for the configured mode.
+    # Absolute pointers can't use the boot interface, so protocol/subclass are 0.
+    if HID_MODE == "absolute":
+        return 0, 0, ABSOLUTE_REPORT_DESC
+    return 2, 1, RELATIVE_REPORT_DESC
+
+# Composite gadget: add a boot keyboard on a second HID function (/dev/hidg1)
+# so menus can be driven with key chords as well as the mouse
+KEYBOARD_ENABLED = False
+KEYBOARD_DEVICE_PATH = "/dev/hidg1"
+
+# Standard boot keyboard: modifier byte, reserved byte, LED output, 6 key slots
+KEYBOARD_REPORT_DESC = bytes([
+    0x05, 0x01, 0x09, 0x06, 0xa1, 0x01, 0x05, 0x07, 0x19, 0xe0, 0x29, 0xe7,
+    0x15, 0x00, 0x25, 0x01, 0x75, 0x01, 0x95, 0x08, 0x81, 0x02,
+    0x95, 0x01, 0x75, 0x08, 0x81, 0x03,
+    0x95, 0x05, 0x75, 0x01, 0x05, 0x08, 0x19, 0x01, 0x29, 0x05, 0x91, 0x02,
+    0x95, 0x01, 0x75, 0x03, 0x91, 0x03,
+    0x95, 0x06, 0x75, 0x08, 0x15, 0x00, 0x25, 0x65, 0x05, 0x07,
+    0x19, 0x00, 0x29, 0x65, 0x81, 0x00, 0xc0,
+])
+
+# Host polling interval for the HID endpoint. f_hid advertises 1ms on
+# high-speed links; raise to 0.010 if the DVR only enumerates at full speed.
+HID_POLL_INTERVAL = 0.001
+
+# Delays between reports (in seconds). These are the conservative values; a model
+# profile tuned with --tune replaces them for that DVR (see sequence_timing)
+CLICK_PRESS_DELAY = 0.003  # RS crucial: very short delay between press and release (3-5ms)
+MOVE_STEP_DELAY = 0.01     # Small delay between movements for stability
+
+# Errors that mean the gadget was unbound or the host went away; the fd is
+# stale after these and must be reopened
+HID_RECONNECT_ERRORS = (errno.EPIPE, errno.ESHUTDOWN, errno.ENODEV, errno.EIO, errno.EBADF, errno.ENOENT,
+                        errno.ENXIO, errno.ECONNREFUSED, errno.ECONNRESET, errno.ENOTCONN)
+
+def is_virtual_device(path):
+    # Socket or FIFO stand-in for /dev/hidgN - there's no gadget behind it
+    if path.startswith("unix:"):
+        return True
+    try:
+        return stat.S_ISFIFO(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+class DeadlineExceeded(Exception):
+    """Raised when work runs out of its share of the shutdown budget or is cancelled"""
+
+class LinkDown(OSError):
+    """The DVR deconfigured the gadget while a report was waiting to be collected"""
+
+class Deadline:
+    """A point in time work must finish by. The sequence creates one and hands
+    children down to each step, move and report write, so every wait and retry
+    can see how much of the budget is left."""
+
+    def __init__(self, seconds=None, parent=None):
+        expires = time.monotonic() + seconds if seconds is not None else float("inf")
+        if parent is not None:
+            expires = min(expires, parent.expires)
+        self.expires = expires
+        # Cancelling any deadline cancels the whole tree it belongs to
+        self.cancelled = parent.cancelled if parent is not None else threading.Event()
+
+    def child(self, seconds):
+        return Deadline(seconds, self)
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def check(self, what="Operation"):
+        if self.cancelled.is_set():
+            raise DeadlineExceeded(f"{what} cancelled")
+        if time.monotonic() >= self.expires:
+            raise DeadlineExceeded(f"{what} ran out of time")
+
+    def sleep(self, seconds, what="Wait"):
+        # Don't start a wait that can't finish in time
+        self.check(what)
+        if seconds > self.remaining():
+            raise DeadlineExceeded(f"{what} ({seconds:.2f}s) doesn't fit in the {self.remaining():.2f}s left")
+        if seconds > 0 and self.cancelled.wait(seconds):
+            raise DeadlineExceeded(f"{what} cancelled")
+
+class HidDevice:
+    """Keeps a HID gadget device open for the whole run and writes queued
+    reports on a single pacing clock tied to the host's polling interval."""
+
+    def __init__(self, path, interval=HID_POLL_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.fd = None
+        self.sock = None   # Set when writing to a "unix:" virtual sink
+        self.pending = []  # (gap, report) pairs waiting to be written
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.reports_sent = 0
+        self.first_write = None
+        self.last_write = None
+        self.next_due = 0.0
+
+    def open(self):
+        if self.fd is None:
+            if self.path.startswith("unix:"):
+                # Seqpacket keeps report boundaries, like the gadget's char device
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+                try:
+                    self.sock.connect(self.path[len("unix:"):])
+                except OSError:
+                    self.sock.close()
+                    self.sock = None
+                    raise
+                self.sock.setblocking(False)
+                self.fd = self.sock.fileno()
+            else:
+                # Non-blocking so a host that stops polling can't hang a write forever
+                self.fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+        return self.fd
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            self.fd = None
+        elif self.fd is not None:
+            try:
+                os.close(self.fd)
+            except OSError:
+                pass
+            self.fd = None
+
+    def queue(self, report, gap=0.0):
+        # gap is the minimum time since the previous report, on top of the
+        # polling interval that is always honoured
+        self.pending.append((gap, report))
+
+    def queue_reports(self, reports):
+        self.pending.extend(reports)
+
+    def write(self, report, gap=0.0, retries=MAX_RETRIES, timeout=DEFAULT_OPERATION_TIMEOUT, deadline=None):
+        self.queue(report, gap)
+        return self.flush(retries, timeout, deadline)
+
+    def flush(self, retries=MAX_RETRIES, timeout=DEFAULT_OPERATION_TIMEOUT, deadline=None):
+        """Write the queued reports. Returns False when a report can't be delivered;
+        raises DeadlineExceeded when the caller's deadline runs out first."""
+        pending, self.pending = self.pending, []
+        deadline = deadline or Deadline()
+
+        for gap, report in pending:
+            if not self._write_paced(report, gap, retries, timeout, deadline):
+                return False
+        return True
+
+    def _write_paced(self, report, gap, retries, timeout, deadline):
+        # Wait for this report's slot on the pacing clock
+        due = self.next_due
+        if self.last_write is not None:
+            due = max(due, self.last_write + gap)
+        deadline.sleep(due - time.monotonic(), "HID pacing")
+
+        retry_count = 0
+        start_time = time.monotonic()
+
+        while True:
+            try:
+                if not link_watchdog.configured():
+                    raise LinkDown(errno.ESHUTDOWN, f"USB link is {link_watchdog.state}")
+                self._write_report(report, min(start_time + timeout, deadline.expires))
+                break
+            except OSError as e:
+                if e.errno in HID_RECONNECT_ERRORS:
+                    # Host disconnected or gadget rebound - reopen on the next attempt
+                    self.close()
+                    link_watchdog.refresh()
+
+                if not link_watchdog.configured():
+                    # Hold output while the DVR has the link down. The host forgets the pointer
+                    # state when it re-enumerates, so the rest of this move is dropped rather
+                    # than sent blind - the caller replays it from a known position.
+                    log_message(f"{e}, pausing HID output", "warning")
+                    with metrics.timed("link_pause") as timer:
+                        timer.ok = link_watchdog.wait_configured(deadline)
+                    if timer.ok:
+                        log_message("USB link is back, dropping the interrupted reports", "warning")
+                    else:
+                        log_message(f"USB link not back within {LINK_WAIT_TIMEOUT} seconds", "error")
+                    return False
+
+                retry_count += 1
+                log_message(f"Error writing to HID device (attempt {retry_count}/{retries}): {e}", "warning")
+
+                if retry_count >= retries:
+                    log_message(f"Failed to send mouse event after {retries} attempts", "error")
+                    return False
+
+                # Exponential backoff for retries, only while the budget allows it
+                backoff_time = min(0.5 * (2 ** retry_count), 5)  # Cap at 5 seconds
+                if backoff_time >= deadline.remaining():
+                    raise DeadlineExceeded(f"No time left to retry HID write ({deadline.remaining():.2f}s left)")
+                if time.monotonic() - start_time + backoff_time > timeout:
+                    log_message(f"Operation timed out after {timeout} seconds", "error")
+                    return False
+
+                log_message(f"Retrying in {backoff_time:.2f} seconds...", "info")
+                metrics.record_retry("hid_write", backoff_time)
+                deadline.sleep(backoff_time, "HID retry backoff")
+
+        now = time.monotonic()
+        if metrics.first_report is None:
+            metrics.first_report = now
+        if self.first_write is None:
+            self.first_write = now
+        self.last_write = now
+        self.next_due = now + self.interval
+        self.reports_sent += 1
+        return True
+
+    def _write_report(self, report, limit):
+        # f_hid returns EAGAIN while the host hasn't collected the previous
+        # report; wait for POLLOUT until the limit instead of blocking forever
+        fd = self.open()
+        started = time.monotonic()
+        while True:
+            try:
+                os.write(fd, report)
+                metrics.observe_write(time.monotonic() - started)
+                return
+            except BlockingIOError:
+                poller = select.poll()
+                poller.register(fd, select.POLLOUT)
+                while True:
+                    remaining = limit - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("host is not collecting HID reports")
+                    if not link_watchdog.configured():
+                        raise LinkDown(errno.ESHUTDOWN, f"USB link went {link_watchdog.state}")
+                    # Short slices while a watchdog runs, so a dropped link ends the wait at once
+                    slice_time = remaining if link_watchdog.state is None else min(remaining, LINK_CHECK_INTERVAL)
+                    if poller.poll(slice_time * 1000):
+                        break
+
+    def reports_per_second(self):
+        if self.reports_sent < 2 or self.last_write == self.first_write:
+            return 0.0
+        return (self.reports_sent - 1) / (self.last_write - self.first_write)
+
+# Shared writers for the mouse and keyboard functions, opened on first use
+hid = HidDevice(DEVICE_PATH)
+keyboard = HidDevice(KEYBOARD_DEVICE_PATH)
+
+# configfs locations for the gadget
+CONFIGFS_GADGETS = "/sys/kernel/config/usb_gadget"
+SINGLE_GADGET_NAME = "mygadget"  # The single-DVR gadget, also the one create-gadget.sh builds
+GADGET_PATH = os.path.join(CONFIGFS_GADGETS, SINGLE_GADGET_NAME)
+UDC_CLASS_PATH = "/sys/class/udc"
+PREFERRED_UDC = "fe980000.usb"  # Pi 4 / Zero 2 OTG controller
+UDC_FALLBACK = True  # Bind to the first UDC when PREFERRED_UDC is missing
+
+DEVICE_WAIT_TIMEOUT = 5  # Deadline for /dev/hidgN to appear after binding
+
+# inotify flags (linux/inotify.h)
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+def gadget_layout():
+    """Attribute values the gadget should have, in the order they must be written"""
+    protocol, subclass, report_desc = gadget_hid_settings()
+    layout = [
+        ("idVendor", "0x046d"),
+        ("idProduct", "0xc077"),
+        ("strings/0x409/product", "USB HID Mouse"),  # same identity as create-gadget.sh
+        ("functions/hid.usb0/protocol", str(protocol)),
+        ("functions/hid.usb0/subclass", str(subclass)),
+        ("functions/hid.usb0/report_length", "8"),
+        ("functions/hid.usb0/report_desc", report_desc),
+    ]
+    if KEYBOARD_ENABLED:
+        # Second function for the keyboard (hidg1) when running as a composite gadget
+        layout += [
+            ("functions/hid.usb1/protocol", "1"),
+            ("functions/hid.usb1/subclass", "1"),
+            ("functions/hid.usb1/report_length", "8"),
+            ("functions/hid.usb1/report_desc", KEYBOARD_REPORT_DESC),
+        ]
+    return layout
+
+def gadget_functions():
+    return ["hid.usb0", "hid.usb1"] if KEYBOARD_ENABLED else ["hid.usb0"]
+
+def gadget_device_paths():
+    return [DEVICE_PATH, KEYBOARD_DEVICE_PATH] if KEYBOARD_ENABLED else [DEVICE_PATH]
+
+def gadget_nodes():
+    """The /dev nodes of this gadget's HID functions, in gadget_functions() order, found
+    by the major:minor f_hid gave each function - the hidgN numbers follow the order
+    functions are created in across every gadget. None where a node isn't there (yet)."""
+    try:
+        candidates = gadget_device_paths() + sorted(os.path.join("/dev", name) for name in os.listdir("/dev")
+                                                    if name.startswith("hidg"))
+    except OSError:
+        candidates = gadget_device_paths()
+    
+    nodes = []
+    for function in gadget_functions():
+        try:
+            major, minor = read_attr(f"functions/{function}/dev").decode().strip().split(":")
+            rdev = os.makedev(int(major), int(minor))
+        except (OSError, ValueError):
+            nodes.append(None)
+            continue
+        node = None
+        for path in candidates:
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            if stat.S_ISCHR(info.st_mode) and info.st_rdev == rdev:
+                node = path
+                break
+        nodes.append(node)
+    return nodes
+
+def use_gadget_nodes():
+    """Point the HID writers at the nodes this gadget really has, which with several
+    gadgets need not be the configured paths. False until every node exists."""
+    global DEVICE_PATH, KEYBOARD_DEVICE_PATH
     
+    nodes = gadget_nodes()
+    if None in nodes:
+        return False
+    for device, setting, node in zip((hid, keyboard), ("DEVICE_PATH", "KEYBOARD_DEVICE_PATH"), nodes):
+        if device.path != node:
+            log_message(f"{setting} {device.path} is not this gadget's node, using {node}", "warning")
+            device.close()
+            device.path = node
+    DEVICE_PATH = hid.path
+    if len(nodes) > 1:
+        KEYBOARD_DEVICE_PATH = keyboard.path
+    return True
+
+def udc_holder(udc):
+    """Path of the gadget bound to a UDC, or None"""
+    for name in os.listdir(CONFIGFS_GADGETS):
+        try:
+            with open(os.path.join(CONFIGFS_GADGETS, name, "UDC")) as f:
+                if f.read().strip() == udc:
+                    return os.path.join(CONFIGFS_GADGETS, name)
+        except OSError:
+            continue
+    return None
+
+def read_attr(name):
+    with open(os.path.join(GADGET_PATH, name), "rb") as f:
+        return f.read()
+
+def write_attr(name, value):
+    with open(os.path.join(GADGET_PATH, name), "wb") as f:
+        f.write(value if isinstance(value, bytes) else value.encode())
+
+def find_udc():
+    udcs = sorted(os.listdir(UDC_CLASS_PATH)) if os.path.isdir(UDC_CLASS_PATH) else []
+    if PREFERRED_UDC in udcs:
+        return PREFERRED_UDC
+    return udcs[0] if udcs and UDC_FALLBACK else None
+
+def gadget_matches():
+    """True when the bound gadget already has the layout we want"""
     try:
-        # Write script to file
-        with open("/tmp/reset_mouse.sh", "w") as f:
-            f.write(reset_script)
+        for name, value in gadget_layout():
+            if name.startswith("strings/"):
+                # Only what the DVR's HID driver depends on counts; a gadget from
+                # create-gadget.sh or an older release may be labelled differently
+                continue
+            current = read_attr(name)
+            if isinstance(value, bytes):
+                if current != value:
+                    return False
+            elif current.decode().strip().lower() != value.lower():
+                return False
         
-        # Make executable and run
-        os.system("chmod +x /tmp/reset_mouse.sh")
-        result = os.system("sudo /tmp/reset_mouse.sh")
+        # Every function linked into the configuration, and nothing else
+        links = sorted(entry for entry in os.listdir(os.path.join(GADGET_PATH, "configs/c.1"))
+                       if os.path.islink(os.path.join(GADGET_PATH, "configs/c.1", entry)))
+        if links != sorted(gadget_functions()):
+            return False
         
-        if result != 0:
-            log_message("Error: Failed to reset USB gadget", "error")
+        udc = read_attr("UDC").decode().strip()
+        if not udc or not os.path.exists(os.path.join(UDC_CLASS_PATH, udc)):
             return False
+    except OSError:
+        return False
+    
+    return None not in gadget_nodes()
+
+def teardown_gadget():
+    if not os.path.isdir(GADGET_PATH):
+        return
+    
+    # First unbind from UDC (fails harmlessly if already unbound)
+    try:
+        write_attr("UDC", "\n")
+    except OSError:
+        pass
+    
+    # configfs wants things removed in reverse order of creation
+    config_path = os.path.join(GADGET_PATH, "configs/c.1")
+    if os.path.isdir(config_path):
+        for entry in os.listdir(config_path):
+            if os.path.islink(os.path.join(config_path, entry)):
+                os.unlink(os.path.join(config_path, entry))
+    
+    for directory in ["configs/c.1/strings/0x409", "configs/c.1"]:
+        if os.path.isdir(os.path.join(GADGET_PATH, directory)):
+            os.rmdir(os.path.join(GADGET_PATH, directory))
+    
+    functions_path = os.path.join(GADGET_PATH, "functions")
+    for function in os.listdir(functions_path):
+        os.rmdir(os.path.join(functions_path, function))
+    
+    if os.path.isdir(os.path.join(GADGET_PATH, "strings/0x409")):
+        os.rmdir(os.path.join(GADGET_PATH, "strings/0x409"))
+    os.rmdir(GADGET_PATH)
+
+def build_gadget():
+    os.makedirs(os.path.join(GADGET_PATH, "strings/0x409"), exist_ok=True)
+    os.makedirs(os.path.join(GADGET_PATH, "configs/c.1/strings/0x409"), exist_ok=True)
+    for function in gadget_functions():
+        os.makedirs(os.path.join(GADGET_PATH, "functions", function), exist_ok=True)
+    
+    for name, value in gadget_layout():
+        write_attr(name, value)
+    
+    for function in gadget_functions():
+        os.symlink(os.path.join(GADGET_PATH, "functions", function),
+                   os.path.join(GADGET_PATH, "configs/c.1", function))
+    
+    udc = find_udc()
+    if udc is None:
+        raise RuntimeError("No UDC device found. Make sure the USB controller is enabled.")
+    
+    # A UDC takes one gadget. With DVR_UNITS the single-DVR gadget (left by create-gadget.sh
+    # or an earlier single-DVR run) is stale and gives its UDC up; anything else is a conflict.
+    holder = udc_holder(udc)
+    if holder is not None and holder != GADGET_PATH:
+        if os.path.basename(holder) != SINGLE_GADGET_NAME or os.path.basename(GADGET_PATH) == SINGLE_GADGET_NAME:
+            raise RuntimeError(f"UDC {udc} is already bound to gadget {holder}")
+        log_message(f"Unbinding {holder} from UDC {udc} for this DVR's gadget", "warning")
+        with open(os.path.join(holder, "UDC"), "w") as f:
+            f.write("\n")
+    try:
+        write_attr("UDC", udc)
+    except OSError as e:
+        if e.errno == errno.EBUSY:
+            raise RuntimeError(f"UDC {udc} is busy - bound to another gadget ({udc_holder(udc) or 'unknown'})")
+        raise
+
+def wait_for_device(paths, timeout=DEVICE_WAIT_TIMEOUT, ready=None):
+    """Wait until every path exists - or until ready() is true - woken by inotify on the
+    paths' parent directories. Falls back to short polling where inotify isn't available."""
+    deadline = time.monotonic() + timeout
+    inotify_fd = -1
+    
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        inotify_fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        for directory in set(os.path.dirname(path) for path in paths):
+            libc.inotify_add_watch(inotify_fd, directory.encode(), IN_CREATE | IN_ATTRIB | IN_MOVED_TO)
+    except (OSError, AttributeError):
+        inotify_fd = -1
+    
+    try:
+        poller = select.poll()
+        if inotify_fd >= 0:
+            poller.register(inotify_fd, select.POLLIN)
         
-        # Wait for device
-        time.sleep(2)
+        while True:
+            # Check after the watches are in place so no creation is missed
+            if ready() if ready else all(os.path.exists(path) for path in paths):
+                return True
+            
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            
+            if inotify_fd >= 0:
+                # Wake on events, but re-check now and then in case one was missed
+                if poller.poll(min(remaining, 0.5) * 1000):
+                    try:
+                        os.read(inotify_fd, 4096)
+                    except BlockingIOError:
+                        pass
+            else:
+                time.sleep(min(remaining, 0.01))
+    finally:
+        if inotify_fd >= 0:
+            os.close(inotify_fd)
+
+# USB link watchdog: the UDC's "state" attribute is sysfs_notify()'d on every change,
+# so poll() wakes the moment the DVR deconfigures or re-enumerates the gadget
+LINK_CONFIGURED = "configured"
+LINK_WAIT_TIMEOUT = 5  # How long paused HID output waits for the link to come back
+LINK_CHECK_INTERVAL = 0.005  # Link re-check interval while a write waits for the host
+LINK_POLL_INTERVAL = 1.0  # Re-read interval in case a notification is missed
+NETLINK_KOBJECT_UEVENT = 15
+
+class LinkWatchdog:
+    """Follows the state of the UDC the gadget is bound to on a background thread.
+    HID output pauses while the link isn't configured; the sequence runner reads
+    state and drops to decide when to retry and whether the cursor is still known."""
+
+    def __init__(self):
+        self.udc = None
+        self.state = None  # None while not watching - output is never held then
+        self.drops = 0     # Times the link left "configured"
+        self.changed = threading.Condition()
+        self.thread = None
+        self.wake_r = self.wake_w = None
+
+    def start(self):
+        udc = self.bound_udc()
+        if udc is None:
+            return False
+        with self.changed:
+            if self.thread is not None and udc == self.udc:
+                return True
+            self.udc = udc
+        self.refresh()
+        if self.thread is None:
+            self.wake_r, self.wake_w = os.pipe()
+            self.thread = threading.Thread(target=self.run, name="link-watchdog", daemon=True)
+            self.thread.start()
+        else:
+            # Rebound to another UDC - have the thread watch the new state file
+            os.write(self.wake_w, b"\n")
+        return True
+
+    def bound_udc(self):
+        try:
+            return read_attr("UDC").decode().strip() or None
+        except OSError:
+            return None
+
+    def configured(self):
+        return self.state is None or self.state == LINK_CONFIGURED
+
+    def refresh(self):
+        # Read the state right now - used when a write fails before the notification lands
+        try:
+            with open(os.path.join(UDC_CLASS_PATH, self.udc, "state")) as f:
+                self.set_state(f.read().strip())
+        except (OSError, TypeError):
+            pass
+
+    def set_state(self, state):
+        with self.changed:
+            if state == self.state:
+                return
+            previous, self.state = self.state, state
+            if previous == LINK_CONFIGURED:
+                self.drops += 1
+            self.changed.notify_all()
+        metrics.record_link(state)
+        if previous is not None:
+            log_message(f"USB link on {self.udc}: {previous} -> {state}",
+                        "info" if state == LINK_CONFIGURED else "warning")
+
+    def wait_configured(self, deadline, timeout=None):
+        """Block until the link is configured again. False when it isn't within timeout
+        (LINK_WAIT_TIMEOUT by default)."""
+        give_up = min(time.monotonic() + (timeout or LINK_WAIT_TIMEOUT), deadline.expires)
+        with self.changed:
+            while not self.configured():
+                deadline.check("Waiting for the USB link")
+                left = give_up - time.monotonic()
+                if left <= 0:
+                    return False
+                # Short waits so a cancelled deadline is noticed
+                self.changed.wait(min(left, 0.1))
+        return True
+
+    def run(self):
+        try:
+            # Gadget bind/unbind shows up as a uevent on the udc subsystem
+            uevents = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            uevents.bind((0, 1))
+        except (OSError, AttributeError):
+            uevents = None
+        
+        while True:
+            udc = self.udc
+            try:
+                fd = os.open(os.path.join(UDC_CLASS_PATH, udc, "state"), os.O_RDONLY)
+            except OSError:
+                fd = None
+            poller = select.poll()
+            poller.register(self.wake_r, select.POLLIN)
+            if fd is not None:
+                poller.register(fd, select.POLLPRI | select.POLLERR)
+            if uevents is not None:
+                poller.register(uevents, select.POLLIN)
+            
+            try:
+                while udc == self.udc:
+                    if fd is not None:
+                        # sysfs only notifies again once the attribute has been read
+                        os.lseek(fd, 0, os.SEEK_SET)
+                        self.set_state(os.read(fd, 64).decode(errors="replace").strip())
+                    else:
+                        self.set_state("not attached")
+                    
+                    for ready, _ in poller.poll(LINK_POLL_INTERVAL * 1000):
+                        if ready == self.wake_r:
+                            os.read(self.wake_r, 64)
+                        elif uevents is not None and ready == uevents.fileno():
+                            if b"SUBSYSTEM=udc" in uevents.recv(8192):
+                                self.udc = self.bound_udc() or self.udc
+            except OSError as e:
+                log_message(f"USB link watchdog error: {e}", "warning")
+                time.sleep(LINK_POLL_INTERVAL)
+            finally:
+                if fd is not None:
+                    os.close(fd)
+
+link_watchdog = LinkWatchdog()
+
+def reset_gadget(force=False, deadline=None):
+    with metrics.timed("reset_gadget") as timer:
+        timer.ok = setup_gadget(force, deadline)
+    return timer.ok
+
+def setup_gadget(force=False, deadline=None):
+    if is_virtual_device(DEVICE_PATH):
+        log_message(f"Using virtual HID sink {DEVICE_PATH}, no USB gadget to manage")
+        return True
+    
+    # Leave a correctly bound gadget alone unless a rebuild is forced
+    if not force and gadget_matches() and use_gadget_nodes():
+        log_message(f"USB gadget already configured ({HID_MODE} pointer), skipping rebuild")
+        link_watchdog.start()
+        return True
+    
+    log_message(f"Resetting USB gadget ({HID_MODE} pointer)...")
+    
+    # The device nodes are recreated by the reset, so drop the stale fds
+    hid.close()
+    keyboard.close()
+    
+    try:
+        if not os.path.isdir(CONFIGFS_GADGETS):
+            import subprocess
+            subprocess.run(["modprobe", "libcomposite"], check=False, timeout=DEFAULT_OPERATION_TIMEOUT)
         
-        if not os.path.exists(DEVICE_PATH):
+        teardown_gadget()
+        build_gadget()
+        
+        # Wait for device
+        timeout = min(DEVICE_WAIT_TIMEOUT, deadline.remaining()) if deadline else DEVICE_WAIT_TIMEOUT
+        if not wait_for_device(gadget_device_paths(), timeout, ready=use_gadget_nodes):
             log_message("Error: HID device not found after reset", "error")
             return False
         
@@ -158,366 +1244,2194 @@ fi
         # Position will be reset in ensure_known_position()
         
         log_message("USB gadget hardware reset complete")
+        link_watchdog.start()
         return True
         
     except Exception as e:
         log_message(f"Error during gadget reset: {e}", "error")
         return False
 
-def ensure_known_position():
-    global current_x, current_y
+def plan_homing():
+    if HID_MODE == "absolute":
+        # Absolute reports carry the position, there is no edge to home against
+        return []
+    
+    # edge of the screen where the cursor will stop
+    # Multiple moves to ensure we reach the edge - maximum left and up
+    gap = sequence_timing()["move_step"]
+    return [(gap, make_mouse_report(0, -127, -127)) for _ in range(20)]
+
+def ensure_known_position(deadline=None):
+    if HID_MODE == "absolute":
+        # One report puts the pointer exactly where we want it
+        log_message("Placing absolute pointer at screen center...")
+        reports, _ = plan_move(0, 0, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2)
+        hid.queue_reports(reports)
+        with metrics.timed("homing") as timer:
+            timer.ok = hid.flush(deadline=deadline)
+        if not timer.ok:
+            log_message("Failed to place absolute pointer", "error")
+            return False
+        
+        track_cursor(reports)
+        log_message(f"Cursor position set to ({current_x}, {current_y})")
+        return True
     
     log_message("Resetting cursor position to known coordinates...")
     
-    # edge of the screen where the cursor will stop
-    for _ in range(20):  # Multiple moves to ensure we reach the edge
-        send_mouse_event(0, -127, -127)  # Move maximum left and up
-        time.sleep(0.01)
+    reports = plan_homing()
+    hid.queue_reports(reports)
+    with metrics.timed("homing") as timer:
+        timer.ok = hid.flush(deadline=deadline)
+    if not timer.ok:
+        log_message("Failed to drive cursor to the corner", "error")
+        forget_cursor()
+        return False
     
     # Now we know we're at (0,0) - the top-left corner
-    current_x = 0
-    current_y = 0
+    forget_cursor()
+    track_cursor(reports)
     
-    log_message("Cursor position reset to top-left (0,0)")
+    log_message(f"Cursor position reset to top-left ({current_x},{current_y})")
     return True
 
-def send_mouse_event(button=0, x=0, y=0, retries=MAX_RETRIES, timeout=DEFAULT_OPERATION_TIMEOUT):
+def make_mouse_report(button=0, x=0, y=0):
     # Format report - 3 bytes: button, x, y
 	# RS: took fiddling to find right combo
-    report = bytes([button & 0xFF, x & 0xFF, y & 0xFF])
+    return bytes([button & 0xFF, x & 0xFF, y & 0xFF])
+
+def make_absolute_report(button, x, y):
+    # Format report - 5 bytes: button, x (16-bit LE), y (16-bit LE) scaled to the logical range
+    ax = min(ABSOLUTE_MAX, x * ABSOLUTE_MAX // SCREEN_WIDTH)
+    ay = min(ABSOLUTE_MAX, y * ABSOLUTE_MAX // SCREEN_HEIGHT)
+    return bytes([button & 0xFF, ax & 0xFF, ax >> 8, ay & 0xFF, ay >> 8])
+
+def clamp_position(x, y):
+    # Ensure within bounds
+    return max(0, min(x, SCREEN_WIDTH)), max(0, min(y, SCREEN_HEIGHT))
+
+# Position model: how far the real cursor may be from (current_x, current_y) on each
+# axis. None means anywhere on screen - nothing sent yet, or another mouse, a dropped
+# link or an interrupted move may have put it somewhere else.
+cursor_error = None
+cursor_updated = 0.0  # time.time() of the last report the model accounts for
+CLICK_TOLERANCE = 6  # Pixels a click may land off its target, unless the step sets its own
+CALIBRATED_MOVE_ERROR = 1.0  # Pixels a calibrated move may land off the fitted curve's prediction
+CURSOR_STATE_DIR = "/run/dvr-automator"  # Model kept between runs (tmpfs - gone after a reboot)
+CURSOR_TRUST_SECONDS = 300  # Older saved state is ignored: someone may have used the DVR since
+# A one-shot run can't know what other mice did to the pointer since the last run, so it
+# homes from an unknown position; only the daemon picks saved state up. Set this when
+# the gadget is the DVR's only pointer and a one-shot run may trust the saved state too.
+SOLE_POINTER = False
+daemon_mode = False  # Set by ShutdownDaemon - this process (or its parent) stays resident
+
+def forget_cursor():
+    global cursor_error
+    cursor_error = None
+
+def track_cursor(reports, last_uncertain=False):
+    """Update the position model for mouse reports the host has collected. Each axis
+    is tracked as an interval that moves with the reports and is clipped at the
+    screen edges, so pushing into an edge pins that axis exactly. With
+    last_uncertain the final report may or may not have arrived."""
+    global current_x, current_y, cursor_error, cursor_updated
     
-    retry_count = 0
-    start_time = time.time()
+    if cursor_error is None:
+        spans = [[0.0, SCREEN_WIDTH], [0.0, SCREEN_HEIGHT]]
+    else:
+        spans = [[current_x - cursor_error[0], current_x + cursor_error[0]],
+                 [current_y - cursor_error[1], current_y + cursor_error[1]]]
+    curve = acceleration_curve()
+    moved = False
+    
+    for index, (_, report) in enumerate(reports):
+        if len(report) == 5:
+            # Absolute report - the position itself
+            x = (report[1] | report[2] << 8) * SCREEN_WIDTH / ABSOLUTE_MAX
+            y = (report[3] | report[4] << 8) * SCREEN_HEIGHT / ABSOLUTE_MAX
+            spans = [[x, x], [y, y]]
+            continue
+        
+        dx = report[1] - 256 if report[1] > 127 else report[1]
+        dy = report[2] - 256 if report[2] > 127 else report[2]
+        if dx == 0 and dy == 0:
+            continue
+        moved = True
+        gain = report_gain(curve, (dx * dx + dy * dy) ** 0.5) if curve else 1.0
+        for span, delta, limit in ((spans[0], dx * gain, SCREEN_WIDTH), (spans[1], dy * gain, SCREEN_HEIGHT)):
+            low, high = max(0.0, min(span[0] + delta, limit)), max(0.0, min(span[1] + delta, limit))
+            if last_uncertain and index == len(reports) - 1:
+                low, high = min(low, span[0]), max(high, span[1])
+            span[:] = [low, high]
+    
+    if moved and curve:
+        # Calibrated moves are only predicted to within CALIBRATED_MOVE_ERROR
+        spans = [[max(0.0, low - CALIBRATED_MOVE_ERROR), min(high + CALIBRATED_MOVE_ERROR, limit)]
+                 for (low, high), limit in zip(spans, (SCREEN_WIDTH, SCREEN_HEIGHT))]
+    
+    current_x, current_y = (round((low + high) / 2) for low, high in spans)
+    cursor_error = [max(high - center, center - low) for (low, high), center in zip(spans, (current_x, current_y))]
+    cursor_updated = time.time()
+
+def cursor_trusted():
+    return cursor_error is not None and time.time() - cursor_updated <= CURSOR_TRUST_SECONDS
+
+def cursor_within(tolerance):
+    """Whether the model is tight enough for a click with this per-axis tolerance"""
+    if not cursor_trusted():
+        return False
+    return all(error <= limit for error, limit in zip(cursor_error, tolerance))
+
+def cursor_state_path():
+    # One model per HID device, so DVR_UNITS processes don't share one
+    return os.path.join(CURSOR_STATE_DIR, f"cursor-{os.path.basename(DEVICE_PATH)}.json")
+
+def save_cursor_state():
+    state = {"x": current_x, "y": current_y, "error": cursor_error, "updated": cursor_updated,
+             "screen": [SCREEN_WIDTH, SCREEN_HEIGHT], "hid_mode": HID_MODE, "model": DVR_MODEL}
+    try:
+        os.makedirs(CURSOR_STATE_DIR, exist_ok=True)
+        tmp_path = cursor_state_path() + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, cursor_state_path())
+    except OSError as e:
+        logging.warning(f"Could not save cursor state: {e}")
+
+def load_cursor_state():
+    """Pick up the position model a previous run (or trigger) left, when it still applies"""
+    global current_x, current_y, cursor_error, cursor_updated
+    
+    try:
+        with open(cursor_state_path()) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError) as e:
+        log_message(f"Ignoring unreadable cursor state {cursor_state_path()}: {e}", "warning")
+        return False
+    
+    if (state.get("error") is None or state.get("screen") != [SCREEN_WIDTH, SCREEN_HEIGHT]
+            or state.get("hid_mode") != HID_MODE or state.get("model") != DVR_MODEL
+            or time.time() - state.get("updated", 0) > CURSOR_TRUST_SECONDS):
+        return False
+    current_x, current_y = state["x"], state["y"]
+    cursor_error, cursor_updated = state["error"], state["updated"]
+    log_message(f"Cursor at ({current_x}, {current_y}) +/-({cursor_error[0]:.0f}, {cursor_error[1]:.0f}) "
+                f"as of {time.time() - cursor_updated:.0f} seconds ago")
+    return True
+
+def plan_partial_homing(tolerance):
+    """Reports that push each axis the model can't place within tolerance into its
+    nearest edge - just far enough to be sure it is pinned there"""
+    curve = acceleration_curve()
+    per_report = 127 * (report_gain(curve, 127 * 2 ** 0.5) if curve else 1.0)
+    
+    pushes = []
+    for position, error, limit, needed in zip((current_x, current_y), cursor_error or (None, None),
+                                              (SCREEN_WIDTH, SCREEN_HEIGHT), tolerance):
+        if error is not None and error <= needed:
+            pushes.append((0, 0))
+        elif error is None:
+            pushes.append((-1, int(-(-limit // per_report)) + 1))
+        elif position <= limit - position:
+            pushes.append((-1, int(-(-(position + error) // per_report)) + 1))
+        else:
+            pushes.append((1, int(-(-(limit - position + error) // per_report)) + 1))
+    
+    (sign_x, count_x), (sign_y, count_y) = pushes
+    gap = sequence_timing()["move_step"]
+    return [(gap, make_mouse_report(0, 127 * sign_x if index < count_x else 0,
+                                    127 * sign_y if index < count_y else 0))
+            for index in range(max(count_x, count_y))]
+
+# Per-model calibration profiles (acceleration curve now, more sections later) live here
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")
+DVR_MODEL = "default"  # Profile name - one per DVR model/firmware
+MOVE_TOLERANCE = 2  # Pixels a calibrated move may land off target
+MOVE_MAX_PASSES = 4  # Correction passes the planner may add to reach the tolerance
+CALIBRATION_COUNTS = (1, 2, 4, 8, 16, 32, 64, 127)  # Report sizes sampled by --calibrate
+CALIBRATION_REPORT_GAP = 0.0  # Gap between calibration reports; planned moves are never closer
+CALIBRATION_MAX_GAIN = 4.0  # Highest gain expected while calibrating - keeps sample runs on screen
+
+# Loaded profile for DVR_MODEL (None until first use)
+dvr_profile = None
+
+def profile_path(model=None):
+    return os.path.join(PROFILE_DIR, f"{model or DVR_MODEL}.json")
+
+def load_dvr_profile():
+    global dvr_profile
     
-    while retry_count < retries:
+    dvr_profile = {"model": DVR_MODEL}
+    try:
+        with open(profile_path()) as f:
+            dvr_profile.update(json.load(f))
+        log_message(f"Loaded DVR profile {profile_path()}")
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        log_message(f"Ignoring unreadable DVR profile {profile_path()}: {e}", "warning")
+    return dvr_profile
+
+def save_dvr_profile():
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    tmp_path = f"{profile_path()}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(dvr_profile, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, profile_path())
+    log_message(f"Saved DVR profile {profile_path()}")
+
+def acceleration_curve():
+    """Calibrated (counts, gain) points for this DVR, or None for a 1:1 pointer"""
+    profile = dvr_profile if dvr_profile is not None else load_dvr_profile()
+    acceleration = profile.get("acceleration")
+    if HID_MODE == "absolute" or not acceleration:
+        return None
+    return acceleration["points"]
+
+# Set after a failed attempt on tuned timing: the rest of the run uses the conservative delays
+timing_fallback = False
+
+def conservative_timing():
+    """The hand-picked delays, or the larger ones --tune found this DVR needs"""
+    profile = dvr_profile if dvr_profile is not None else load_dvr_profile()
+    timing = profile.get("timing") or {}
+    return timing.get("conservative") or {"click_press": CLICK_PRESS_DELAY, "move_step": MOVE_STEP_DELAY, "waits": {}}
+
+def sequence_timing():
+    """Delays the sequence is planned with: click_press, move_step and waits (seconds
+    per UI state, replacing the step's own wait). The DVR_MODEL profile's tuned
+    timing when there is one, else - and for the rest of a run after a failure -
+    the conservative delays."""
+    profile = dvr_profile if dvr_profile is not None else load_dvr_profile()
+    timing = profile.get("timing")
+    if not timing or timing_fallback:
+        return conservative_timing()
+    return timing
+
+def report_gain(curve, speed):
+    # Linear interpolation between calibration points, flat beyond either end
+    if speed <= curve[0][0]:
+        return curve[0][1]
+    for (c0, g0), (c1, g1) in zip(curve, curve[1:]):
+        if speed <= c1:
+            return g0 + (g1 - g0) * (speed - c0) / (c1 - c0)
+    return curve[-1][1]
+
+def report_speed_for(curve, pixels, max_speed):
+    # Report size (counts) that moves the cursor `pixels` - pixels per report rises monotonically
+    low, high = 0.0, max_speed
+    for _ in range(30):
+        mid = (low + high) / 2
+        if mid * report_gain(curve, mid) < pixels:
+            low = mid
+        else:
+            high = mid
+    return high
+
+def plan_move_calibrated(from_x, from_y, target_x, target_y, curve):
+    """Fewest, largest reports that land within MOVE_TOLERANCE under the DVR's acceleration"""
+    reports = []
+    x, y = float(from_x), float(from_y)
+    # No faster than the curve was measured at, and no faster than the (tuned) move step
+    gap = max((dvr_profile.get("acceleration") or {}).get("report_gap", CALIBRATION_REPORT_GAP),
+              sequence_timing()["move_step"])
+    
+    for _ in range(MOVE_MAX_PASSES):
+        rest_x, rest_y = target_x - x, target_y - y
+        distance = (rest_x ** 2 + rest_y ** 2) ** 0.5
+        if distance <= MOVE_TOLERANCE:
+            break
+        
+        # Largest report along this direction, then the fewest of them that cover the distance
+        ux, uy = rest_x / distance, rest_y / distance
+        max_speed = 127 / max(abs(ux), abs(uy))
+        per_report = max_speed * report_gain(curve, max_speed)
+        count = max(1, int(-(-distance // per_report)))
+        speed = report_speed_for(curve, distance / count, max_speed)
+        dx, dy = round(speed * ux), round(speed * uy)
+        if dx == 0 and dy == 0:
+            break
+        
+        # Predict where the integer reports really land; the next pass corrects the rest
+        gain = report_gain(curve, (dx ** 2 + dy ** 2) ** 0.5)
+        for _ in range(count):
+            reports.append((gap, make_mouse_report(0, dx, dy)))
+            x, y = clamp_position(x + dx * gain, y + dy * gain)
+    
+    return reports, (round(x), round(y))
+
+def plan_move(from_x, from_y, target_x, target_y):
+    """Work out the reports that take the cursor from one position to another.
+    Returns the (gap, report) list and the tracked end position."""
+    if HID_MODE == "absolute":
+        # A single report lands on the target - no chunking, no accumulated drift
+        x, y = clamp_position(target_x, target_y)
+        return [(0.0, make_absolute_report(0, x, y))], (x, y)
+    
+    curve = acceleration_curve()
+    if curve:
+        return plan_move_calibrated(from_x, from_y, target_x, target_y, curve)
+    
+    reports = []
+    x, y = from_x, from_y
+    
+    # Calculate distance to move
+    dx_total = target_x - from_x
+    dy_total = target_y - from_y
+    
+    # Break the movement into smaller chunks
+    steps_needed = max(1, max(abs(dx_total), abs(dy_total)) // 100)
+    step_delay = sequence_timing()["move_step"]
+    done_x = done_y = 0
+    
+    for step in range(steps_needed):
+        # Split cumulatively so the last step lands exactly on the target
+        dx = dx_total * (step + 1) // steps_needed - done_x
+        dy = dy_total * (step + 1) // steps_needed - done_y
+        done_x += dx
+        done_y += dy
+        
+        # Small delay between movements for stability
+        gap = step_delay if step > 0 else 0.0
+        
+        # Maximum movement per report is 127 in any direction
+        while dx != 0 or dy != 0:
+            dx_chunk = max(-127, min(127, dx))
+            dy_chunk = max(-127, min(127, dy))
+            
+            reports.append((gap, make_mouse_report(0, dx_chunk, dy_chunk)))
+            x, y = clamp_position(x + dx_chunk, y + dy_chunk)
+            gap = 0.0
+            
+            dx -= dx_chunk
+            dy -= dy_chunk
+    
+    return reports, (x, y)
+
+def move_to_absolute(target_x, target_y, deadline=None):
+	# RS: client wants absolute so seperated relative and absolute
+    if target_x == current_x and target_y == current_y:
+        log_message("Already at target position.")
+        return True
+    
+    log_message(f"Moving from ({current_x}, {current_y}) to ({target_x}, {target_y})")
+    
+    reports, _ = plan_move(current_x, current_y, target_x, target_y)
+    hid.queue_reports(reports)
+    
+    with metrics.timed("move") as timer:
+        timer.ok = hid.flush(deadline=deadline)
+    if not timer.ok:
+        log_message("Movement failed while streaming reports", "error")
+        forget_cursor()
+        return False
+    
+    track_cursor(reports)
+    return True
+
+def plan_click(button, x=0, y=0):
+    # Button press, then button release (0x00 = no buttons) after a very short gap.
+    # Absolute reports must repeat the position (x, y) or the pointer would jump.
+    press = sequence_timing()["click_press"]
+    if HID_MODE == "absolute":
+        return [(0.0, make_absolute_report(button, x, y)),
+                (press, make_absolute_report(0, x, y))]
+    return [(0.0, make_mouse_report(button, 0, 0)),
+            (press, make_mouse_report(0, 0, 0))]
+
+def ask_cursor_position():
+    # Interactive probe for --calibrate without a frame source. The DVR shows no pointer
+    # coordinates, so this is for a bench setup (or the simulator) that can measure them
+    while True:
+        answer = input("Cursor position on the DVR screen as X,Y (blank to abort): ").strip()
+        if not answer:
+            return None
         try:
-            # Check if we've exceeded the timeout
-            if time.time() - start_time > timeout:
-                log_message(f"Operation timed out after {timeout} seconds", "error")
+            x, y = answer.split(",")
+            return int(x), int(y)
+        except ValueError:
+            print(f"'{answer}' is not a position - enter two whole numbers, e.g. 1800,50")
+
+CURSOR_SETTLE = 0.2  # Seconds for the capture to show the pointer where the reports left it
+CURSOR_DIFF_THRESHOLD = 60  # Gray levels a pixel has to change by to count as the pointer moving
+CURSOR_MAX_SIZE = 64  # Largest the pointer may be on screen, in pixels per side
+
+def locate_cursor():
+    """Probe for --calibrate on the frame source: the pixels that change when the pointer
+    is pushed into the bottom-right corner, less those the picture itself changes, are
+    where it was - its tip is their top-left. None when they don't look like a pointer."""
+    source = ui_watcher.source
+    time.sleep(CURSOR_SETTLE)
+    still = source.read()
+    time.sleep(CURSOR_SETTLE)
+    before = source.read()
+    
+    pushes = max(SCREEN_WIDTH, SCREEN_HEIGHT) // 127 + 2
+    hid.queue_reports([(sequence_timing()["move_step"], make_mouse_report(0, 127, 127))] * pushes)
+    if not hid.flush():
+        return None
+    forget_cursor()
+    time.sleep(CURSOR_SETTLE)
+    after = source.read()
+    if still is None or before is None or after is None:
+        log_message("No frame to locate the cursor on", "warning")
+        return None
+    
+    noise = np.abs(still.astype(np.int16) - before) > CURSOR_DIFF_THRESHOLD
+    changed = (np.abs(before.astype(np.int16) - after) > CURSOR_DIFF_THRESHOLD) & ~noise
+    changed[SCREEN_HEIGHT - CURSOR_MAX_SIZE:, SCREEN_WIDTH - CURSOR_MAX_SIZE:] = False  # where it went
+    ys, xs = np.nonzero(changed)
+    if not len(xs) or xs.max() - xs.min() > CURSOR_MAX_SIZE or ys.max() - ys.min() > CURSOR_MAX_SIZE:
+        log_message(f"Could not tell the cursor apart on {FRAME_SOURCE} "
+                    f"({len(xs)} pixels changed)", "warning")
+        return None
+    return int(xs.min()), int(ys.min())
+
+def calibrate_acceleration(probe, counts=CALIBRATION_COUNTS):
+    """Fit the DVR's pointer acceleration and save it in the DVR_MODEL profile.
+    For each report size, home, send a run of equal reports along one axis and ask
+    `probe` where the cursor ended up; the gain is pixels travelled per count sent."""
+    global compiled_sequence
+    
+    if HID_MODE == "absolute":
+        log_message("Absolute pointers have no acceleration to calibrate", "warning")
+        return False
+    
+    points = []
+    for count in counts:
+        gains = []
+        for axis, extent in ((0, SCREEN_WIDTH), (1, SCREEN_HEIGHT)):
+            if not ensure_known_position():
                 return False
-                
-            # Use low-level file operations to ensure immediate write
-            fd = os.open(DEVICE_PATH, os.O_WRONLY)
-            os.write(fd, report)
-            os.close(fd)
-            return True
             
-        except Exception as e:
-            retry_count += 1
-            log_message(f"Error writing to HID device (attempt {retry_count}/{retries}): {e}", "warning")
+            # As many reports as fit in half the screen, so rounding in the probe hardly matters
+            repeats = max(1, min(40, int(extent * 0.5 // (count * CALIBRATION_MAX_GAIN))))
+            report = make_mouse_report(0, count, 0) if axis == 0 else make_mouse_report(0, 0, count)
+            hid.queue_reports([(CALIBRATION_REPORT_GAP, report)] * repeats)
+            if not hid.flush():
+                log_message("Calibration failed while streaming reports", "error")
+                return False
             
-            if retry_count >= retries:
-                log_message(f"Failed to send mouse event after {retries} attempts", "error")
+            position = probe()
+            if position is None:
+                log_message("Calibration aborted", "warning")
                 return False
-                
-            # Exponential backoff for retries
-            backoff_time = min(0.5 * (2 ** retry_count), 5)  # Cap at 5 seconds
-            log_message(f"Retrying in {backoff_time:.2f} seconds...", "info")
-            time.sleep(backoff_time)
+            travelled = position[axis]
+            if travelled >= extent - 1:
+                # Stopped by the screen edge - the sample says nothing about the gain
+                continue
+            gains.append(travelled / (repeats * count))
+        
+        if gains:
+            points.append([count, round(sum(gains) / len(gains), 4)])
+            log_message(f"Calibration: {count} counts/report -> gain {points[-1][1]}")
+    
+    if not points:
+        log_message("Calibration produced no usable samples", "error")
+        return False
+    
+    # The planner inverts pixels-per-report, so it has to rise with the report size
+    for previous, point in zip(points, points[1:]):
+        point[1] = max(point[1], round(previous[0] * previous[1] / point[0], 4))
+    
+    profile = dvr_profile if dvr_profile is not None else load_dvr_profile()
+    profile["acceleration"] = {
+        "points": points,
+        "report_gap": CALIBRATION_REPORT_GAP,
+        "calibrated": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+    save_dvr_profile()
+    compiled_sequence = None
+    
+    # Leave the cursor somewhere the tracked position agrees with
+    return ensure_known_position()
+
+# Keyboard usage IDs (HID usage page 0x07) for keys the DVR menus respond to
+KEY_CODES = {
+    "ENTER": 0x28, "ESC": 0x29, "BACKSPACE": 0x2a, "TAB": 0x2b, "SPACE": 0x2c,
+    "RIGHT": 0x4f, "LEFT": 0x50, "DOWN": 0x51, "UP": 0x52,
+    "HOME": 0x4a, "PAGEUP": 0x4b, "DELETE": 0x4c, "END": 0x4d, "PAGEDOWN": 0x4e,
+}
+KEY_CODES.update({chr(ord("A") + i): 0x04 + i for i in range(26)})
+KEY_CODES.update({str((i + 1) % 10): 0x1e + i for i in range(10)})
+KEY_CODES.update({f"F{i + 1}": 0x3a + i for i in range(12)})
+
+# Modifier bits for the first byte of the keyboard report
+KEY_MODIFIERS = {
+    "CTRL": 0x01, "SHIFT": 0x02, "ALT": 0x04, "GUI": 0x08,
+    "RCTRL": 0x10, "RSHIFT": 0x20, "RALT": 0x40, "RGUI": 0x80,
+}
+
+KEY_PRESS_DELAY = 0.03  # Hold time for a key chord before release
+KEY_REPEAT_DELAY = 0.1  # Gap between repeated key presses so menus can follow
+
+def make_keyboard_report(modifiers=0, keys=()):
+    # Format report - 8 bytes: modifiers, reserved, up to 6 key codes
+    keys = list(keys)[:6]
+    return bytes([modifiers & 0xFF, 0] + keys + [0] * (6 - len(keys)))
+
+def plan_key_chord(chord, repeat=1):
+    """Reports for a chord such as "DOWN" or "CTRL+ALT+DELETE", pressed repeat times"""
+    modifiers = 0
+    keys = []
+    for name in chord.upper().split("+"):
+        if name in KEY_MODIFIERS:
+            modifiers |= KEY_MODIFIERS[name]
+        elif name in KEY_CODES:
+            keys.append(KEY_CODES[name])
+        else:
+            raise ValueError(f"Unknown key '{name}' in chord '{chord}'")
+    
+    reports = []
+    for press in range(repeat):
+        reports.append((KEY_REPEAT_DELAY if press > 0 else 0.0, make_keyboard_report(modifiers, keys)))
+        reports.append((KEY_PRESS_DELAY, make_keyboard_report()))
+    return reports
+
+def compile_macro(actions, position):
+    """Compile a macro of mixed keyboard and mouse actions into sequence steps.
+
+    Actions are tuples:
+        ("move", x, y)           - move the pointer to a screen position
+        ("click", "left"/"right") - click at the current position
+        ("key", chord[, repeat]) - press a key chord, e.g. "DOWN" or "CTRL+ALT+DELETE"
+        ("wait", seconds[, state]) - pause before the next action, or only until the
+                                   UI state (e.g. "menu") appears when it can be detected
+    Consecutive actions on the same device share a step; a wait ends the step.
+    Returns the steps and the tracked end position.
+    """
+    steps = []
+    current = None
+    
+    for action in actions:
+        kind = action[0]
+        
+        if kind == "wait":
+            if current is None:
+                raise ValueError("Macro can't start with a wait")
+            if len(action) > 2:
+                current["expect"] = action[2]
+            current["wait"] += sequence_timing()["waits"].get(action[2], action[1]) if len(action) > 2 else action[1]
+            current = None
+            continue
+        
+        device = "keyboard" if kind == "key" else "mouse"
+        if current is None or current["device"] != device:
+            current = {"name": "", "id": f"macro{len(steps) + 1}", "device": device,
+                       "reports": [], "segments": [], "wait": 0.0, "end": position}
+            steps.append(current)
+        
+        if kind == "move":
+            reports, position = plan_move(position[0], position[1], action[1], action[2])
+            label = f"move to ({action[1]}, {action[2]})"
+            segment = "move"
+        elif kind == "click":
+            button = CLICK_BUTTONS[action[1]]
+            reports = plan_click(button, position[0], position[1])
+            current["tolerance"] = [CLICK_TOLERANCE, CLICK_TOLERANCE]
+            label = f"{action[1]} click"
+            segment = f"{action[1]}_click"
+        elif kind == "key":
+            repeat = action[2] if len(action) > 2 else 1
+            reports = plan_key_chord(action[1], repeat)
+            label = f"key {action[1]}" + (f" x{repeat}" if repeat > 1 else "")
+            segment = "key"
+        else:
+            raise ValueError(f"Unknown macro action '{kind}'")
+        
+        current["reports"] += reports
+        current["segments"].append([segment, len(reports)])
+        current["end"] = position
+        current["name"] = f"{current['name']}, {label}" if current["name"] else f"Macro: {label}"
+    
+    return steps, position
+
+def run_macro(actions, deadline=None):
+    """Compile and play a macro straight away, starting from the tracked position"""
+    steps, _ = compile_macro(actions, (current_x, current_y))
+    for step in steps:
+        log_message(step["name"])
+        if not play_sequence_step(step, deadline):
+            log_message(f"Macro failed at '{step['name']}'", "error")
+            return False
+        wait_for_step_ui(step, deadline or Deadline())
+    return True
+
+# Recordings made by DVRRecorder.py from usbmon captures of a technician's mouse.
+# They are captured with the cursor pushed into the top-left corner, so playback homes first.
+REPLAY_RECORDING = None  # Recording played by the "replay" shutdown method
+
+def load_recording(path):
+    with open(path) as f:
+        recording = json.load(f)
+    if recording.get("format") != "dvr-recording":
+        raise ValueError(f"{path} is not a DVR recording")
+    return recording
+
+def plan_recording(recording, position=(0, 0)):
+    """Reports for a recording, with large deltas split into the +/-127 a report carries.
+    Returns the (gap, report) list and the end position, not counting acceleration."""
+    reports = []
+    x, y = position
+    for gap, buttons, dx, dy in recording["events"]:
+        while True:
+            step_x = max(-127, min(127, dx))
+            step_y = max(-127, min(127, dy))
+            reports.append((gap, make_mouse_report(buttons, step_x, step_y)))
+            x, y = clamp_position(x + step_x, y + step_y)
+            dx -= step_x
+            dy -= step_y
+            gap = 0.0
+            if dx == 0 and dy == 0:
+                break
+    return reports, (x, y)
+
+def play_recording(path, deadline=None):
+    """Home the cursor and stream a recording through the HID path"""
+    if HID_MODE == "absolute":
+        log_message("Recordings hold relative mouse reports; set HID_MODE to relative", "error")
+        return False
+    recording = load_recording(path)
+    if not ensure_known_position(deadline):
+        return False
+    
+    log_message(f"Replaying {path} ({len(recording['events'])} events, {recording['duration']:.1f} seconds)")
+    reports, _ = plan_recording(recording, (current_x, current_y))
+    hid.queue_reports(reports)
+    with metrics.timed("replay") as timer:
+        timer.ok = hid.flush(deadline=deadline)
+    if not timer.ok:
+        log_message("Replay failed while streaming reports", "error")
+        forget_cursor()
+        return False
+    track_cursor(reports)
+    return True
+
+# Optional UI state detection: watch the DVR's HDMI output and go on as soon as the
+# menu or confirmation dialog shows instead of sleeping a fixed time. Needs NumPy
+# (and Pillow for PNG frames/templates); without a FRAME_SOURCE the fixed waits are used.
+FRAME_SOURCE = None  # V4L2 capture device (e.g. "/dev/video0") or a directory of PNG frames for testing
+UI_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ui_templates")
+UI_STATES = {
+    # state: screen region (x, y, width, height) it is matched in; template is UI_TEMPLATE_DIR/<state>.png
+    "menu": (1640, 40, 270, 620),
+    "confirm": (700, 400, 520, 200),
+}
+UI_MATCH_SCALE = 4  # Regions are downsampled by this factor before matching
+UI_MATCH_THRESHOLD = 0.08  # Mean absolute difference (0..1) at or below which a region matches
+UI_WAIT_TIMEOUT = 3.0  # Longest wait for an expected menu/dialog before the step is replayed
+UI_POLL_INTERVAL = 0.02  # How often the frame source is checked while waiting
+UI_START_TIMEOUT = 3.0  # Seconds after a background frame-source start that checks stop waiting for it
+
+# numpy, imported on first use - only UI detection needs it
+np = None
+
+class UiStateMissing(Exception):
+    """The menu/dialog a step should have opened never showed up (or the last one never closed)"""
+
+def load_vision():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
+
+def load_gray_image(path):
+    from PIL import Image
+    with Image.open(path) as image:
+        return np.asarray(image.convert("L"))
+
+class PngDirectorySource:
+    """Test frame source: the newest PNG (by name) in a directory is the current screen"""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = None
+        self.frame = None
+
+    def read(self):
+        names = sorted(name for name in os.listdir(self.path) if name.lower().endswith(".png"))
+        if not names:
+            return None
+        if names[-1] != self.name:
+            self.frame = load_gray_image(os.path.join(self.path, names[-1]))
+            self.name = names[-1]
+        return self.frame
+
+    def close(self):
+        pass
+
+class V4L2FrameSource:
+    """HDMI capture on /dev/videoN, decoded by ffmpeg into raw grayscale frames at
+    screen size. A reader thread keeps only the newest frame so waits never lag."""
+
+    def __init__(self, device):
+        self.frame_size = SCREEN_WIDTH * SCREEN_HEIGHT
+        self.frame = None
+        self.lock = threading.Lock()
+        import subprocess
+        self.process = subprocess.Popen(
+            ["ffmpeg", "-loglevel", "error", "-f", "v4l2", "-i", device,
+             "-vf", f"scale={SCREEN_WIDTH}:{SCREEN_HEIGHT},format=gray", "-f", "rawvideo", "-"],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        threading.Thread(target=self.reader, daemon=True).start()
+
+    def reader(self):
+        stream = self.process.stdout
+        while True:
+            data = stream.read(self.frame_size)
+            if len(data) < self.frame_size:
+                break
+            with self.lock:
+                self.frame = np.frombuffer(data, np.uint8).reshape(SCREEN_HEIGHT, SCREEN_WIDTH)
+
+    def read(self):
+        with self.lock:
+            return self.frame
+
+    def close(self):
+        import subprocess
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+def open_frame_source(path):
+    return PngDirectorySource(path) if os.path.isdir(path) else V4L2FrameSource(path)
+
+class UiWatcher:
+    """Matches regions of the DVR's screen against per-state templates, downsampled
+    and brightness-normalized, and waits until an expected state appears."""
+
+    def __init__(self):
+        self.source = None
+        self.templates = {}
+        self.starting = None  # Thread running start() for start_in_background()
+        self.start_give_up = None  # Monotonic time checks stop waiting for that thread
+
+    def start_in_background(self):
+        """start() on a thread, so NumPy, the templates and the capture process load
+        while the first reports go out. The first check on the watcher waits for it."""
+        if self.starting is None and self.source is None and FRAME_SOURCE is not None:
+            self.starting = threading.Thread(target=self.start, name="ui-watcher-start", daemon=True)
+            self.start_give_up = time.monotonic() + UI_START_TIMEOUT
+            self.starting.start()
+
+    def started(self):
+        # Wait for a background start until UI_START_TIMEOUT after it began; checks after
+        # that only look whether it has finished, and see no source while it hasn't
+        if self.starting is not None:
+            self.starting.join(max(0, self.start_give_up - time.monotonic()))
+            if not self.starting.is_alive():
+                self.starting = None
+        return self.starting is None and self.source is not None
+
+    def start(self):
+        if self.source is not None or FRAME_SOURCE is None:
+            return self.source is not None
+        if not load_vision():
+            log_message("NumPy is not installed, using fixed menu/dialog waits", "warning")
+            return False
+        try:
+            self.source = open_frame_source(FRAME_SOURCE)
+            for state in UI_STATES:
+                path = os.path.join(UI_TEMPLATE_DIR, f"{state}.png")
+                if os.path.exists(path):
+                    self.add_template(state, load_gray_image(path))
+        except Exception as e:
+            log_message(f"UI detection unavailable ({FRAME_SOURCE}): {e}", "warning")
+            self.close()
+            return False
+        log_message(f"Watching {FRAME_SOURCE} for UI states: {', '.join(sorted(self.templates)) or 'none'}")
+        return True
+
+    def close(self):
+        if self.starting is not None and self.starting is not threading.current_thread():
+            self.starting.join()
+            self.starting = None
+        if self.source is not None:
+            self.source.close()
+        self.source = None
+        self.templates = {}
+
+    def add_template(self, state, image):
+        self.templates[state] = self.normalize(image)
+
+    def can_detect(self, state):
+        return self.started() and state in self.templates
+
+    @staticmethod
+    def normalize(image):
+        # Block-average down by UI_MATCH_SCALE, then remove the mean so capture levels don't matter
+        scale = UI_MATCH_SCALE
+        height, width = image.shape[0] // scale * scale, image.shape[1] // scale * scale
+        small = image[:height, :width].reshape(height // scale, scale, width // scale, scale)
+        small = small.mean(axis=(1, 3), dtype=np.float32)
+        return small - small.mean()
+
+    def score(self, frame, state):
+        x, y, width, height = UI_STATES[state]
+        region = self.normalize(frame[y:y + height, x:x + width])
+        template = self.templates[state]
+        if region.shape != template.shape:
+            return 1.0
+        return float(np.abs(region - template).mean()) / 255
+
+    def matches(self, state):
+        frame = self.source.read()
+        return frame is not None and self.score(frame, state) <= UI_MATCH_THRESHOLD
+
+    def wait_for(self, state, deadline, timeout=UI_WAIT_TIMEOUT, shown=True):
+        """True as soon as `state` is on screen (or, with shown=False, gone from it),
+        False if that doesn't happen within timeout"""
+        give_up = time.monotonic() + timeout
+        while self.matches(state) != shown:
+            left = give_up - time.monotonic()
+            if left <= 0:
+                return False
+            deadline.sleep(min(UI_POLL_INTERVAL, left), f"Waiting for {state}")
+        return True
+
+    def capture_template(self, state):
+        """Save the state's region of the current frame as its template"""
+        from PIL import Image
+        frame = self.source.read()
+        if frame is None:
+            return False
+        x, y, width, height = UI_STATES[state]
+        os.makedirs(UI_TEMPLATE_DIR, exist_ok=True)
+        Image.fromarray(np.ascontiguousarray(frame[y:y + height, x:x + width])).save(
+            os.path.join(UI_TEMPLATE_DIR, f"{state}.png"))
+        self.add_template(state, frame[y:y + height, x:x + width])
+        return True
+
+ui_watcher = UiWatcher()
+
+def wait_for_step_ui(step, deadline):
+    """Wait for the menu/dialog a step opens: until it shows on the frame source
+    when it can be detected, otherwise the step's fixed wait"""
+    state = step.get("expect")
+    if state and ui_watcher.can_detect(state):
+        with metrics.timed(f"{step['id']}.wait_{state}") as timer:
+            timer.ok = ui_watcher.wait_for(state, deadline, UI_WAIT_TIMEOUT)
+        if not timer.ok:
+            raise UiStateMissing(f"'{state}' did not appear after {step['name']}")
+    elif step["wait"]:
+        deadline.sleep(step["wait"], "Waiting for menu/dialog")
+
+def wait_for_last_ui_closed(steps, deadline):
+    """After the last step: wait for the menu/dialog it clicked in (the last one a step
+    expects) to go, when it can be detected - still showing means the click was lost"""
+    state = next((step["expect"] for step in reversed(steps[:-1]) if step.get("expect")), None)
+    if not state or not ui_watcher.can_detect(state):
+        return
+    with metrics.timed(f"{steps[-1]['id']}.closed_{state}") as timer:
+        timer.ok = ui_watcher.wait_for(state, deadline, UI_WAIT_TIMEOUT, shown=False)
+    if not timer.ok:
+        raise UiStateMissing(f"'{state}' still showing after {steps[-1]['name']}")
+
+# How the shutdown is driven:
+#   "mouse" - SHUTDOWN_STEPS, pixel-precise moves and clicks
+#   "macro" - SHUTDOWN_MACRO, mixed key chords and mouse actions (needs KEYBOARD_ENABLED)
+#   "replay" - REPLAY_RECORDING, a technician's recorded mouse session
+SHUTDOWN_METHOD = "mouse"
+
+# Keyboard-assisted shutdown. The menu is opened with the mouse, then the
+# confirmation dialog is accepted with Enter, which doesn't depend on where
+# the "Yes" button sits. Adjust the keys per DVR firmware.
+SHUTDOWN_MACRO = [
+    ("move", 1800, 50), ("click", "right"), ("wait", 1.0, "menu"),      # open the menu
+    ("move", 1750, 600), ("click", "left"), ("wait", 1.0, "confirm"),   # shutdown option
+    ("key", "ENTER"),                                                   # confirm with the focused "Yes"
+]
+
+# Backs out of whatever menu or dialog a --tune rehearsal left open (right-click is
+# "back" in the Hikvision local menu). Same actions as SHUTDOWN_MACRO.
+DISMISS_MACRO = [("click", "right")]
+
+# Shutdown sequence: (log label, target position, mouse button to click, wait afterwards,
+# UI state the click opens - waited for instead of the fixed wait when it can be detected,
+# step timeout - None for STEP_TIMEOUT, (x, y) pixels the click may miss the target by -
+# None for CLICK_TOLERANCE)
+SHUTDOWN_STEPS = [
+    ("Step 1: Navigating to menu button", (1800, 50), 2, 1.0, "menu", None, None),          # right-click, wait for menu to appear
+    ("Step 2: Navigating to shutdown option", (1750, 600), 1, 1.0, "confirm", None, None),  # wait for confirmation dialog
+    ("Step 3: Confirming shutdown", (900, 500), 1, 0.0, None, None, None),                  # "Yes" button
+]
+
+# Sequence library: one entry per DVR model, with positions normalized to 0..1 so
+# the same entry fits whatever resolution the DVR outputs. The selected model
+# (DVR_MODEL) replaces SHUTDOWN_STEPS, SHUTDOWN_MACRO, DISMISS_MACRO and UI_STATES above.
+SEQUENCE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sequences.json")
+# (width, height) override; else the one --calibrate, --tune or --capture-ui detected from
+# FRAME_SOURCE and saved in the model profile (never probed on the shutdown path), else the model's
+SCREEN_RESOLUTION = None
+CLICK_BUTTONS = {"none": 0, "left": 1, "right": 2, "middle": 4}
+SEQUENCE_STEP_KEYS = {"label", "target", "click", "wait", "expect", "timeout", "tolerance"}
+
+# Parsed SEQUENCE_FILE models (None until first use)
+sequence_library = None
+
+def load_sequence_library():
+    global sequence_library
+    if sequence_library is None:
+        try:
+            with open(SEQUENCE_FILE) as f:
+                sequence_library = json.load(f).get("models", {})
+        except FileNotFoundError:
+            sequence_library = {}
+    return sequence_library
+
+def validate_sequence_model(model):
+    """Everything wrong with a sequence library entry, as a list of messages"""
+    problems = []
+    
+    def is_number(value, low=0.0, high=float("inf")):
+        return isinstance(value, (int, float)) and not isinstance(value, bool) and low <= value <= high
+    
+    def check_position(where, position):
+        if not (isinstance(position, list) and len(position) == 2 and all(is_number(v, 0, 1) for v in position)):
+            problems.append(f"{where}: position must be [x, y] between 0 and 1")
+    
+    def check_actions(name, actions):
+        for number, action in enumerate(actions, 1):
+            where = f"{name} action {number}"
+            kind = action[0] if isinstance(action, list) and action else None
+            if kind == "move":
+                check_position(where, action[1:])
+            elif kind == "click":
+                if len(action) != 2 or action[1] not in CLICK_BUTTONS or action[1] == "none":
+                    problems.append(f"{where}: click needs left, right or middle")
+            elif kind == "key":
+                if not (2 <= len(action) <= 3 and isinstance(action[1], str)):
+                    problems.append(f"{where}: key needs a chord such as \"ENTER\"")
+                    continue
+                unknown = [name for name in action[1].upper().split("+")
+                           if name not in KEY_CODES and name not in KEY_MODIFIERS]
+                if unknown:
+                    problems.append(f"{where}: unknown key {', '.join(repr(name) for name in unknown)} in '{action[1]}'")
+                if len(action) == 3 and not (isinstance(action[2], int) and not isinstance(action[2], bool) and action[2] >= 1):
+                    problems.append(f"{where}: key repeat must be a whole number from 1")
+            elif kind == "wait":
+                if not (2 <= len(action) <= 3 and is_number(action[1])):
+                    problems.append(f"{where}: wait needs a number of seconds")
+                elif len(action) == 3 and action[2] not in known_states:
+                    problems.append(f"{where}: unknown UI state '{action[2]}'")
+            else:
+                problems.append(f"{where}: unknown action {kind!r}")
+    
+    resolution = model.get("resolution")
+    if resolution is not None and not (isinstance(resolution, list) and len(resolution) == 2
+                                       and all(isinstance(v, int) and v > 0 for v in resolution)):
+        problems.append("resolution must be [width, height] in pixels")
+    
+    states = model.get("ui_states", {})
+    for state, region in states.items():
+        if not (isinstance(region, list) and len(region) == 4 and all(is_number(v, 0, 1) for v in region)):
+            problems.append(f"ui_states.{state}: region must be [x, y, width, height] between 0 and 1")
+    known_states = set(states) | set(UI_STATES)
+    
+    method = model.get("method", SHUTDOWN_METHOD)
+    if method not in ("mouse", "macro", "replay"):
+        problems.append(f"method must be 'mouse', 'macro' or 'replay', not '{method}'")
+    if method == "replay" and not isinstance(model.get("recording"), str):
+        problems.append("method 'replay' needs a recording file")
+    
+    steps = model.get("steps")
+    if not isinstance(steps, list) or not steps:
+        problems.append("steps must be a non-empty list")
+        steps = []
+    for number, step in enumerate(steps, 1):
+        where = f"step {number}"
+        if not isinstance(step, dict):
+            problems.append(f"{where}: must be an object")
+            continue
+        for key in sorted(set(step) - SEQUENCE_STEP_KEYS):
+            problems.append(f"{where}: unknown key '{key}'")
+        check_position(where, step.get("target"))
+        if step.get("click", "left") not in CLICK_BUTTONS:
+            problems.append(f"{where}: click must be one of {', '.join(CLICK_BUTTONS)}")
+        if not is_number(step.get("wait", 0.0)):
+            problems.append(f"{where}: wait must be a number of seconds")
+        if step.get("timeout") is not None and not is_number(step["timeout"], 0.1):
+            problems.append(f"{where}: timeout must be a positive number of seconds")
+        if step.get("expect") is not None and step["expect"] not in known_states:
+            problems.append(f"{where}: unknown UI state '{step['expect']}'")
+        tolerance = step.get("tolerance")
+        if tolerance is not None and not (isinstance(tolerance, list) and len(tolerance) == 2
+                                          and all(is_number(v, 0, 1) for v in tolerance)):
+            problems.append(f"{where}: tolerance must be [x, y] between 0 and 1")
+    
+    macro = model.get("macro")
+    if method == "macro" and not macro:
+        problems.append("method 'macro' needs a macro")
+    check_actions("macro", macro or [])
+    if model.get("dismiss") is not None:
+        check_actions("dismiss", model["dismiss"])
+    
+    return problems
+
+def detect_resolution():
+    """The DVR's output resolution as seen by the frame source, or None"""
+    if FRAME_SOURCE is None:
+        return None
+    try:
+        if os.path.isdir(FRAME_SOURCE):
+            names = sorted(name for name in os.listdir(FRAME_SOURCE) if name.lower().endswith(".png"))
+            if not names:
+                return None
+            from PIL import Image
+            with Image.open(os.path.join(FRAME_SOURCE, names[-1])) as image:
+                return image.size
+        import subprocess
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-f", "v4l2", "-show_entries", "stream=width,height",
+             "-of", "csv=p=0", FRAME_SOURCE],
+            capture_output=True, text=True, timeout=5)
+        width, height = result.stdout.split(",")[:2]
+        return int(width), int(height)
+    except Exception as e:
+        log_message(f"Could not detect the DVR resolution from {FRAME_SOURCE}: {e}", "warning")
+        return None
+
+def macro_needs_keyboard(actions):
+    return any(action[0] == "key" for action in actions)
 
-def move_mouse_relative(dx, dy):
-    global current_x, current_y
+def load_sequence_model(required=False, detect=False):
+    """Validate the DVR_MODEL entry of the sequence library, scale it to the screen
+    resolution and install it. Raises ValueError when the entry is invalid, needs a
+    keyboard that isn't enabled, or is missing although `required` (named with
+    --model or in DVR_UNITS); otherwise a missing entry keeps the built-in
+    1920x1080 sequence. With `detect` the resolution is probed on the frame
+    source and saved in the model profile for later runs."""
+    global SCREEN_WIDTH, SCREEN_HEIGHT, SHUTDOWN_METHOD, SHUTDOWN_STEPS, SHUTDOWN_MACRO, DISMISS_MACRO, UI_STATES
+    global REPLAY_RECORDING, current_x, current_y
     
-    # Update position tracking
-    current_x += dx
-    current_y += dy
+    model = load_sequence_library().get(DVR_MODEL)
+    if model is None and required:
+        raise ValueError(f"No '{DVR_MODEL}' model in {SEQUENCE_FILE} (see --list-models)")
+    if model is None:
+        log_message(f"No '{DVR_MODEL}' sequence in {SEQUENCE_FILE}, using the built-in 1920x1080 sequence", "warning")
+        return False
+    problems = validate_sequence_model(model)
+    if problems:
+        raise ValueError(f"Invalid '{DVR_MODEL}' sequence in {SEQUENCE_FILE}: {'; '.join(problems)}")
+    if model.get("method", SHUTDOWN_METHOD) == "macro" and macro_needs_keyboard(model["macro"]) and not KEYBOARD_ENABLED:
+        raise ValueError(f"The '{DVR_MODEL}' macro uses key chords but KEYBOARD_ENABLED is off")
     
-    # Ensure within bounds
-    current_x = max(0, min(current_x, SCREEN_WIDTH))
-    current_y = max(0, min(current_y, SCREEN_HEIGHT))
+    profile = dvr_profile if dvr_profile is not None else load_dvr_profile()
+    detected = detect_resolution() if detect and not SCREEN_RESOLUTION else None
+    if detected and list(detected) != profile.get("resolution"):
+        profile["resolution"] = list(detected)
+        try:
+            save_dvr_profile()
+        except OSError as e:
+            log_message(f"Could not save the detected resolution: {e}", "warning")
+    width, height = SCREEN_RESOLUTION or profile.get("resolution") or model.get("resolution") or (1920, 1080)
+    
+    def scale(x, y):
+        return min(width - 1, round(x * width)), min(height - 1, round(y * height))
+    
+    SCREEN_WIDTH, SCREEN_HEIGHT = width, height
+    SHUTDOWN_METHOD = model.get("method", SHUTDOWN_METHOD)
+    SHUTDOWN_STEPS = [
+        (step.get("label", f"Step {number}"), scale(*step["target"]), CLICK_BUTTONS[step.get("click", "left")],
+         step.get("wait", 0.0), step.get("expect"), step.get("timeout"),
+         (round(step["tolerance"][0] * width), round(step["tolerance"][1] * height)) if "tolerance" in step else None)
+        for number, step in enumerate(model["steps"], 1)
+    ]
+    if "recording" in model:
+        REPLAY_RECORDING = os.path.join(os.path.dirname(os.path.abspath(SEQUENCE_FILE)), model["recording"])
+    if "macro" in model:
+        SHUTDOWN_MACRO = [("move",) + scale(*action[1:]) if action[0] == "move" else tuple(action)
+                          for action in model["macro"]]
+    if "dismiss" in model:
+        DISMISS_MACRO = [("move",) + scale(*action[1:]) if action[0] == "move" else tuple(action)
+                         for action in model["dismiss"]]
+    UI_STATES = dict(UI_STATES)
+    for state, (x, y, w, h) in model.get("ui_states", {}).items():
+        UI_STATES[state] = scale(x, y) + (round(w * width), round(h * height))
+    
+    # Nothing has been sent yet; the tracked cursor starts at the new center, position unknown
+    current_x, current_y = width // 2, height // 2
+    forget_cursor()
     
-    # Send movement event
-    return send_mouse_event(0, dx, dy)
+    log_message(f"Loaded '{DVR_MODEL}' sequence: {len(SHUTDOWN_STEPS)} steps at {width}x{height}")
+    return True
 
-def move_to_absolute(target_x, target_y):
-	# RS: client wants absolute so seperated relative and absolute
-    global current_x, current_y
+# Compiled report streams are cached here, keyed by screen size and coordinates
+SEQUENCE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sequence_cache")
+SEQUENCE_FORMAT_VERSION = 7
+
+# In-memory copy of the compiled sequence for this process
+compiled_sequence = None
+
+def sequence_cache_key():
+    timing = sequence_timing()
+    params = {
+        "version": SEQUENCE_FORMAT_VERSION,
+        "screen": [SCREEN_WIDTH, SCREEN_HEIGHT],
+        "hid_mode": HID_MODE,
+        "steps": [[label, list(target), button, wait, expect, timeout, tolerance]
+                  for label, target, button, wait, expect, timeout, tolerance in SHUTDOWN_STEPS],
+        "delays": [timing["move_step"], timing["click_press"], KEY_PRESS_DELAY, KEY_REPEAT_DELAY],
+        "waits": timing["waits"],
+        "click_tolerance": CLICK_TOLERANCE,
+        "method": SHUTDOWN_METHOD,
+        "acceleration": acceleration_curve(),
+    }
+    if SHUTDOWN_METHOD == "macro":
+        params["macro"] = [list(action) for action in SHUTDOWN_MACRO]
+    if SHUTDOWN_METHOD == "replay":
+        # A re-imported recording keeps its name, so its modification time is part of the key
+        params["recording"] = [REPLAY_RECORDING, os.path.getmtime(REPLAY_RECORDING)]
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+    return f"shutdown-{HID_MODE}-{SCREEN_WIDTH}x{SCREEN_HEIGHT}-{digest}"
+
+def compile_shutdown_sequence():
+    """Turn the shutdown sequence into a flat list of paced HID reports per step"""
+    steps = []
+    position = (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2)
     
-    # Calculate distance to move
-    dx_total = target_x - current_x
-    dy_total = target_y - current_y
+    if SHUTDOWN_METHOD == "replay":
+        # Recordings start in the top-left corner, which is where homing leaves the cursor
+        if HID_MODE == "absolute":
+            raise ValueError("Recordings hold relative mouse reports; set HID_MODE to relative")
+        homing = plan_homing()
+        reports, position = plan_recording(load_recording(REPLAY_RECORDING))
+        steps = [{
+            "name": "Step 0.5: Establishing known position...",
+            "id": "step0",
+            "device": "mouse",
+            "homing": True,
+            "reports": homing,
+            "segments": [["homing", len(homing)]],
+            "wait": 0.0,
+            "end": (0, 0),
+        }, {
+            "name": f"Replaying {os.path.basename(REPLAY_RECORDING)}",
+            "id": "replay",
+            "device": "mouse",
+            "reports": reports,
+            "segments": [["replay", len(reports)]],
+            "wait": 0.0,
+            "tolerance": [0, 0],  # recorded from the exact corner
+            "end": position,
+        }]
+        return {"version": SEQUENCE_FORMAT_VERSION, "key": sequence_cache_key(), "steps": steps}
     
-    if dx_total == 0 and dy_total == 0:
-        log_message("Already at target position.")
-        return True
+    # A macro made only of key chords doesn't need to know where the cursor is
+    uses_mouse = SHUTDOWN_METHOD != "macro" or any(action[0] in ("move", "click") for action in SHUTDOWN_MACRO)
     
-    log_message(f"Moving from ({current_x}, {current_y}) to ({target_x}, {target_y})")
+    if uses_mouse:
+        # Homing, then the center (better starting point)
+        reports = plan_homing()
+        center_reports, position = plan_move(0, 0, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2)
+        steps.append({
+            "name": "Step 0.5: Establishing known position...",
+            "id": "step0",
+            "device": "mouse",
+            "homing": True,
+            "reports": reports + center_reports,
+            "segments": [["homing", len(reports)], ["move", len(center_reports)]],
+            "wait": 0.0,
+            "end": position,
+        })
     
-    # Break the movement into smaller chunks
-    steps_needed = max(1, max(abs(dx_total), abs(dy_total)) // 100)
+    if SHUTDOWN_METHOD == "macro":
+        if not KEYBOARD_ENABLED and macro_needs_keyboard(SHUTDOWN_MACRO):
+            raise ValueError("SHUTDOWN_MACRO uses key chords but KEYBOARD_ENABLED is off")
+        macro_steps, position = compile_macro(SHUTDOWN_MACRO, position)
+        steps += macro_steps
+        return {"version": SEQUENCE_FORMAT_VERSION, "key": sequence_cache_key(), "steps": steps}
     
-    for step in range(steps_needed):
-        if step == steps_needed - 1:
-            # Last step - move remaining distance
-            dx = dx_total - (dx_total * step // steps_needed)
-            dy = dy_total - (dy_total * step // steps_needed)
-        else:
-            # Calculate this step's movement
-            dx = dx_total // steps_needed
-            dy = dy_total // steps_needed
-        
-        # Maximum movement per step is 127 in any direction
-        while abs(dx) > 127 or abs(dy) > 127:
-            dx_chunk = max(-127, min(127, dx))
-            dy_chunk = max(-127, min(127, dy))
-            
-            if not move_mouse_relative(dx_chunk, dy_chunk):
-                log_message("Movement failed during large chunk", "error")
-                return False
-            
-            dx -= dx_chunk
-            dy -= dy_chunk
-        
-        # Send the remaining movement
-        if dx != 0 or dy != 0:
-            if not move_mouse_relative(dx, dy):
-                log_message("Movement failed during final movement", "error")
-                return False
-            
-        # Small delay between movements for stability
-        time.sleep(0.01)
-            
-    return True
+    waits = sequence_timing()["waits"]
+    for number, (label, (target_x, target_y), button, wait, expect, timeout, tolerance) in enumerate(SHUTDOWN_STEPS, 1):
+        reports, position = plan_move(position[0], position[1], target_x, target_y)
+        click_reports = plan_click(button, position[0], position[1]) if button else []
+        steps.append({
+            "name": label,
+            "id": f"step{number}",
+            "device": "mouse",
+            "reports": reports + click_reports,
+            "segments": [["move", len(reports)], ["click", len(click_reports)]],
+            "wait": waits.get(expect, wait) if expect else wait,
+            "expect": expect,
+            "timeout": timeout,
+            "tolerance": list(tolerance or (CLICK_TOLERANCE, CLICK_TOLERANCE)),
+            "end": position,
+        })
+    
+    return {"version": SEQUENCE_FORMAT_VERSION, "key": sequence_cache_key(), "steps": steps}
 
-def right_click():
-    log_message("Performing right click...")
+def encode_sequence(sequence):
+    encoded = dict(sequence)
+    encoded["steps"] = [dict(step, reports=[[gap, report.hex()] for gap, report in step["reports"]],
+                             end=list(step["end"]))
+                        for step in sequence["steps"]]
+    return encoded
+
+def decode_sequence(encoded):
+    sequence = dict(encoded)
+    sequence["steps"] = [dict(step, reports=[(gap, bytes.fromhex(report)) for gap, report in step["reports"]],
+                              end=tuple(step["end"]))
+                         for step in encoded["steps"]]
+    return sequence
+
+def load_shutdown_sequence():
+    """Return the compiled shutdown sequence, from memory, the disk cache or a fresh compile"""
+    global compiled_sequence
     
-    # 1. Send button press (0x02 = right button)
-    if not send_mouse_event(button=2, x=0, y=0):
-        log_message("Failed to send right button press", "error")
-        return False
+    key = sequence_cache_key()
+    if compiled_sequence is not None and compiled_sequence["key"] == key:
+        return compiled_sequence
+    
+    cache_file = os.path.join(SEQUENCE_CACHE_DIR, key + ".json")
+    try:
+        with open(cache_file) as f:
+            compiled_sequence = decode_sequence(json.load(f))
+        return compiled_sequence
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log_message(f"Ignoring unreadable sequence cache {cache_file}: {e}", "warning")
     
-    # RS crucial: very short delay between press and release (3-5ms)
-    time.sleep(0.003)  # 3 milliseconds
+    log_message("Compiling shutdown sequence...")
+    compiled_sequence = compile_shutdown_sequence()
     
-    # 2. Send button release (0x00 = no buttons)
-    if not send_mouse_event(button=0, x=0, y=0):
-        log_message("Failed to send right button release", "error")
-        return False
+    try:
+        os.makedirs(SEQUENCE_CACHE_DIR, exist_ok=True)
+        tmp_file = cache_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(encode_sequence(compiled_sequence), f)
+        os.replace(tmp_file, cache_file)
+    except Exception as e:
+        log_message(f"Could not cache compiled sequence: {e}", "warning")
     
-    log_message("Right click completed successfully")
-    return True
+    return compiled_sequence
 
-def left_click():
-    log_message("Performing left click...")
-    
-    # 1. Send button press (0x01 = left button)
-    if not send_mouse_event(button=1, x=0, y=0):
-        log_message("Failed to send left button press", "error")
-        return False
+def play_sequence_step(step, deadline=None):
+    """Stream one compiled step to its device and update the tracked position"""
+    device = keyboard if step.get("device") == "keyboard" else hid
     
-    # Crucial: Very short delay between press and release (3-5ms)
-    time.sleep(0.003)  # 3 milliseconds
+    # Flush segment by segment (move, click, ...) so each gets its own timing;
+    # the pacing clock runs straight through, so this costs nothing
+    offset = 0
+    for segment, count in step["segments"]:
+        device.queue_reports(step["reports"][offset:offset + count])
+        with metrics.timed(f"{step['id']}.{segment}") as timer:
+            timer.ok = device.flush(deadline=deadline)
+        if not timer.ok:
+            return False
+        offset += count
     
-    # 2. Send button release (0x00 = no buttons)
-    if not send_mouse_event(button=0, x=0, y=0):
-        log_message("Failed to send left button release", "error")
+    if device is hid:
+        track_cursor(step["reports"])
+    return True
+
+def estimate_sequence_time(steps):
+    """Minimum time compiled steps need: pacing gaps, report slots and waits"""
+    return sum(sum(max(gap, HID_POLL_INTERVAL) for gap, _ in step["reports"]) + step["wait"]
+               for step in steps)
+
+def required_cursor_error(steps, index):
+    """Largest per-axis model error the next positioned step from steps[index] on
+    can take, after the error its own move adds. None when nothing needs the cursor."""
+    for step in steps[index:]:
+        if step.get("tolerance") is not None:
+            # A calibrated move stops within MOVE_TOLERANCE of its target and lands near its prediction
+            slack = MOVE_TOLERANCE + CALIBRATED_MOVE_ERROR if acceleration_curve() else 0
+            return [max(0, limit - slack) for limit in step["tolerance"]]
+    return None
+
+def rehome_partially(needed, deadline):
+    """Pin only the axes the model can't place within needed against their nearest edge"""
+    reports = plan_partial_homing(needed)
+    error = "unknown" if cursor_error is None else f"+/-({cursor_error[0]:.0f}, {cursor_error[1]:.0f})"
+    log_message(f"Cursor position {error}, needs +/-({needed[0]:.0f}, {needed[1]:.0f}): homing with {len(reports)} reports...")
+    hid.queue_reports(reports)
+    with metrics.timed("rehome") as timer:
+        timer.ok = hid.flush(deadline=deadline)
+    if not timer.ok:
+        forget_cursor()
         return False
-    
-    log_message("Left click completed successfully")
+    track_cursor(reports)
     return True
 
-def perform_shutdown_sequence():
+def verify_checkpoint(steps, checkpoint):
+    """Step to resume from, going by what the frame source shows: past the checkpoint
+    when its own menu/dialog came up late, back to the step that opens an earlier
+    one that has gone (a stray click closes the menu). Unchanged when nothing can
+    be detected."""
+    state = steps[checkpoint].get("expect") if checkpoint < len(steps) else None
+    if state and ui_watcher.can_detect(state) and ui_watcher.matches(state):
+        log_message(f"'{state}' showed up late, resuming after {steps[checkpoint]['name']}")
+        return checkpoint + 1
+    
+    while True:
+        opener = next((index for index in range(checkpoint - 1, -1, -1) if steps[index].get("expect")), None)
+        if opener is None:
+            return checkpoint
+        state = steps[opener]["expect"]
+        if not ui_watcher.can_detect(state) or ui_watcher.matches(state):
+            return checkpoint
+        log_message(f"'{state}' is no longer showing, going back to {steps[opener]['name']}", "warning")
+        checkpoint = opener
+
+def perform_shutdown_sequence(deadline=None):
+    global current_x, current_y, cursor_error, timing_fallback
+    
     log_message("Starting DVR shutdown sequence...")
+    timing_fallback = False
     
-    # Set overall sequence timeout
+    # Set overall sequence timeout - one budget shared by every step, move and write
     sequence_start = time.time()
-    sequence_end = sequence_start + SEQUENCE_TIMEOUT
+    sequence_deadline = Deadline(SEQUENCE_TIMEOUT, deadline)
+    
+    # Work out the reports before anything is sent; the frame source opens alongside
+    # the homing and the first move - only the first menu/dialog wait needs it
+    sequence = load_shutdown_sequence()
+    ui_watcher.start_in_background()
+    steps = sequence["steps"]
+    homing_step = next((step for step in steps if step.get("homing")), None)
+    
+    # Checkpoint: retries resume from the step that failed instead of starting over
+    checkpoint = 0         # Index of the next step to play
+    pending_wait = 0.0     # Wait still owed by the last completed step (menu/dialog)
+    
+    # A daemon remembers where it left the cursor, and finds it on disk after a restart
+    if cursor_error is None and (daemon_mode or SOLE_POINTER):
+        load_cursor_state()
     
     # Track retry attempts for the entire sequence
     sequence_retry = 0
     
-    while sequence_retry < MAX_RETRIES:
+    while True:
         try:
-            # Check if overall sequence has timed out
-            if time.time() > sequence_end:
-                log_message(f"Shutdown sequence timed out after {SEQUENCE_TIMEOUT} seconds", "error")
-                send_notification("DVR shutdown sequence failed due to timeout", "error")
-                return False
-                
-            # Reset mouse hardware with timeout
-            step_start = time.time()
-            step_end = step_start + STEP_TIMEOUT
+            # Reset mouse hardware with timeout (skipped when the gadget is intact)
+            step_deadline = sequence_deadline.child(STEP_TIMEOUT)
             
             log_message("Step 0: Initializing hardware...")
-            if not reset_gadget():
+            if not reset_gadget(deadline=step_deadline):
                 raise Exception("Failed to reset mouse hardware")
-                
-            # Now establish known position with timeout
-            log_message("Step 0.5: Establishing known position...")
-            if not ensure_known_position():
-                raise Exception("Failed to establish known cursor position")
             
-            # Move to center (better starting point)
-            if not move_to_absolute(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2):
-                raise Exception("Failed to move to center position")
-                
-            # Check if this initialization step timed out
-            if time.time() > step_end:
-                log_message("Initialization step timed out", "warning")
-                
-            # Step 1: Navigate to menu button with timeout
-            step_start = time.time()
-            step_end = step_start + STEP_TIMEOUT
-            
-            log_message("Step 1: Navigating to menu button")
-            if not move_to_absolute(1800, 50):
-                raise Exception("Failed to move to menu button")
-            
-            # Use right-click for menu
-            if not right_click():
-                raise Exception("Failed to right-click menu button")
-                
-            log_message("Step 1 complete, waiting for menu to appear...")
-            time.sleep(1.0)  # Wait for menu to appear
+            # A retry resumes where the DVR's screen really is, which a lost click may have changed
+            if checkpoint > 0:
+                resume = verify_checkpoint(steps, checkpoint)
+                if resume != checkpoint:
+                    checkpoint, pending_wait = resume, 0.0
+                if checkpoint == len(steps):
+                    break
             
-            # Check if step timed out
-            if time.time() > step_end:
-                log_message("Step 1 timed out", "warning")
+            # Home only as far as the next click needs: not at all when the position model
+            # already places the cursor within its tolerance, else just the uncertain axes
+            # (the compiled full homing is only played when the position is unknown)
+            needed = required_cursor_error(steps, checkpoint + 1 if steps[checkpoint] is homing_step else checkpoint)
+            if checkpoint == 0 and homing_step is steps[0] and cursor_trusted():
+                checkpoint = 1
+                if needed is None or cursor_within(needed):
+                    log_message("Cursor position known, skipping homing")
+            if (checkpoint > 0 and needed is not None and not cursor_within(needed)
+                    and HID_MODE == "relative"):
+                if not rehome_partially(needed, step_deadline):
+                    raise Exception("Failed to re-establish known cursor position")
+            if checkpoint > 0 and (current_x, current_y) != steps[checkpoint - 1]["end"]:
+                # Start the next step's move from where it was planned to start
+                resume_x, resume_y = steps[checkpoint - 1]["end"]
+                if not move_to_absolute(resume_x, resume_y, step_deadline):
+                    raise Exception("Failed to return to the resume position")
             
-            # Step 2: Navigate to shutdown option with timeout
-            step_start = time.time()
-            step_end = step_start + STEP_TIMEOUT
+            if checkpoint > 0:
+                log_message(f"Resuming from {steps[checkpoint]['name']}")
+            if pending_wait:
+                step_deadline.sleep(pending_wait, "Waiting for menu/dialog")
+                pending_wait = 0.0
             
-            log_message("Step 2: Navigating to shutdown option")
-            if not move_to_absolute(1750, 600):
-                raise Exception("Failed to move to shutdown option")
+            # Play the compiled steps back, each within its own share of the budget
+            while checkpoint < len(steps):
+                step = steps[checkpoint]
+                step_deadline = sequence_deadline.child(step.get("timeout") or STEP_TIMEOUT)
+                device = keyboard if step.get("device") == "keyboard" else hid
+                sent_before = device.reports_sent
+                drops_before = link_watchdog.drops
+                model_before = (current_x, current_y, cursor_error)
                 
-            if not left_click():
-                raise Exception("Failed to click shutdown option")
+                log_message(step["name"])
+                try:
+                    played = play_sequence_step(step, step_deadline)
+                finally:
+                    # Some but not all of a mouse step's reports went out - the model follows
+                    # the ones that did, the last of which may not have reached the host
+                    sent = device.reports_sent - sent_before
+                    if device is hid and 0 < sent < len(step["reports"]):
+                        current_x, current_y, cursor_error = model_before
+                        track_cursor(step["reports"][:sent], last_uncertain=True)
+                if link_watchdog.drops != drops_before:
+                    # The DVR re-enumerated the gadget mid-step - replay it from a known position
+                    if device is hid:
+                        forget_cursor()
+                    raise LinkDown(errno.ESHUTDOWN, f"USB link dropped during {step['name']}")
+                if not played:
+                    raise Exception(f"Failed to play {step['name']}")
                 
-            log_message("Step 2 complete, waiting for confirmation dialog...")
-            time.sleep(1.0)  # Wait for confirmation dialog
-            
-            # Check if step timed out
-            if time.time() > step_end:
-                log_message("Step 2 timed out", "warning")
-            
-            # Step 3: Navigate to "Yes" button to confirm shutdown with timeout
-            step_start = time.time()
-            step_end = step_start + STEP_TIMEOUT
-            
-            log_message("Step 3: Confirming shutdown")
-            if not move_to_absolute(900, 500):
-                raise Exception("Failed to move to confirmation button")
+                # Detected menus/dialogs are waited for here; a miss replays this step
+                if step.get("expect") and ui_watcher.can_detect(step["expect"]):
+                    wait_for_step_ui(step, step_deadline)
+                    checkpoint += 1
+                    continue
+                if checkpoint == len(steps) - 1:
+                    # So is the dialog the last click closes, which the Pi must not halt under
+                    wait_for_last_ui_closed(steps, step_deadline)
                 
-            if not left_click():
-                raise Exception("Failed to click confirmation button")
-            
-            # Check if step timed out
-            if time.time() > step_end:
-                log_message("Step 3 timed out", "warning")
-            
-            # Successfully completed sequence
-            sequence_duration = time.time() - sequence_start
-            log_message(f"Shutdown sequence completed successfully in {sequence_duration:.1f} seconds")
-            send_notification(f"DVR shutdown sequence completed successfully in {sequence_duration:.1f} seconds", "info")
-            return True
+                checkpoint += 1
+                pending_wait = step["wait"]
+                if pending_wait:
+                    step_deadline.sleep(pending_wait, "Waiting for menu/dialog")
+                    pending_wait = 0.0
+            break
             
+        except DeadlineExceeded as e:
+            error = e
+            if checkpoint == len(steps):
+                # Every report went out; only the wait after the last step was cut short
+                log_message(f"Wait after the last step cut short: {e}", "warning")
+                break
+            if sequence_deadline.cancelled.is_set():
+                log_message(f"Shutdown sequence cancelled: {e}", "error")
+                return False
         except Exception as e:
-            # Handle sequence failure
-            sequence_retry += 1
-            log_message(f"Error during shutdown sequence (attempt {sequence_retry}/{MAX_RETRIES}): {e}", "error")
-            
-            if sequence_retry >= MAX_RETRIES:
-                log_message(f"Shutdown sequence failed after {MAX_RETRIES} attempts", "error")
-                send_notification(f"DVR shutdown sequence failed after {MAX_RETRIES} attempts: {e}", "error")
+            error = e
+        
+        # Handle sequence failure
+        sequence_retry += 1
+        log_message(f"Error during shutdown sequence (attempt {sequence_retry}/{MAX_RETRIES}): {error}", "error")
+        
+        # The tuned delays may be what failed: retry on the conservative ones (same steps,
+        # so the checkpoint still holds) and save the tuned ones backed off for next time
+        if not isinstance(error, LinkDown) and back_off_timing(error):
+            steps = load_shutdown_sequence()["steps"]
+            homing_step = next((step for step in steps if step.get("homing")), None)
+        
+        if sequence_retry >= MAX_RETRIES:
+            log_message(f"Shutdown sequence failed after {MAX_RETRIES} attempts", "error")
+            send_notification(f"DVR shutdown sequence failed after {MAX_RETRIES} attempts: {error}", "error")
+            return False
+        
+        # Only the remaining steps (plus a rehome, if needed) have to fit in the budget
+        remaining_estimate = estimate_sequence_time(steps[checkpoint:]) + pending_wait
+        needed = required_cursor_error(steps, checkpoint)
+        if checkpoint > 0 and needed is not None and not cursor_within(needed) and homing_step is not None:
+            remaining_estimate += estimate_sequence_time([homing_step])
+        remaining = sequence_deadline.remaining()
+        if remaining < remaining_estimate:
+            log_message(f"Shutdown sequence timed out: only {remaining:.1f} seconds left, "
+                        f"{remaining_estimate:.1f} needed to finish", "error")
+            send_notification("DVR shutdown sequence failed due to timeout", "error")
+            return False
+        
+        # Short backoff - resuming is cheap, and dropped entirely when the budget is tight
+        backoff_time = min(0.5 * (2 ** sequence_retry), 2, remaining - remaining_estimate)  # Cap at 2 seconds
+        if isinstance(error, (UiStateMissing, LinkDown)) or not link_watchdog.configured():
+            # The click may simply not have registered, or the link is down and the
+            # watchdog will say exactly when the DVR is back - no reason to wait blindly
+            backoff_time = 0.0
+        log_message(f"Resuming sequence in {backoff_time:.2f} seconds...", "warning")
+        metrics.record_retry("sequence", backoff_time)
+        try:
+            sequence_deadline.sleep(backoff_time, "Sequence retry backoff")
+            if not link_watchdog.configured():
+                log_message(f"USB link is {link_watchdog.state}, waiting for the DVR to reconnect...", "warning")
+                with metrics.timed("link_pause") as timer:
+                    timer.ok = link_watchdog.wait_configured(sequence_deadline)
+        except DeadlineExceeded as e:
+            log_message(f"Shutdown sequence cancelled: {e}", "error")
+            return False
+    
+    # Successfully completed sequence
+    sequence_duration = time.time() - sequence_start
+    log_message(f"Shutdown sequence completed successfully in {sequence_duration:.1f} seconds")
+    send_notification(f"DVR shutdown sequence completed successfully in {sequence_duration:.1f} seconds", "info")
+    return True
+
+# Timing tuning (--tune): each delay is searched downward while rehearsals of the
+# sequence - every step but the last, so the DVR never shuts down - keep passing,
+# then saved in the model profile with a safety margin
+TIMING_SAFETY_MARGIN = 1.5  # Saved delays are the shortest that passed times this
+TIMING_TUNE_FACTOR = 0.7    # Each candidate is this fraction of the last one that passed
+TIMING_TUNE_TRIALS = 3      # Rehearsals a candidate has to pass in a row
+TIMING_TUNE_MAX_SCALE = 4   # Farthest the conservative delays are raised when they fail as they are
+TIMING_TUNE_SETTLE = 1.0    # Longest wait for the live view after backing out of a rehearsal
+TIMING_FLOORS = {"click_press": 0.0005, "move_step": HID_POLL_INTERVAL, "waits": 0.05}  # Never tried below these
+TIMING_BACKOFF_FACTOR = 2.0  # A failure multiplies the saved tuned delays by this (up to the conservative ones)
+
+def back_off_timing(reason):
+    """After a failed attempt on tuned timing: use the conservative delays for the rest
+    of the run and save the tuned ones TIMING_BACKOFF_FACTOR longer. False when the
+    run isn't on tuned timing."""
+    global timing_fallback
+    
+    profile = dvr_profile if dvr_profile is not None else load_dvr_profile()
+    timing = profile.get("timing")
+    if not timing or timing_fallback:
+        return False
+    timing_fallback = True
+    
+    conservative = conservative_timing()
+    for name in ("click_press", "move_step"):
+        timing[name] = round(min(conservative[name], timing[name] * TIMING_BACKOFF_FACTOR), 4)
+    for state, wait in timing["waits"].items():
+        timing["waits"][state] = round(min(conservative["waits"].get(state, float("inf")), wait * TIMING_BACKOFF_FACTOR), 3)
+    timing["failures"] = timing.get("failures", 0) + 1
+    timing["backed_off"] = datetime.datetime.now().isoformat(timespec="seconds")
+    log_message(f"Tuned timing failed ({reason}), retrying on the conservative delays", "warning")
+    try:
+        save_dvr_profile()
+    except OSError as e:
+        log_message(f"Could not save the backed-off timing: {e}", "warning")
+    return True
+
+def ask_ui_state(state, timeout=0.0):
+    # Interactive check for --tune without a frame source: the operator reads the DVR screen
+    what = f"the {state}" if state else "the live view (no menu or dialog)"
+    return input(f"Is {what} showing on the DVR screen? [y/N] ").strip().lower().startswith("y")
+
+def see_ui_state(state, timeout=0.0):
+    """Check for --tune on the frame source: whether `state` (None: no known menu or
+    dialog) is showing, polling for up to timeout seconds"""
+    give_up = time.monotonic() + timeout
+    while True:
+        if state:
+            shown = ui_watcher.matches(state)
+        else:
+            shown = not any(ui_watcher.matches(known) for known in ui_watcher.templates)
+        if shown or time.monotonic() >= give_up:
+            return shown
+        time.sleep(UI_POLL_INTERVAL)
+
+def return_to_live(verify, opened):
+    """Back out of the menus/dialogs a rehearsal opened with DISMISS_MACRO"""
+    for _ in range(3):
+        if opened:
+            log_message("Backing out to the live view...")
+            if not run_macro(DISMISS_MACRO):
                 return False
-                
-            # backoff for retries
-            backoff_time = min(2 * (2 ** sequence_retry), 10)  # Cap at 10 seconds
-            log_message(f"Retrying sequence in {backoff_time:.2f} seconds...", "warning")
-            time.sleep(backoff_time)
-            
-            # Reset everything before retry
-            reset_gadget()
+        if verify(None, TIMING_TUNE_SETTLE):
+            return True
+        opened = True
+    return False
 
-if __name__ == "__main__":
-    # Start logging session
-    log_message("="*50)
-    log_message(f"DVR Shutdown Script Started: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+def rehearse_sequence(verify):
+    """Play the mouse steps short of the last one with the timing in the profile and
+    check each menu/dialog is showing once its wait is over. True when all were."""
+    steps = compile_shutdown_sequence()["steps"][:-1]
+    passed = True
+    for step in steps:
+        if not play_sequence_step(step):
+            raise OSError(f"HID output failed during {step['name']}")
+        if step["wait"]:
+            time.sleep(step["wait"])
+        if step.get("expect") and not verify(step["expect"]):
+            log_message(f"'{step['expect']}' not showing after {step['name']}")
+            passed = False
+            break
     
-    # Check hostname for logging purposes
-    hostname = socket.gethostname()
-    log_message(f"Running on host: {hostname}")
+    if not return_to_live(verify, opened=passed):
+        raise RuntimeError("Could not get the DVR back to the live view")
+    return passed
+
+def tune_timing(verify=None, timed=False, trials=TIMING_TUNE_TRIALS):
+    """Find the shortest reliable click press, move step and menu/dialog waits for
+    DVR_MODEL and save them, times TIMING_SAFETY_MARGIN, in its profile.
+
+    `verify(state, timeout)` says whether a UI state (None: the live view) is showing.
+    Without one the frame source is used when it can see every state the rehearsal
+    expects, else the operator is asked. Waits are only tuned when `timed` - the
+    check is made the moment the wait ends, which a person can't do.
+    """
+    global SHUTDOWN_METHOD, compiled_sequence, timing_fallback
     
-    # Check if running as root
-    if os.geteuid() != 0:
-        error_msg = "This script must be run as root (sudo)!"
-        log_message(error_msg, "error")
-        send_notification(f"DVR shutdown failed on {hostname}: {error_msg}", "error")
-        sys.exit(1)
+    expected = [expect for _, _, _, _, expect, _, _ in SHUTDOWN_STEPS[:-1] if expect]
+    if not expected:
+        log_message("Nothing to check timing against: no step before the last one opens a menu or dialog", "error")
+        return False
+    if verify is None:
+        if ui_watcher.start() and all(ui_watcher.can_detect(state) for state in expected):
+            verify, timed = see_ui_state, True
+        else:
+            log_message("No frame source for every menu/dialog, asking instead; waits are kept as they are", "warning")
+            verify, timed = ask_ui_state, False
+    
+    profile = dvr_profile if dvr_profile is not None else load_dvr_profile()
+    previous = profile.get("timing")
+    base = conservative_timing()
+    base = {"click_press": base["click_press"], "move_step": base["move_step"],
+            "waits": {expect: base["waits"].get(expect, wait)
+                      for _, _, _, wait, expect, _, _ in SHUTDOWN_STEPS[:-1] if expect and wait}}
+    
+    def candidate(scale=1.0, **changes):
+        timing = {"click_press": base["click_press"] * scale, "move_step": base["move_step"] * scale,
+                  "waits": {state: wait * scale for state, wait in base["waits"].items()}}
+        timing.update(changes)
+        return timing
+    
+    def passes(timing):
+        profile["timing"] = timing
+        return all(rehearse_sequence(verify) for _ in range(trials))
+    
+    # Every model's steps are a mouse path through its menus, whatever its shutdown method
+    method, SHUTDOWN_METHOD = SHUTDOWN_METHOD, "mouse"
+    timing_fallback = False
+    try:
+        # Start from delays that work, raising them when the conservative ones don't
+        scale = 1
+        while not passes(candidate(scale)):
+            scale *= 2
+            if scale > TIMING_TUNE_MAX_SCALE:
+                raise RuntimeError(f"Rehearsals fail even at {TIMING_TUNE_MAX_SCALE}x the conservative delays - "
+                                   "check the sequence positions and calibration first")
+            log_message(f"Rehearsal failed, trying {scale}x the conservative delays", "warning")
+        base = candidate(scale)
+        best = candidate()
+        
+        names = ["waits." + state for state in base["waits"]] if timed else []
+        for name in names + ["move_step", "click_press"]:
+            section, _, state = name.partition(".")
+            value = best["waits"][state] if state else best[section]
+            while value * TIMING_TUNE_FACTOR >= TIMING_FLOORS[section]:
+                trial = dict(best, waits=dict(best["waits"]))
+                if state:
+                    trial["waits"][state] = value * TIMING_TUNE_FACTOR
+                else:
+                    trial[section] = value * TIMING_TUNE_FACTOR
+                log_message(f"Trying {name} = {value * TIMING_TUNE_FACTOR * 1000:.1f} ms...")
+                if not passes(trial):
+                    break
+                value *= TIMING_TUNE_FACTOR
+                best = trial
+            log_message(f"Shortest reliable {name}: {value * 1000:.1f} ms")
+    except Exception as e:
+        log_message(f"Timing tuning failed: {e}", "error")
+        if previous is None:
+            profile.pop("timing", None)
+        else:
+            profile["timing"] = previous
+        return False
+    finally:
+        SHUTDOWN_METHOD = method
+        compiled_sequence = None
+    
+    def margin(value, limit):
+        return min(limit, value * TIMING_SAFETY_MARGIN)
     
+    profile["timing"] = {
+        "click_press": round(margin(best["click_press"], base["click_press"]), 4),
+        "move_step": round(margin(best["move_step"], base["move_step"]), 4),
+        "waits": {state: round(margin(wait, base["waits"][state]), 3) for state, wait in best["waits"].items()},
+        "conservative": {"click_press": round(base["click_press"], 4), "move_step": round(base["move_step"], 4),
+                         "waits": {state: round(wait, 3) for state, wait in base["waits"].items()}},
+        "margin": TIMING_SAFETY_MARGIN,
+        "trials": trials,
+        "tuned": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+    save_dvr_profile()
+    log_message(f"Tuned timing for '{DVR_MODEL}': click press {profile['timing']['click_press'] * 1000:.1f} ms, "
+                f"move step {profile['timing']['move_step'] * 1000:.1f} ms, waits "
+                + (", ".join(f"{state} {wait:.2f} s" for state, wait in profile["timing"]["waits"].items()) or "unchanged"))
+    return True
+
+# Checks that can't stop the shutdown run on a background thread alongside it,
+# and are given up on (not waited for) past this many seconds
+BACKGROUND_CHECK_BUDGET = 2.0
+
+def check_disk_space():
     # Check disk space for logs
     try:
-        log_dir = Path(log_file).parent
+        log_dir = os.path.dirname(log_file)
         stat = os.statvfs(log_dir)
         free_space_mb = (stat.f_frsize * stat.f_bavail) / (1024 * 1024)
         if free_space_mb < 50:  # Less than 50MB free
             log_message(f"Warning: Low disk space ({free_space_mb:.1f} MB available)", "warning")
     except Exception as e:
         log_message(f"Could not check disk space: {e}", "warning")
+
+def start_background_checks():
+    """Disk space and notification readiness, in parallel with the shutdown. Returns
+    a thread the caller can join() within BACKGROUND_CHECK_BUDGET."""
+    def run():
+        with metrics.timed("background_checks"):
+            check_disk_space()
+            notifier.prepare()
+    thread = threading.Thread(target=run, name="background-checks", daemon=True)
+    thread.start()
+    return thread
+
+def preflight():
+    """Root and gadget checks - everything the first HID report depends on.
+    Returns an error message, or None when ready."""
+    # Check if running as root
+    if os.geteuid() != 0:
+        return "This script must be run as root (sudo)!"
     
-    # Check if HID device exists and set it up if needed
-    if not os.path.exists(DEVICE_PATH):
+    # Check if HID device exists and set it up if needed (each DVR of DVR_UNITS sets up its own)
+    if not DVR_UNITS and not os.path.exists(DEVICE_PATH):
         log_message("HID device not found. Setting up USB gadget...", "warning")
         
         # Try to set up with timeout
         setup_timeout = time.time() + 30
-        setup_success = False
         
-        while time.time() < setup_timeout and not setup_success:
+        while time.time() < setup_timeout:
             if reset_gadget():
-                setup_success = True
-                break
+                return None
             log_message("Retrying USB gadget setup...", "warning")
             time.sleep(2)
             
-        if not setup_success:
-            error_msg = "Failed to set up USB mouse gadget after multiple attempts"
-            log_message(error_msg, "error")
-            send_notification(f"DVR shutdown failed on {hostname}: {error_msg}", "error")
-            sys.exit(1)
+        return "Failed to set up USB mouse gadget after multiple attempts"
     
-    # Execute the shutdown sequence
-    log_message("Starting DVR shutdown process...")
+    return None
+
+# Several DVRs from one controller: one entry per recorder, each shut down in its
+# own process at the same time. Empty means a single DVR on DEVICE_PATH.
+#   {"name": "lobby", "device": "/dev/hidg0", "udc": "fe980000.usb"},
+#   {"name": "yard", "device": "/dev/hidg1", "udc": "3f980000.usb", "model": "default", "max_retries": 5},
+# "device" may also be a unix: virtual sink. Every other DVR gets a gadget of its own,
+# so with more than one each needs its own "udc". /dev/hidgN numbers follow the order the gadgets are created in, so "device"
+# is only where the node is expected: each DVR process finds its gadget's real node.
+DVR_UNITS = []
+
+# Per-DVR keys and the setting each one overrides in that DVR's process
+UNIT_SETTINGS = {
+    "device": "DEVICE_PATH",
+    "keyboard_device": "KEYBOARD_DEVICE_PATH",
+    "model": "DVR_MODEL",
+    "hid_mode": "HID_MODE",
+    "udc": "PREFERRED_UDC",
+    "frames": "FRAME_SOURCE",
+    "resolution": "SCREEN_RESOLUTION",
+    "max_retries": "MAX_RETRIES",
+    "step_timeout": "STEP_TIMEOUT",
+    "sequence_timeout": "SEQUENCE_TIMEOUT",
+}
+UNIT_KILL_GRACE = 5  # Seconds a DVR process gets to stop after SIGTERM before it is killed
+
+# DVRs already shut down by this controller - a retry after a partial failure skips them
+units_done = set()
+
+def validate_units():
+    """Everything wrong with DVR_UNITS, as a list of messages"""
+    problems = []
+    names, devices = set(), set()
+    for number, unit in enumerate(DVR_UNITS, 1):
+        name = unit.get("name")
+        if not name or name in names:
+            problems.append(f"unit {number}: needs a unique name")
+        if not unit.get("device") or unit["device"] in devices:
+            problems.append(f"unit {name or number}: needs a device of its own")
+        for key in sorted(set(unit) - set(UNIT_SETTINGS) - {"name", "gadget"}):
+            problems.append(f"unit {name or number}: unknown key '{key}'")
+        if "model" in unit and unit["model"] not in load_sequence_library():
+            problems.append(f"unit {name or number}: no '{unit['model']}' model in {SEQUENCE_FILE}")
+        names.add(name)
+        devices.add(unit.get("device"))
     
-    # Set a timeout for the entire operation
-    start_time = time.time()
-    max_runtime = 120  # 2 minutes max runtime
+    # Each gadget binds a UDC of its own - a second one on the same UDC would only
+    # fail with "already bound" when the power goes
+    real = [unit for unit in DVR_UNITS if unit.get("device") and not is_virtual_device(unit["device"])]
+    udcs, gadgets = set(), set()
+    for unit in real:
+        name = unit.get("name")
+        gadget = unit.get("gadget", f"dvr-{name}")
+        if gadget in gadgets:
+            problems.append(f"unit {name}: gadget '{gadget}' is already used by another DVR")
+        if "udc" in unit:
+            if unit["udc"] in udcs:
+                problems.append(f"unit {name}: UDC '{unit['udc']}' is already used by another DVR")
+            udcs.add(unit["udc"])
+        elif len(real) > 1:
+            problems.append(f"unit {name}: needs a udc when several DVRs use USB gadgets")
+        gadgets.add(gadget)
+    return problems
+
+def apply_unit_settings(unit):
+    """Turn this (forked) process into the controller for one DVR"""
+    global LOG_PREFIX, KEYBOARD_ENABLED, UDC_FALLBACK, GADGET_PATH, dvr_profile, compiled_sequence, ui_watcher
+    global link_watchdog, cursor_error
+    global DEVICE_PATH, KEYBOARD_DEVICE_PATH, DVR_MODEL, HID_MODE, PREFERRED_UDC, FRAME_SOURCE
+    global SCREEN_RESOLUTION, MAX_RETRIES, STEP_TIMEOUT, SEQUENCE_TIMEOUT
+    
+    LOG_PREFIX = f"[{unit['name']}] "
+    GADGET_PATH = os.path.join(CONFIGFS_GADGETS, unit.get("gadget", f"dvr-{unit['name']}"))
+    # One line per UNIT_SETTINGS key
+    DEVICE_PATH = unit.get("device", DEVICE_PATH)
+    KEYBOARD_DEVICE_PATH = unit.get("keyboard_device", KEYBOARD_DEVICE_PATH)
+    DVR_MODEL = unit.get("model", DVR_MODEL)
+    HID_MODE = unit.get("hid_mode", HID_MODE)
+    PREFERRED_UDC = unit.get("udc", PREFERRED_UDC)
+    FRAME_SOURCE = unit.get("frames", FRAME_SOURCE)
+    SCREEN_RESOLUTION = tuple(unit["resolution"]) if "resolution" in unit else SCREEN_RESOLUTION
+    MAX_RETRIES = unit.get("max_retries", MAX_RETRIES)
+    STEP_TIMEOUT = unit.get("step_timeout", STEP_TIMEOUT)
+    SEQUENCE_TIMEOUT = unit.get("sequence_timeout", SEQUENCE_TIMEOUT)
+    if "udc" in unit:
+        # Never fall back to a UDC that belongs to another DVR
+        UDC_FALLBACK = False
+    if "keyboard_device" in unit:
+        KEYBOARD_ENABLED = True
+    
+    # Nothing of the controller's DVR state carries over
+    for device, path in ((hid, DEVICE_PATH), (keyboard, KEYBOARD_DEVICE_PATH)):
+        device.close()
+        device.path = path
+        device.reset_stats()
+    dvr_profile = None
+    compiled_sequence = None
+    cursor_error = None
+    ui_watcher = UiWatcher()
+    link_watchdog = LinkWatchdog()
+
+def run_unit(unit, result_fd, hostname, deadline):
+    """Child process body: shut one DVR down and write the result to result_fd"""
+    apply_unit_settings(unit)
+    
+    # The controller stops a DVR with SIGTERM; the sequence stops at its next wait or write
+    unit_deadline = Deadline(None, deadline)
+    signal.signal(signal.SIGTERM, lambda signum, frame: unit_deadline.cancel())
+    return shutdown_unit(unit, result_fd, hostname, unit_deadline)
+
+def shutdown_unit(unit, result_fd, hostname, deadline, trigger_time=None):
+    """Shut this process's DVR down once and write the result to result_fd as one line"""
+    metrics.reset(trigger_time)
+    notifier.capture()
+    hid.reset_stats()
+    keyboard.reset_stats()
+    
+    started = time.monotonic()
+    try:
+        if compiled_sequence is None:
+            # Not pre-warmed, or that failed: load this DVR's model now
+            load_sequence_model(required="model" in unit)
+        exit_code = shutdown_dvr(hostname, deadline)
+    except Exception as e:
+        log_message(f"DVR shutdown failed: {e}", "error")
+        exit_code = 1
+    
+    result = {
+        "name": unit["name"], "exit_code": exit_code, "seconds": time.monotonic() - started,
+        "reports": hid.reports_sent + keyboard.reports_sent,
+        "metrics": metrics.snapshot(), "notifications": notifier.captured,
+    }
+    data = json.dumps(result).encode() + b"\n"
+    while data:
+        data = data[os.write(result_fd, data):]
+    return exit_code
+
+def unit_worker(unit, trigger_fd, result_fd, hostname):
+    """Resident child body for the daemon: pre-warm one DVR's path, then shut it down
+    once per trigger line on trigger_fd until the daemon closes it"""
+    apply_unit_settings(unit)
+    
+    # SIGTERM from the controller stops the shutdown in progress, if any
+    running = []
+    def stop(signum, frame):
+        for deadline in running:
+            deadline.cancel()
+    signal.signal(signal.SIGTERM, stop)
     
     try:
-        # First ensure we're at a known position, regardless of what other mice might have done
-        ensure_known_position()
+        load_sequence_model(required="model" in unit)
+        load_shutdown_sequence()
+        reset_gadget()
+        ui_watcher.start()
+        hid.open()
+        if KEYBOARD_ENABLED:
+            keyboard.open()
+    except Exception as e:
+        # Tried again, and reported, by the first shutdown
+        log_message(f"Failed to prepare shutdown path: {e}", "warning")
+    log_buffer.flush()
+    
+    exit_code = 0
+    with os.fdopen(trigger_fd, "rb") as triggers:
+        for line in triggers:
+            trigger = json.loads(line)
+            deadline = Deadline(max(0.0, trigger["expires"] - time.monotonic()))
+            running[:] = [deadline]
+            exit_code = shutdown_unit(unit, result_fd, hostname, deadline, trigger["started"])
+            running.clear()
+            log_buffer.flush()
+    return exit_code
+
+def shutdown_units(hostname, deadline):
+    """Shut every DVR in DVR_UNITS down at once, each in a forked process with its
+    own cursor, HID devices and retry loop, so the site takes as long as the
+    slowest DVR. Returns the exit code."""
+    return finish_units(start_units(hostname, deadline), hostname, deadline)
+
+def unit_failure(name, seconds, message):
+    # The result of a DVR whose process never reported one
+    return {"name": name, "exit_code": 1, "seconds": seconds, "reports": 0, "metrics": None,
+            "notifications": [("error", message)]}
+
+def start_units(hostname, deadline):
+    """Fork a process for every DVR in DVR_UNITS not yet shut down. Call it before
+    starting any thread: a child could inherit a lock a thread held at fork time.
+    Returns what finish_units() waits on."""
+    units = [unit for unit in DVR_UNITS if unit["name"] not in units_done]
+    if not units:
+        return None
+    log_message(f"Shutting down {len(units)} DVRs in parallel: {', '.join(unit['name'] for unit in units)}")
+    started = time.monotonic()
+    
+    # Buffered output would otherwise be written once per child as well
+    sys.stdout.flush()
+    log_buffer.flush()
+    children = {}  # result pipe fd -> child
+    for unit in units:
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 1
+            try:
+                os.close(read_fd)
+                for fd in children:
+                    os.close(fd)
+                exit_code = run_unit(unit, write_fd, hostname, deadline)
+            except BaseException as e:
+                log_message(f"DVR process crashed: {e}", "error")
+            finally:
+                sys.stdout.flush()
+                log_buffer.flush()
+                os._exit(exit_code)
+        os.close(write_fd)
+        children[read_fd] = {"unit": unit, "pid": pid, "data": b"", "resident": False}
+    return children, started, []
+
+# The daemon's resident DVR processes, by DVR name (see fork_unit_workers())
+unit_workers = {}
+
+def fork_unit_workers(hostname):
+    """Daemon mode: fork a resident process for every DVR in DVR_UNITS, which pre-warms
+    its DVR and then waits for trigger_units(). The daemon calls it before starting any
+    thread, so no child inherits a lock a thread held at fork time."""
+    sys.stdout.flush()
+    log_buffer.flush()
+    for unit in DVR_UNITS:
+        trigger_read, trigger_write = os.pipe()
+        result_read, result_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 1
+            try:
+                os.close(trigger_write)
+                os.close(result_read)
+                for worker in unit_workers.values():
+                    os.close(worker["trigger"])
+                    os.close(worker["result"])
+                exit_code = unit_worker(unit, trigger_read, result_write, hostname)
+            except BaseException as e:
+                log_message(f"DVR process crashed: {e}", "error")
+            finally:
+                sys.stdout.flush()
+                log_buffer.flush()
+                os._exit(exit_code)
+        os.close(trigger_read)
+        os.close(result_write)
+        unit_workers[unit["name"]] = {"unit": unit, "pid": pid, "trigger": trigger_write, "result": result_read}
+
+def trigger_units(hostname, deadline):
+    """Start a shutdown in every resident DVR process whose DVR isn't shut down yet.
+    Returns what finish_units() waits on, like start_units()."""
+    workers = [worker for name, worker in unit_workers.items() if name not in units_done]
+    if not workers:
+        return None
+    log_message(f"Shutting down {len(workers)} DVRs in parallel: {', '.join(worker['unit']['name'] for worker in workers)}")
+    started = time.monotonic()
+    
+    trigger = json.dumps({"expires": deadline.expires, "started": metrics.started}).encode() + b"\n"
+    children, results = {}, []
+    for worker in workers:
+        try:
+            os.write(worker["trigger"], trigger)
+        except OSError as e:
+            results.append(unit_failure(worker["unit"]["name"], 0.0, f"DVR process is gone: {e}"))
+            continue
+        children[worker["result"]] = {"unit": worker["unit"], "pid": worker["pid"], "data": b"", "resident": True}
+    return children, started, results
+
+def stop_unit_workers():
+    """Let the resident DVR processes exit (they stop at the end of their trigger pipe)"""
+    for worker in unit_workers.values():
+        os.close(worker["trigger"])
+        os.close(worker["result"])
+    for worker in unit_workers.values():
+        try:
+            os.waitpid(worker["pid"], 0)
+        except ChildProcessError:
+            pass
+    unit_workers.clear()
+
+def finish_units(forked, hostname, deadline):
+    """Collect the DVR processes of start_units(), stopping them when the deadline
+    runs out, and fold their results into this run's. Returns the exit code."""
+    if forked is None:
+        return 0
+    children, started, results = forked
+    
+    poller = select.poll()
+    for fd in children:
+        poller.register(fd, select.POLLIN)
+    
+    stopped_at = None
+    killed = False
+    while children:
+        if stopped_at is None and (deadline.cancelled.is_set() or deadline.remaining() <= 0):
+            log_message("Stopping the DVR processes still running", "warning")
+            stopped_at = time.monotonic()
+            for child in children.values():
+                os.kill(child["pid"], signal.SIGTERM)
+        elif stopped_at is not None and not killed and time.monotonic() - stopped_at > UNIT_KILL_GRACE:
+            killed = True
+            for child in children.values():
+                os.kill(child["pid"], signal.SIGKILL)
         
-        # Now run the shutdown sequence with enhanced error handling
-        success = perform_shutdown_sequence()
+        for fd, _ in poller.poll(100):
+            data = os.read(fd, 65536)
+            child = children[fd]
+            if data:
+                child["data"] += data
+                # A resident DVR process answers with one line and waits for the next trigger
+                if not (child["resident"] and child["data"].endswith(b"\n")):
+                    continue
+                poller.unregister(fd)
+                children.pop(fd)
+            else:
+                # End of the pipe - the DVR process is done
+                poller.unregister(fd)
+                os.close(fd)
+                children.pop(fd)
+                os.waitpid(child["pid"], 0)
+                if child["resident"]:
+                    del unit_workers[child["unit"]["name"]]
+            try:
+                results.append(json.loads(child["data"]))
+            except ValueError:
+                results.append(unit_failure(child["unit"]["name"], time.monotonic() - started,
+                                            "DVR process ended without a result"))
+    
+    # One aggregate result: per-DVR metrics and notifications folded into this run's
+    failed = []
+    for result in sorted(results, key=lambda result: result["name"]):
+        name = result["name"]
+        if result["metrics"]:
+            metrics.merge(result["metrics"], name)
+        for level, message in result["notifications"]:
+            send_notification(f"[{name}] {message}", level)
+        if result["exit_code"] == 0:
+            units_done.add(name)
+        else:
+            failed.append(name)
+        log_message(f"{name}: {'shut down' if result['exit_code'] == 0 else 'FAILED'} "
+                    f"in {result['seconds']:.1f} seconds ({result['reports']} reports)")
+    
+    slowest = max(results, key=lambda result: result["seconds"])
+    summary = (f"{len(results) - len(failed)}/{len(results)} DVRs shut down in {time.monotonic() - started:.1f} "
+               f"seconds (slowest: {slowest['name']}, {slowest['seconds']:.1f} seconds)")
+    if failed:
+        log_message(f"Site shutdown on {hostname} incomplete: {summary}; failed: {', '.join(failed)}", "error")
+        return 1
+    log_message(summary)
+    send_notification(f"Site shutdown on {hostname}: {summary}", "info")
+    return 0
+
+def shutdown_dvr(hostname, run_deadline):
+    """Home the cursor and play the shutdown sequence on this process's DVR.
+    Returns the exit code."""
+    start_time = time.time()
+    exit_code = 0
+    
+    try:
+        # The sequence homes as far as its position model needs - regardless of what
+        # other mice might have done, since an old model isn't trusted
+        success = perform_shutdown_sequence(run_deadline)
         if not success:
             error_msg = "Shutdown sequence failed"
             log_message(error_msg, "error")
             send_notification(f"DVR shutdown failed on {hostname}: {error_msg}", "error")
-            sys.exit(1)
-            
-        elapsed_time = time.time() - start_time
-        log_message(f"Shutdown sequence completed in {elapsed_time:.1f} seconds")
+            exit_code = 1
+        else:
+            elapsed_time = time.time() - start_time
+            log_message(f"Shutdown sequence completed in {elapsed_time:.1f} seconds")
         
+    except DeadlineExceeded as e:
+        error_msg = f"Shutdown ran out of time: {e}"
+        log_message(error_msg, "error")
+        send_notification(f"DVR shutdown failed on {hostname}: {error_msg}", "error")
+        exit_code = 1
     except KeyboardInterrupt:
         # Handle manual interruption
         log_message("\nOperation cancelled by user", "warning")
         send_notification(f"DVR shutdown cancelled by user on {hostname}", "warning")
-        sys.exit(130)
+        exit_code = 130
     except Exception as e:
         # Handle unexpected errors
         error_msg = f"Unexpected error: {e}"
         log_message(error_msg, "error")
         send_notification(f"DVR shutdown failed on {hostname}: {error_msg}", "error")
-        sys.exit(1)
+        exit_code = 1
+    
+    # Where the cursor was left, for the next trigger if this one didn't finish the job
+    save_cursor_state()
+    return exit_code
+
+def run_shutdown(hostname, deadline=None, started=PROCESS_START):
+    """Shut the DVR (or every DVR in DVR_UNITS) down, then the Pi. Returns the process exit code.
+    started is what the first HID report's latency is measured from: process start, or the trigger."""
+    # Execute the shutdown sequence
+    log_message("Starting DVR shutdown process...")
+    
+    # Set a timeout for the entire operation
+    start_time = time.time()
+    max_runtime = 120  # 2 minutes max runtime
+    run_deadline = Deadline(max_runtime, deadline)
+    metrics.reset(started)
+    
+    if DVR_UNITS:
+        # The DVR processes are forked before the background checks start their thread;
+        # the daemon forked its resident ones before it started any
+        units = trigger_units(hostname, run_deadline) if unit_workers else start_units(hostname, run_deadline)
+        background = start_background_checks()
+        exit_code = finish_units(units, hostname, run_deadline)
+    else:
+        background = start_background_checks()
+        exit_code = shutdown_dvr(hostname, run_deadline)
+    
+    if metrics.first_report is not None:
+        log_message(f"First HID report {metrics.first_report_seconds() * 1000:.0f} ms after "
+                    f"{'start-up' if started == PROCESS_START else 'the trigger'}")
+    background.join(max(0.0, metrics.started + BACKGROUND_CHECK_BUDGET - time.monotonic()))
+    if background.is_alive():
+        log_message(f"Background checks still running after {BACKGROUND_CHECK_BUDGET} seconds, not waiting", "warning")
+    
+    if exit_code != 0:
+        metrics.export(success=False)
+        log_buffer.flush()
+        return exit_code
     
     # Check if we exceeded the timeout
     if time.time() - start_time > max_runtime:
         log_message(f"Warning: Shutdown sequence took longer than expected ({max_runtime} seconds)", "warning")
         send_notification(f"DVR shutdown on {hostname} completed but exceeded expected runtime", "warning")
     
+    log_message(f"HID output: {hid.reports_sent} reports at {hid.reports_per_second():.0f} reports/s")
+    hid.close()
+    keyboard.close()
+    ui_watcher.close()
+    
     log_message(f"DVR Shutdown Script Completed: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     log_message("="*50)
     
@@ -525,6 +3439,12 @@ if __name__ == "__main__":
     log_message("DVR successfully shut down. Now shutting down Raspberry Pi...")
     send_notification(f"DVR successfully shut down on {hostname}. Raspberry Pi is now shutting down.", "info")
     
+    # Deliver the run's digest while the network is still up
+    if not notifier.flush():
+        log_message(f"Notification digest not delivered within {NOTIFY_TIME_BUDGET} seconds", "warning")
+    
+    metrics.export(success=True)
+    
     # Flush the log file to ensure all messages are written before shutdown
     logging.shutdown()
     
@@ -532,4 +3452,345 @@ if __name__ == "__main__":
     log_message("Executing system shutdown command...")
     os.system("sudo shutdown -h now")
     
-    sys.exit(0)
+    return 0
+
+# Daemon mode: triggers arrive on a UNIX socket (e.g. from the NUT upsmon
+# NOTIFYCMD hook) or from a GPIO-style value file
+DAEMON_SOCKET = "/run/dvr-automator.sock"
+# Group given read/write access to DAEMON_SOCKET (mode 0660). upsmon runs NOTIFYCMD as
+# its unprivileged RUN_AS_USER, so this is that user's group - "nut" on Debian/Raspbian.
+# None keeps the socket root-only.
+DAEMON_SOCKET_GROUP = "nut"
+TRIGGER_EVENTS = ("LOWBATT", "FSD", "SHUTDOWN")  # NUT NOTIFYTYPEs that start the shutdown
+# ONBATT alone is a mains blip as often as an outage. With a grace period set it starts
+# the shutdown only if no ONLINE arrives within that many seconds (upsmon needs
+# NOTIFYFLAG ONBATT and ONLINE set to EXEC); None ignores ONBATT.
+ONBATT_GRACE = None
+TRIGGER_FILE = None          # e.g. "/sys/class/gpio/gpio17/value"; any file works for local testing
+TRIGGER_FILE_ACTIVE = "1"    # Value that means the event below; any other value sends ONLINE
+TRIGGER_FILE_EVENT = "LOWBATT"  # A UPS low-battery line; "ONBATT" for an on-battery line (see ONBATT_GRACE)
+TRIGGER_FILE_POLL_INTERVAL = 0.05  # Fallback re-read interval when the file has no edge notification
+
+def send_trigger(event):
+    """Hand a power event to a running daemon. Returns the process exit code."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(DEFAULT_OPERATION_TIMEOUT)
+            client.connect(DAEMON_SOCKET)
+            client.sendall(event.encode() + b"\n")
+            reply = client.recv(256).decode().strip()
+    except OSError as e:
+        print(f"Could not reach DVR shutdown daemon at {DAEMON_SOCKET}: {e}")
+        return 1
+    
+    print(f"{event}: {reply}")
+    return 0 if reply in ("queued", "armed", "cancelled", "busy", "duplicate", "ignored") else 1
+
+class ShutdownDaemon:
+    """Keeps the gadget bound, the HID device open and the sequence compiled,
+    then runs one shutdown per power-fail trigger."""
+
+    def __init__(self, hostname):
+        self.hostname = hostname
+        # Room for exactly one pending trigger - duplicates are dropped, never stacked
+        self.events = queue.Queue(maxsize=1)
+        self.busy = threading.Event()
+        self.stopping = threading.Event()
+        # Pending ONBATT_GRACE timer - an ONLINE before it fires cancels the shutdown
+        self.onbatt = None
+        self.lock = threading.Lock()
+        # Cancelled on SIGTERM so a running sequence stops at its next wait or write
+        self.deadline = Deadline()
+
+    def submit(self, event, source):
+        event = event.strip().upper()
+        if event == "ONLINE":
+            return self.cancel_onbatt(source)
+        if event == "ONBATT" and ONBATT_GRACE is not None:
+            return self.arm_onbatt(source)
+        if event not in TRIGGER_EVENTS:
+            log_message(f"Ignoring '{event}' from {source}")
+            return "ignored"
+        return self.queue_shutdown(event, source)
+
+    def arm_onbatt(self, source):
+        with self.lock:
+            if self.busy.is_set():
+                return "busy"
+            if self.onbatt is not None:
+                return "duplicate"
+            log_message(f"ONBATT from {source}, shutting down unless power returns within {ONBATT_GRACE} seconds",
+                        "warning")
+            self.onbatt = threading.Timer(ONBATT_GRACE, self.onbatt_expired, args=(source,))
+            self.onbatt.daemon = True
+            self.onbatt.start()
+        return "armed"
+
+    def cancel_onbatt(self, source):
+        with self.lock:
+            if self.onbatt is None:
+                log_message(f"Ignoring 'ONLINE' from {source}")
+                return "ignored"
+            self.onbatt.cancel()
+            self.onbatt = None
+        log_message(f"Power back (ONLINE from {source}), shutdown cancelled")
+        return "cancelled"
+
+    def onbatt_expired(self, source):
+        with self.lock:
+            if self.onbatt is None:
+                return
+            self.onbatt = None
+        log_message(f"Still on battery {ONBATT_GRACE} seconds after ONBATT")
+        self.queue_shutdown("ONBATT", source)
+
+    def queue_shutdown(self, event, source):
+        if self.busy.is_set():
+            log_message(f"Shutdown already running, ignoring {event} from {source}", "warning")
+            return "busy"
+        try:
+            self.events.put_nowait((event, source))
+        except queue.Full:
+            log_message(f"Shutdown already pending, ignoring {event} from {source}", "warning")
+            return "duplicate"
+        return "queued"
+
+    def serve_socket(self, server):
+        while not self.stopping.is_set():
+            try:
+                connection, _ = server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            with connection:
+                try:
+                    connection.settimeout(1.0)
+                    event = connection.recv(256).decode(errors="replace")
+                    connection.sendall(self.submit(event, "socket").encode() + b"\n")
+                except OSError as e:
+                    log_message(f"Trigger socket error: {e}", "warning")
+
+    def watch_trigger_file(self):
+        # sysfs GPIO values with an edge configured wake poll() with POLLPRI;
+        # plain files never do, so the poll timeout turns into a re-read interval
+        try:
+            fd = os.open(TRIGGER_FILE, os.O_RDONLY)
+        except OSError as e:
+            log_message(f"Cannot watch trigger file {TRIGGER_FILE}: {e}", "error")
+            return
+        
+        poller = select.poll()
+        poller.register(fd, select.POLLPRI | select.POLLERR)
+        previous = None
+        try:
+            while not self.stopping.is_set():
+                os.lseek(fd, 0, os.SEEK_SET)
+                value = os.read(fd, 64).decode(errors="replace").strip()
+                if value == TRIGGER_FILE_ACTIVE and previous != TRIGGER_FILE_ACTIVE:
+                    self.submit(TRIGGER_FILE_EVENT, TRIGGER_FILE)
+                elif value != TRIGGER_FILE_ACTIVE and previous == TRIGGER_FILE_ACTIVE:
+                    self.submit("ONLINE", TRIGGER_FILE)
+                previous = value
+                poller.poll(TRIGGER_FILE_POLL_INTERVAL * 1000)
+        finally:
+            os.close(fd)
+
+    def stop(self):
+        self.stopping.set()
+        self.deadline.cancel()
+        with self.lock:
+            if self.onbatt is not None:
+                self.onbatt.cancel()
+                self.onbatt = None
+
+    def prewarm(self):
+        # Everything the shutdown path needs, done before any power event.
+        # With DVR_UNITS each DVR's resident process pre-warms its own.
+        if DVR_UNITS:
+            return
+        load_shutdown_sequence()
+        ui_watcher.start()
+        link_watchdog.start()
+        hid.open()
+        if KEYBOARD_ENABLED:
+            keyboard.open()
+
+    def run(self):
+        global daemon_mode
+        
+        log_message("Starting DVR shutdown daemon...")
+        daemon_mode = True
+        if DVR_UNITS:
+            # Forked while this is still the only thread
+            fork_unit_workers(self.hostname)
+        try:
+            self.prewarm()
+        except Exception as e:
+            log_message(f"Failed to prepare shutdown path: {e}", "error")
+            return 1
+        
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        
+        if os.path.exists(DAEMON_SOCKET):
+            os.unlink(DAEMON_SOCKET)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(DAEMON_SOCKET)
+        os.chmod(DAEMON_SOCKET, 0o660)
+        if DAEMON_SOCKET_GROUP:
+            import grp
+            try:
+                os.chown(DAEMON_SOCKET, -1, grp.getgrnam(DAEMON_SOCKET_GROUP).gr_gid)
+            except (KeyError, OSError) as e:
+                log_message(f"Could not give group '{DAEMON_SOCKET_GROUP}' access to {DAEMON_SOCKET} "
+                            f"({e}); --notify from upsmon will be refused", "warning")
+        server.listen(4)
+        server.settimeout(0.5)
+        threading.Thread(target=self.serve_socket, args=(server,), daemon=True).start()
+        
+        if TRIGGER_FILE:
+            threading.Thread(target=self.watch_trigger_file, daemon=True).start()
+        
+        log_message(f"Waiting for power events on {DAEMON_SOCKET}" + (f" and {TRIGGER_FILE}" if TRIGGER_FILE else ""))
+        log_buffer.flush()  # the startup lines are on disk before the daemon goes idle
+        
+        exit_code = 0
+        try:
+            while not self.stopping.is_set():
+                try:
+                    event, source = self.events.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                
+                self.busy.set()
+                started = time.monotonic()
+                log_message(f"Power event {event} from {source}, starting shutdown")
+                exit_code = run_shutdown(self.hostname, self.deadline, started)
+                if exit_code == 0:
+                    break
+                
+                notifier.flush()
+                
+                # Sequence failed - drop anything that slipped in while it ran
+                # and stay up so a fresh trigger can retry
+                while not self.events.empty():
+                    self.events.get_nowait()
+                self.busy.clear()
+        except KeyboardInterrupt:
+            exit_code = 130
+        finally:
+            self.stopping.set()
+            server.close()
+            if os.path.exists(DAEMON_SOCKET):
+                os.unlink(DAEMON_SOCKET)
+            stop_unit_workers()
+        
+        return exit_code
+
+def main():
+    global DEVICE_PATH, DVR_MODEL, FRAME_SOURCE, SCREEN_RESOLUTION
+    
+    parser = argparse.ArgumentParser(description="Hikvision DVR shutdown automation")
+    parser.add_argument("--daemon", action="store_true",
+                        help="stay resident with the shutdown path pre-warmed and wait for power events")
+    parser.add_argument("--trigger", metavar="EVENT",
+                        help="send a power event (e.g. LOWBATT) to a running daemon")
+    parser.add_argument("--notify", nargs="?", const="", metavar="MESSAGE",
+                        help="NUT upsmon NOTIFYCMD hook: forward $NOTIFYTYPE to a running daemon")
+    parser.add_argument("--model", metavar="NAME",
+                        help=f"DVR model: sequence from {SEQUENCE_FILE} and profile from {PROFILE_DIR} (default: {DVR_MODEL})")
+    parser.add_argument("--list-models", action="store_true", help="list the models in the sequence library")
+    parser.add_argument("--resolution", metavar="WxH",
+                        help="DVR output resolution, when it can't be detected from --frames (e.g. 1280x1024)")
+    parser.add_argument("--calibrate", action="store_true",
+                        help="measure the DVR's pointer acceleration and save it in the model profile "
+                             "(the cursor is located on --frames; without them positions are asked for, "
+                             "which only a bench setup can answer)")
+    parser.add_argument("--tune", action="store_true",
+                        help="find the shortest reliable delays by rehearsing the sequence short of its last step, "
+                             "and save them in the model profile (checked on --frames, else asked)")
+    parser.add_argument("--frames", metavar="SOURCE",
+                        help="watch the DVR screen for menus/dialogs: a V4L2 capture device or a directory of PNG frames")
+    parser.add_argument("--capture-ui", metavar="STATE",
+                        help=f"save the current frame's region as the STATE template in {UI_TEMPLATE_DIR}")
+    parser.add_argument("--replay", metavar="FILE", help="play a DVRRecorder.py recording instead of the shutdown")
+    parser.add_argument("--history", nargs="?", type=int, const=20, metavar="N",
+                        help="show the last N runs (default 20) from the run history")
+    parser.add_argument("--failed", action="store_true", help="with --history: only failed runs")
+    parser.add_argument("--since", type=float, metavar="DAYS", help="with --history: only runs from the last DAYS days")
+    parser.add_argument("--steps", action="store_true", help="with --history: per-step timing across the selected runs")
+    parser.add_argument("--device", metavar="PATH",
+                        help=f"HID device to drive instead of {DEVICE_PATH} (e.g. unix:/tmp/hidg0.sock for DVRSimulator.py)")
+    args = parser.parse_args()
+    
+    if args.device:
+        DEVICE_PATH = hid.path = args.device
+    if args.model:
+        DVR_MODEL = args.model
+    if args.frames:
+        FRAME_SOURCE = args.frames
+    if args.resolution:
+        width, height = args.resolution.lower().split("x")
+        SCREEN_RESOLUTION = (int(width), int(height))
+    
+    if args.list_models:
+        for name, model in sorted(load_sequence_library().items()):
+            resolution = "x".join(str(v) for v in model.get("resolution", [])) or "-"
+            print(f"{name:<24} {resolution:<10} {model.get('description', '')}")
+        sys.exit(0)
+    if args.history is not None:
+        sys.exit(show_history(args.history, args.failed, args.since, args.steps))
+    if args.trigger:
+        sys.exit(send_trigger(args.trigger))
+    if args.notify is not None:
+        sys.exit(send_trigger(os.environ.get("NOTIFYTYPE", "")))
+    
+    # Start logging session
+    log_message("="*50)
+    log_message(f"DVR Shutdown Script Started: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    
+    # Check hostname for logging purposes
+    hostname = socket.gethostname()
+    log_message(f"Running on host: {hostname}")
+    
+    # The model's sequence is loaded, validated and scaled once, before anything is sent
+    try:
+        load_sequence_model(required=bool(args.model), detect=bool(args.calibrate or args.tune or args.capture_ui))
+        problems = validate_units()
+        error_msg = f"Invalid DVR_UNITS: {'; '.join(problems)}" if problems else None
+    except ValueError as e:
+        error_msg = str(e)
+    
+    if args.capture_ui and not error_msg:
+        if args.capture_ui not in UI_STATES:
+            sys.exit(f"Unknown UI state '{args.capture_ui}' (known: {', '.join(sorted(UI_STATES))})")
+        if not ui_watcher.start():
+            sys.exit("No usable frame source - pass --frames")
+        time.sleep(0.5)  # let a capture device deliver its first frame
+        saved = ui_watcher.capture_template(args.capture_ui)
+        ui_watcher.close()
+        sys.exit(0 if saved else "No frame captured")
+    
+    error_msg = error_msg or preflight()
+    if error_msg:
+        log_message(error_msg, "error")
+        send_notification(f"DVR shutdown failed on {hostname}: {error_msg}", "error")
+        exit_code = 1
+    elif args.replay:
+        exit_code = 0 if play_recording(args.replay) else 1
+    elif args.calibrate:
+        # The cursor is read off the frame source; asking is for bench setups without one
+        exit_code = 0 if calibrate_acceleration(locate_cursor if ui_watcher.start() else ask_cursor_position) else 1
+    elif args.tune:
+        exit_code = 0 if tune_timing() else 1
+    elif args.daemon:
+        exit_code = ShutdownDaemon(hostname).run()
+    else:
+        exit_code = run_shutdown(hostname)
+    
+    # Anything not yet delivered (failures end here rather than in a Pi shutdown)
+    notifier.flush()
+    sys.exit(exit_code)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+# Hikvision IP Seurity DVR Shutdown Automation Script
+# Copyright (c) 2019 CFCS - C. Formeister, w/ assistance from G. Kessler & B. Stone
+# w/ HID information by Google Open Source results
+# for Chris Formeister Computer Svcs. Phoenix, AZ
+#
+# Version 1.1a
+# This script is for use for specific purposes of client of Chris Formeister Computer Services.
+# Reproduction or other use is prohibited without the express consent of Chris Formeister Computer Services
+"""
+
+#!/usr/bin/env python3
+
+# Turns usbmon captures of a physical mouse into recordings DVRAutomator.py can replay.
+# A technician plugs a real mouse into the DVR through a machine running usbmon, pushes
+# the cursor into the top-left corner, starts the capture and walks through the workflow:
+#
+#   cat /sys/kernel/debug/usb/usbmon/1u > menu.txt      # or: tcpdump -i usbmon1 -w menu.pcap
+#   python3 DVRRecorder.py --import menu.txt --output recordings/menu.json --speed 4
+#   sudo python3 DVRAutomator.py --replay recordings/menu.json
+#
+# Text (usbmon 'u' format), pcap and pcapng captures are read. Reports that neither move
+# nor change buttons are dropped, idle gaps are cut to --max-gap, and --speed compresses
+# the motion while the pauses after clicks, where the DVR draws its menus, are kept.
+
+import os
+import sys
+import json
+import struct
+import argparse
+import collections
+
+import DVRAutomator as dvr
+
+# Where the buttons, X and Y fields sit in the captured mouse's reports:
+# (buttons offset, X offset, Y offset, bytes per axis - signed little-endian)
+REPORT_LAYOUTS = {
+    "boot": (0, 1, 2, 1),       # boot protocol: buttons, X, Y[, wheel]
+    "report-id": (1, 2, 3, 1),  # boot layout after a report ID byte
+    "wide16": (0, 2, 4, 2),     # 16-bit buttons, X and Y, common on newer mice
+}
+
+MAX_GAP = 1.0  # Longest pause kept in a recording (seconds)
+SPEED = 1.0    # Motion time-compression factor
+
+# usbmon pcap link types and their per-packet header sizes
+USBMON_LINKTYPES = {189: 48, 220: 64}
+USBMON_HEADER = "QBBBBHbbqiiII"  # id, event, transfer type, endpoint, device, bus, flags, ts, status, lengths
+TRANSFER_INTERRUPT = 1
+
+def parse_usbmon_text(path):
+    """Interrupt-IN completions from a usbmon text capture: (seconds, "bus:device", data)"""
+    offset = 0
+    previous = None
+    with open(path) as f:
+        for line in f:
+            # tag timestamp event address status[:interval] length = data words
+            fields = line.split()
+            if len(fields) < 8 or fields[2] != "C" or fields[6] != "=":
+                continue
+            kind, bus, device, _ = fields[3].split(":")
+            if kind != "Ii":
+                continue
+
+            # The microsecond timestamp is 32 bits wide and wraps about every 71 minutes
+            stamp = int(fields[1])
+            if previous is not None and stamp < previous:
+                offset += 1 << 32
+            previous = stamp
+            yield (stamp + offset) / 1e6, f"{int(bus)}:{int(device)}", bytes.fromhex("".join(fields[7:]))
+
+def read_pcap_packets(data):
+    """(link type, packet, endian) for every packet of a pcap or pcapng capture"""
+    if data[:4] == b"\x0a\x0d\x0d\x0a":
+        endian = "<" if data[8:12] == b"\x4d\x3c\x2b\x1a" else ">"
+        linktypes = []
+        offset = 0
+        while offset + 12 <= len(data):
+            block_type, length = struct.unpack_from(endian + "II", data, offset)
+            if length < 12:
+                break
+            if block_type == 0x0A0D0D0A:
+                # Each section starts its own interface numbering
+                linktypes = []
+            elif block_type == 1:
+                linktypes.append(struct.unpack_from(endian + "H", data, offset + 8)[0])
+            elif block_type == 6:
+                interface, _, _, captured = struct.unpack_from(endian + "IIII", data, offset + 8)
+                yield linktypes[interface], data[offset + 28:offset + 28 + captured], endian
+            elif block_type == 3:
+                captured = min(struct.unpack_from(endian + "I", data, offset + 8)[0], length - 16)
+                yield linktypes[0], data[offset + 12:offset + 12 + captured], endian
+            offset += length
+        return
+
+    magic = data[:4]
+    if magic in (b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1"):
+        endian = "<"
+    elif magic in (b"\xa1\xb2\xc3\xd4", b"\xa1\xb2\x3c\x4d"):
+        endian = ">"
+    else:
+        raise ValueError("not a pcap or pcapng capture")
+    linktype = struct.unpack_from(endian + "I", data, 20)[0]
+    offset = 24
+    while offset + 16 <= len(data):
+        captured = struct.unpack_from(endian + "I", data, offset + 8)[0]
+        yield linktype, data[offset + 16:offset + 16 + captured], endian
+        offset += 16 + captured
+
+def parse_usbmon_pcap(path):
+    """Interrupt-IN completions from a pcap/pcapng usbmon capture: (seconds, "bus:device", data)"""
+    with open(path, "rb") as f:
+        data = f.read()
+    for linktype, packet, endian in read_pcap_packets(data):
+        header_size = USBMON_LINKTYPES.get(linktype)
+        if header_size is None or len(packet) < header_size:
+            continue
+        (_, event, transfer, endpoint, device, bus, _, data_flag,
+         seconds, microseconds, _, _, captured) = struct.unpack_from(endian + USBMON_HEADER, packet)
+        if event != ord("C") or transfer != TRANSFER_INTERRUPT or not endpoint & 0x80 or data_flag != 0:
+            continue
+        yield seconds + microseconds / 1e6, f"{bus}:{device}", packet[header_size:header_size + captured]
+
+def read_capture(path):
+    with open(path, "rb") as f:
+        head = f.read(4)
+    if head in (b"\x0a\x0d\x0d\x0a", b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1", b"\xa1\xb2\xc3\xd4", b"\xa1\xb2\x3c\x4d"):
+        return list(parse_usbmon_pcap(path))
+    return list(parse_usbmon_text(path))
+
+def decode_reports(transfers, layout, device=None):
+    """Mouse reports of one device as (seconds, buttons, dx, dy). Without a device
+    the busiest interrupt-IN device in the capture is taken to be the mouse."""
+    if device is None:
+        counts = collections.Counter(address for _, address, _ in transfers)
+        if not counts:
+            raise ValueError("no interrupt-IN transfers in the capture")
+        device = counts.most_common(1)[0][0]
+    buttons_at, x_at, y_at, size = layout
+
+    reports = []
+    for seconds, address, data in transfers:
+        if address != device or len(data) < y_at + size:
+            continue
+        dx = int.from_bytes(data[x_at:x_at + size], "little", signed=True)
+        dy = int.from_bytes(data[y_at:y_at + size], "little", signed=True)
+        reports.append((seconds, data[buttons_at] & 0x07, dx, dy))
+    return device, reports
+
+def compact_reports(reports, max_gap=MAX_GAP, speed=SPEED):
+    """Replay events [gap, buttons, dx, dy]: reports that neither move nor change the
+    buttons are dropped, pauses are cut to max_gap, and motion runs `speed` times
+    faster. The pause after a button change is kept, so the DVR can draw its menu."""
+    events = []
+    buttons = 0
+    last_seconds = None
+    last_changed_buttons = False
+
+    for seconds, report_buttons, dx, dy in reports:
+        if dx == 0 and dy == 0 and report_buttons == buttons:
+            continue
+
+        gap = 0.0 if last_seconds is None else min(seconds - last_seconds, max_gap)
+        if not last_changed_buttons:
+            gap /= speed
+        events.append([round(gap, 4), report_buttons, dx, dy])
+
+        last_changed_buttons = report_buttons != buttons
+        buttons = report_buttons
+        last_seconds = seconds
+
+    # Never leave a button held down at the end of a replay
+    if buttons:
+        events.append([dvr.CLICK_PRESS_DELAY, 0, 0, 0])
+    return events
+
+def import_capture(args):
+    layout = REPORT_LAYOUTS.get(args.layout) or tuple(int(value) for value in args.layout.split(","))
+    transfers = read_capture(args.capture)
+    device, reports = decode_reports(transfers, layout, args.device)
+    events = compact_reports(reports, args.max_gap, args.speed)
+
+    recording = {
+        "format": "dvr-recording",
+        "version": 1,
+        "source": os.path.basename(args.capture),
+        "device": device,
+        "layout": args.layout,
+        "duration": round(sum(event[0] for event in events), 3),
+        "events": events,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(recording, f, separators=(",", ":"))
+
+    print(f"{args.capture}: device {device}, {len(reports)} reports -> {len(events)} events, "
+          f"{recording['duration']:.2f} seconds (captured {reports[-1][0] - reports[0][0]:.2f})"
+          if reports else f"{args.capture}: no reports from device {device}")
+    return 0 if events else 1
+
+def show_recording(path):
+    recording = dvr.load_recording(path)
+    events = recording["events"]
+    clicks = sum(1 for previous, event in zip([[0, 0, 0, 0]] + events, events) if event[1] & ~previous[1])
+    reports, (x, y) = dvr.plan_recording(recording)
+    print(f"{path}: {len(events)} events, {len(reports)} reports, {clicks} clicks, "
+          f"{recording['duration']:.2f} seconds, ends near ({x}, {y}) without acceleration")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Import usbmon mouse captures as DVR recordings")
+    parser.add_argument("--import", dest="capture", metavar="CAPTURE", help="usbmon text, pcap or pcapng capture")
+    parser.add_argument("--output", metavar="FILE", help="recording to write")
+    parser.add_argument("--layout", default="boot",
+                        help=f"report layout: {', '.join(REPORT_LAYOUTS)} or BUTTONS,X,Y,SIZE offsets")
+    parser.add_argument("--device", metavar="BUS:DEV", help="mouse address in the capture (default: busiest device)")
+    parser.add_argument("--max-gap", type=float, default=MAX_GAP, help="longest pause to keep, in seconds")
+    parser.add_argument("--speed", type=float, default=SPEED, help="speed up motion by this factor")
+    parser.add_argument("--info", metavar="FILE", help="describe a recording")
+    args = parser.parse_args()
+
+    if args.info:
+        sys.exit(show_recording(args.info))
+    if args.capture and args.output:
+        sys.exit(import_capture(args))
+    parser.print_help()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,617 @@
+"""
+# Hikvision IP Seurity DVR Shutdown Automation Script
+# Copyright (c) 2019 CFCS - C. Formeister, w/ assistance from G. Kessler & B. Stone
+# w/ HID information by Google Open Source results
+# for Chris Formeister Computer Svcs. Phoenix, AZ
+#
+# Version 1.1a
+# This script is for use for specific purposes of client of Chris Formeister Computer Services.
+# Reproduction or other use is prohibited without the express consent of Chris Formeister Computer Services
+"""
+
+#!/usr/bin/env python3
+
+# Virtual HID sink and simulated DVR screen, plus benchmarks for the shutdown path.
+# Stands in for /dev/hidg0 and the Hikvision UI so the sequence can be timed and
+# regression-tested without a Pi wired to a recorder.
+#
+#   python3 DVRSimulator.py --benchmark                  # run the benchmark suite
+#   python3 DVRSimulator.py --serve unix:/tmp/hidg0.sock # sink for DVRAutomator.py --device ...
+
+import os
+import sys
+import time
+import math
+import json
+import random
+import select
+import shutil
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+import contextlib
+import statistics
+
+import DVRAutomator as dvr
+
+# Pointer acceleration models: (threshold in counts, extra gain per count above it, max gain).
+# Synthetic curves meant to show drift, not measurements of a particular DVR.
+ACCELERATION_MODELS = {
+    "none": (0, 0.0, 1.0),
+    "mild": (6, 0.02, 2.0),
+    "hikvision": (4, 0.04, 3.0),
+}
+
+HIT_RADIUS = 20      # Half-size (px) of a menu item's clickable box
+MENU_DELAY = 0.3     # Time the simulated menu takes to draw
+DIALOG_DELAY = 0.3   # Time the simulated confirmation dialog takes to draw
+
+# Report sizes for FIFO sinks, which don't keep report boundaries
+REPORT_SIZES = {"relative": 3, "absolute": 5, "keyboard": 8}
+
+BACKGROUND_LEVEL = 24  # Gray level of the rendered "camera view" behind menus and dialogs
+CURSOR_WIDTH, CURSOR_HEIGHT = 12, 19  # Size of the rendered pointer arrow
+
+def ui_flow():
+    # (state, target, mouse button, next state) following the shutdown sequence: each
+    # step leads to the state it expects (or stays put), the last one shuts the DVR down
+    flow = []
+    state = "live"
+    for number, (_, target, button, _, expect, *_) in enumerate(dvr.SHUTDOWN_STEPS, 1):
+        next_state = "shutdown" if number == len(dvr.SHUTDOWN_STEPS) else expect or state
+        flow.append((state, target, button, next_state))
+        state = next_state
+    return flow
+
+def load_model(model):
+    # Models that confirm with key chords get the keyboard function; the simulated
+    # DVR reads keyboard reports from the same sink as the mouse ones
+    dvr.DVR_MODEL = model
+    entry = dvr.load_sequence_library().get(model, {})
+    if entry.get("method") == "macro" and dvr.macro_needs_keyboard(entry.get("macro", [])):
+        dvr.KEYBOARD_ENABLED = True
+    dvr.load_sequence_model(required=True)
+
+class SimulatedDvr:
+    """Cursor and UI model of a DVR: applies HID reports with pointer
+    acceleration and edge clamping, and fires menu/dialog clicks."""
+
+    def __init__(self, width=None, height=None, acceleration="none",
+                 menu_delay=MENU_DELAY, dialog_delay=DIALOG_DELAY):
+        # Defaults to the screen of the sequence DVRAutomator has loaded
+        width = width or dvr.SCREEN_WIDTH
+        height = height or dvr.SCREEN_HEIGHT
+        self.width = width
+        self.height = height
+        self.acceleration_name = acceleration
+        self.acceleration = ACCELERATION_MODELS[acceleration]
+        self.delays = {"menu": menu_delay, "confirm": dialog_delay, "live": 0.0, "shutdown": 0.0}
+        self.flow = ui_flow()
+        self.lock = threading.Lock()
+        self.cursor = [width / 2, height / 2]
+        self.buttons = 0
+        self.keys = set()
+        self.state = "live"
+        self.state_ready = 0.0   # When the current state's UI has finished drawing
+        self.clicks = []         # (button, x, y, state, accepted)
+        self.reports = 0
+
+    def position(self):
+        with self.lock:
+            return round(self.cursor[0]), round(self.cursor[1])
+
+    def visible_state(self):
+        # The UI state once it has finished drawing, None while it is still coming up
+        with self.lock:
+            return self.state if time.monotonic() >= self.state_ready else None
+
+    def place(self, x, y):
+        with self.lock:
+            self.cursor = [float(x), float(y)]
+
+    def gain(self, dx, dy):
+        threshold, per_count, max_gain = self.acceleration
+        speed = math.hypot(dx, dy)
+        return min(max_gain, 1.0 + per_count * max(0.0, speed - threshold))
+
+    def apply_report(self, report, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.reports += 1
+            if len(report) == 8:
+                self.apply_keyboard(report, now)
+                return
+
+            if len(report) == 5:
+                # Absolute pointer: 16-bit positions scaled to the screen
+                buttons = report[0]
+                self.cursor[0] = (report[1] | report[2] << 8) * self.width / dvr.ABSOLUTE_MAX
+                self.cursor[1] = (report[3] | report[4] << 8) * self.height / dvr.ABSOLUTE_MAX
+            else:
+                # Relative boot mouse: signed deltas, scaled by the acceleration curve
+                buttons = report[0]
+                dx = report[1] - 256 if report[1] > 127 else report[1]
+                dy = report[2] - 256 if report[2] > 127 else report[2]
+                gain = self.gain(dx, dy)
+                self.cursor[0] += dx * gain
+                self.cursor[1] += dy * gain
+
+            # Edge clamping - the cursor stops at the screen border
+            self.cursor[0] = max(0.0, min(self.cursor[0], self.width - 1))
+            self.cursor[1] = max(0.0, min(self.cursor[1], self.height - 1))
+
+            pressed = buttons & ~self.buttons
+            self.buttons = buttons
+            for button in (1, 2, 4):
+                if pressed & button:
+                    self.click(button, now)
+
+    def click(self, button, now):
+        x, y = self.cursor
+        accepted = False
+        for state, (target_x, target_y), target_button, next_state in self.flow:
+            if (self.state == state and button == target_button and now >= self.state_ready
+                    and abs(x - target_x) <= HIT_RADIUS and abs(y - target_y) <= HIT_RADIUS):
+                self.enter(next_state, now)
+                accepted = True
+                break
+
+        # A stray click dismisses an open menu; the confirmation dialog is modal,
+        # though a right-click ("back" in the Hikvision menus) still backs out of it
+        if not accepted and (self.state == "menu" or self.state == "confirm" and button == 2):
+            self.enter("live", now)
+        self.clicks.append((button, round(x), round(y), self.state, accepted))
+
+    def apply_keyboard(self, report, now):
+        keys = set(code for code in report[2:] if code)
+        pressed = keys - self.keys
+        self.keys = keys
+        if self.state == "confirm" and now >= self.state_ready:
+            if dvr.KEY_CODES["ENTER"] in pressed:
+                self.enter("shutdown", now)
+            elif dvr.KEY_CODES["ESC"] in pressed:
+                self.enter("live", now)
+
+    def enter(self, state, now):
+        self.state = state
+        # States only a model's sequence knows draw like a menu
+        self.state_ready = now + self.delays.get(state, self.delays["menu"])
+
+def render_screen(state, width=None, height=None, cursor=None):
+    """Grayscale frame of the DVR screen: menus and dialogs are light panels with rows of
+    dark text, and the pointer (when given) a white arrow with its tip at `cursor`"""
+    np = dvr.np
+    frame = np.full((height or dvr.SCREEN_HEIGHT, width or dvr.SCREEN_WIDTH), BACKGROUND_LEVEL, np.uint8)
+    if state in dvr.UI_STATES:
+        x, y, w, h = dvr.UI_STATES[state]
+        frame[y:y + h, x:x + w] = 200
+        for row in range(y + 12, y + h - 12, 24):
+            frame[row:row + 8, x + 12:x + w - 12] = 40
+    if cursor is not None:
+        x, y = cursor
+        for row in range(CURSOR_HEIGHT):
+            frame[y + row:y + row + 1, x:x + 1 + row * CURSOR_WIDTH // CURSOR_HEIGHT] = 255
+    return frame
+
+class SimulatedFrameSource:
+    """Frame source for DVRAutomator's UI watcher, rendered from a SimulatedDvr"""
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+
+    def read(self):
+        return render_screen(self.simulator.visible_state(), self.simulator.width, self.simulator.height,
+                             self.simulator.position())
+
+    def close(self):
+        pass
+
+class VirtualHidSink:
+    """Stand-in for /dev/hidgN: accepts reports on a unix: seqpacket socket or
+    a FIFO and feeds each one into a SimulatedDvr."""
+
+    def __init__(self, path, simulator, report_size=REPORT_SIZES["relative"]):
+        self.path = path
+        self.simulator = simulator
+        self.report_size = report_size
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.path.startswith("unix:"):
+            address = self.path[len("unix:"):]
+            if os.path.exists(address):
+                os.unlink(address)
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            self.server.bind(address)
+            self.server.listen(4)
+            self.server.settimeout(0.2)
+            target = self.serve_socket
+        else:
+            if not os.path.exists(self.path):
+                os.mkfifo(self.path)
+            # O_RDWR keeps the FIFO open between writers instead of seeing EOF
+            self.fifo = os.open(self.path, os.O_RDWR)
+            target = self.serve_fifo
+        self.thread = threading.Thread(target=target, name="hid-sink", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(1.0)
+        if self.path.startswith("unix:"):
+            self.server.close()
+            if os.path.exists(self.path[len("unix:"):]):
+                os.unlink(self.path[len("unix:"):])
+        else:
+            os.close(self.fifo)
+
+    def serve_socket(self):
+        while not self.stopping.is_set():
+            try:
+                connection, _ = self.server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            threading.Thread(target=self.read_connection, args=(connection,), daemon=True).start()
+
+    def read_connection(self, connection):
+        connection.settimeout(0.2)
+        with connection:
+            while not self.stopping.is_set():
+                try:
+                    report = connection.recv(64)
+                except socket.timeout:
+                    continue
+                except OSError:
+                    return
+                if not report:
+                    return
+                self.simulator.apply_report(report)
+
+    def serve_fifo(self):
+        buffer = b""
+        while not self.stopping.is_set():
+            try:
+                ready, _, _ = select.select([self.fifo], [], [], 0.2)
+                if not ready:
+                    continue
+                buffer += os.read(self.fifo, 4096)
+            except OSError:
+                return
+            while len(buffer) >= self.report_size:
+                self.simulator.apply_report(buffer[:self.report_size])
+                buffer = buffer[self.report_size:]
+
+    def wait_for(self, reports, timeout=2.0):
+        # Writes are asynchronous; wait until the simulator has seen them all
+        deadline = time.monotonic() + timeout
+        while self.simulator.reports < reports and time.monotonic() < deadline:
+            time.sleep(0.001)
+        return self.simulator.reports >= reports
+
+@contextlib.contextmanager
+def quiet():
+    # The automator logs every move; keep benchmark output (and the real log) clean
+    logging.disable(logging.CRITICAL)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+class BenchmarkRig:
+    """Points DVRAutomator at a virtual sink and a scratch directory"""
+
+    def __init__(self, acceleration, mode, model=None):
+        self.workdir = tempfile.mkdtemp(prefix="dvr-bench-")
+        if model:
+            with quiet():
+                load_model(model)
+        self.simulator = SimulatedDvr(acceleration=acceleration)
+        self.sink = VirtualHidSink("unix:" + os.path.join(self.workdir, "hidg0.sock"), self.simulator).start()
+
+        dvr.HID_MODE = mode
+        dvr.DEVICE_PATH = dvr.hid.path = self.sink.path
+        dvr.KEYBOARD_DEVICE_PATH = dvr.keyboard.path = self.sink.path
+        for device in (dvr.hid, dvr.keyboard):
+            device.close()
+            device.reset_stats()
+        dvr.EMAIL_ENABLED = False
+        dvr.SEQUENCE_CACHE_DIR = os.path.join(self.workdir, "sequence_cache")
+        dvr.METRICS_TRACE_FILE = os.path.join(self.workdir, "trace.jsonl")
+        dvr.RUN_HISTORY_DB = os.path.join(self.workdir, "runs.sqlite")
+        dvr.METRICS_PROM_FILE = os.path.join(self.workdir, "missing", "dvr_automator.prom")
+        dvr.PROFILE_DIR = os.path.join(self.workdir, "profiles")
+        dvr.CURSOR_STATE_DIR = os.path.join(self.workdir, "cursor")
+        dvr.dvr_profile = None
+        dvr.compiled_sequence = None
+
+    def reset(self, cursor=None):
+        # Fresh UI state; the cursor starts where DVRAutomator believes it is unless told otherwise
+        self.simulator.state = "live"
+        self.simulator.clicks = []
+        self.simulator.buttons = 0
+        if cursor is not None:
+            self.forget_cursor()
+        x, y = cursor if cursor is not None else (dvr.current_x, dvr.current_y)
+        self.simulator.place(x, y)
+
+    def forget_cursor(self):
+        # Someone else moved the mouse: neither the live nor the saved position model holds
+        dvr.forget_cursor()
+        shutil.rmtree(dvr.CURSOR_STATE_DIR, ignore_errors=True)
+
+    def sync(self):
+        return self.sink.wait_for(dvr.hid.reports_sent)
+
+    def probe(self):
+        # Stands in for someone reading the cursor position off the DVR screen
+        self.sync()
+        return self.simulator.position()
+
+    def enable_ui_detection(self):
+        if not dvr.load_vision():
+            raise SystemExit("UI detection needs NumPy")
+        dvr.ui_watcher.source = SimulatedFrameSource(self.simulator)
+        for state, (x, y, w, h) in dvr.UI_STATES.items():
+            dvr.ui_watcher.add_template(state, render_screen(state)[y:y + h, x:x + w])
+
+    def calibrate(self):
+        # With UI detection the cursor is found on the rendered frames, as on a real DVR
+        probe = dvr.locate_cursor if dvr.ui_watcher.source is not None else self.probe
+        with quiet():
+            return dvr.calibrate_acceleration(probe)
+
+    def verify(self, state, timeout=0.0):
+        # Stands in for the UI watcher while tuning: is the state (None: live view) drawn
+        self.sync()
+        give_up = time.monotonic() + timeout
+        while self.simulator.visible_state() != (state or "live"):
+            if time.monotonic() >= give_up:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def tune(self):
+        with quiet():
+            return dvr.tune_timing(self.verify, timed=True)
+
+    def close(self):
+        dvr.hid.close()
+        dvr.ui_watcher.close()
+        self.sink.stop()
+
+def bench_sequence(rig, runs, warm=False):
+    # Warm runs start where the last one left the cursor, as a daemon's next trigger would
+    results = []
+    for _ in range(runs):
+        if warm:
+            rig.reset()
+        else:
+            rig.reset(cursor=(random.uniform(0, dvr.SCREEN_WIDTH), random.uniform(0, dvr.SCREEN_HEIGHT)))
+            dvr.current_x, dvr.current_y = dvr.SCREEN_WIDTH // 2, dvr.SCREEN_HEIGHT // 2
+        sent_before = dvr.hid.reports_sent
+
+        start = time.monotonic()
+        with quiet():
+            ok = dvr.perform_shutdown_sequence()
+        wall = time.monotonic() - start
+        rig.sync()
+
+        # Positional error of each click against the target it was aiming for
+        errors = [math.hypot(x - target[0], y - target[1])
+                  for (_, x, y, _, _), (_, target, _, _) in zip(rig.simulator.clicks, rig.simulator.flow)]
+        results.append({
+            "wall": wall, "reports": dvr.hid.reports_sent - sent_before,
+            "error": max(errors) if errors else float("nan"),
+            "success": ok and rig.simulator.state == "shutdown",
+        })
+    return results
+
+def bench_homing(rig, runs):
+    results = []
+    for _ in range(runs):
+        rig.reset(cursor=(random.uniform(0, dvr.SCREEN_WIDTH), random.uniform(0, dvr.SCREEN_HEIGHT)))
+        sent_before = dvr.hid.reports_sent
+
+        start = time.monotonic()
+        with quiet():
+            ok = dvr.ensure_known_position()
+        wall = time.monotonic() - start
+        rig.sync()
+
+        x, y = rig.simulator.position()
+        results.append({
+            "wall": wall, "reports": dvr.hid.reports_sent - sent_before,
+            "error": math.hypot(x - dvr.current_x, y - dvr.current_y), "success": ok,
+        })
+    return results
+
+def bench_moves(rig, target_sets, targets_per_set):
+    results = []
+    for _ in range(target_sets):
+        targets = [(random.randrange(dvr.SCREEN_WIDTH), random.randrange(dvr.SCREEN_HEIGHT))
+                   for _ in range(targets_per_set)]
+        rig.reset()
+        sent_before = dvr.hid.reports_sent
+        errors = []
+        ok = True
+
+        start = time.monotonic()
+        for target_x, target_y in targets:
+            with quiet():
+                ok = dvr.move_to_absolute(target_x, target_y) and ok
+            rig.sync()
+            x, y = rig.simulator.position()
+            errors.append(math.hypot(x - target_x, y - target_y))
+        wall = time.monotonic() - start
+
+        results.append({
+            "wall": wall, "reports": dvr.hid.reports_sent - sent_before,
+            "error": statistics.mean(errors), "success": ok,
+        })
+    return results
+
+def bench_site(rig, units, runs):
+    # One controller driving several simulated DVRs at once, each from its own process
+    simulators = [rig.simulator] + [SimulatedDvr(acceleration=rig.simulator.acceleration_name)
+                                    for _ in range(units - 1)]
+    sinks = [rig.sink] + [VirtualHidSink("unix:" + os.path.join(rig.workdir, f"hidg{index}.sock"), simulator).start()
+                          for index, simulator in enumerate(simulators[1:], 1)]
+    dvr.DVR_UNITS = [{"name": f"dvr{index}", "device": sink.path} for index, sink in enumerate(sinks)]
+
+    results = []
+    try:
+        for _ in range(runs):
+            for simulator in simulators:
+                simulator.state = "live"
+                simulator.clicks = []
+                simulator.buttons = 0
+                simulator.place(random.uniform(0, simulator.width), random.uniform(0, simulator.height))
+            rig.forget_cursor()
+            dvr.units_done.clear()
+            dvr.metrics.reset()
+            reports_before = sum(simulator.reports for simulator in simulators)
+
+            start = time.monotonic()
+            with quiet():
+                exit_code = dvr.shutdown_units("simulator", dvr.Deadline(dvr.SEQUENCE_TIMEOUT))
+            wall = time.monotonic() - start
+
+            results.append({
+                "wall": wall, "reports": sum(simulator.reports for simulator in simulators) - reports_before,
+                "error": float("nan"),
+                "success": exit_code == 0 and all(simulator.state == "shutdown" for simulator in simulators),
+            })
+    finally:
+        dvr.DVR_UNITS = []
+        for sink in sinks[1:]:
+            sink.stop()
+    return results
+
+def summarize(name, acceleration, results):
+    errors = [r["error"] for r in results if not math.isnan(r["error"])]
+    return {
+        "benchmark": name,
+        "acceleration": acceleration,
+        "runs": len(results),
+        "wall_mean": statistics.mean(r["wall"] for r in results),
+        "wall_max": max(r["wall"] for r in results),
+        "reports_mean": statistics.mean(r["reports"] for r in results),
+        "error_mean": statistics.mean(errors) if errors else float("nan"),
+        "error_max": max(errors) if errors else float("nan"),
+        "success_rate": sum(1 for r in results if r["success"]) / len(results),
+    }
+
+def run_benchmarks(args):
+    random.seed(args.seed)
+    summaries = []
+
+    for acceleration in args.accel:
+        rig = BenchmarkRig(acceleration, args.mode, args.model)
+        try:
+            if args.ui_detect:
+                # First, so calibration finds the cursor on the rendered frames
+                rig.enable_ui_detection()
+            if args.calibrated:
+                if not rig.calibrate():
+                    print(f"Calibration against {acceleration} failed", file=sys.stderr)
+                    return 1
+                acceleration += "+cal"
+            if args.tuned:
+                if not rig.tune():
+                    print(f"Timing tuning against {acceleration} failed", file=sys.stderr)
+                    return 1
+                acceleration += "+tuned"
+            if args.ui_detect:
+                acceleration += "+ui"
+            summaries.append(summarize("homing", acceleration, bench_homing(rig, args.runs)))
+            summaries.append(summarize("move_to_absolute", acceleration,
+                                       bench_moves(rig, args.target_sets, args.targets)))
+            if not args.skip_sequence:
+                summaries.append(summarize("shutdown_sequence", acceleration,
+                                           bench_sequence(rig, args.sequence_runs)))
+                summaries.append(summarize("sequence_warm", acceleration,
+                                           bench_sequence(rig, args.sequence_runs, warm=True)))
+            if args.site > 1:
+                summaries.append(summarize(f"site_shutdown_x{args.site}", acceleration,
+                                           bench_site(rig, args.site, args.sequence_runs)))
+        finally:
+            rig.close()
+
+    if args.json:
+        print(json.dumps(summaries, indent=2))
+        return 0
+
+    print(f"{'benchmark':<20} {'accel':<18} {'runs':>4} {'wall s':>8} {'max s':>8} "
+          f"{'reports':>8} {'err px':>8} {'max px':>8} {'ok':>5}")
+    for s in summaries:
+        print(f"{s['benchmark']:<20} {s['acceleration']:<18} {s['runs']:>4} {s['wall_mean']:>8.3f} "
+              f"{s['wall_max']:>8.3f} {s['reports_mean']:>8.1f} {s['error_mean']:>8.1f} "
+              f"{s['error_max']:>8.1f} {s['success_rate']:>5.0%}")
+    return 0
+
+def serve(args):
+    if args.model:
+        load_model(args.model)
+    simulator = SimulatedDvr(acceleration=args.accel[0])
+    sink = VirtualHidSink(args.serve, simulator, REPORT_SIZES[args.mode]).start()
+    print(f"Simulated DVR listening on {args.serve} ({args.mode} reports, {args.accel[0]} acceleration)")
+
+    state = simulator.state
+    try:
+        while True:
+            time.sleep(0.05)
+            if simulator.state != state:
+                state = simulator.state
+                print(f"UI state: {state} (cursor at {simulator.position()})")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sink.stop()
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated DVR and shutdown-path benchmarks")
+    parser.add_argument("--benchmark", action="store_true", help="run the benchmark suite")
+    parser.add_argument("--serve", metavar="PATH", help="run a sink on PATH (unix:/socket or a FIFO) and show UI events")
+    parser.add_argument("--mode", choices=["relative", "absolute"], default="relative", help="pointer report format")
+    parser.add_argument("--accel", nargs="+", choices=sorted(ACCELERATION_MODELS), default=["none", "hikvision"],
+                        help="acceleration models to simulate")
+    parser.add_argument("--calibrated", action="store_true",
+                        help="calibrate against the simulated acceleration before benchmarking")
+    parser.add_argument("--tuned", action="store_true",
+                        help="tune the delays and menu/dialog waits against the simulated DVR before benchmarking")
+    parser.add_argument("--model", help="run this model's sequence from DVRAutomator's sequence library")
+    parser.add_argument("--resolution", metavar="WxH", help="simulated screen resolution (with --model)")
+    parser.add_argument("--ui-detect", action="store_true",
+                        help="wait for rendered menus/dialogs instead of fixed sleeps (needs NumPy)")
+    parser.add_argument("--runs", type=int, default=20, help="homing runs")
+    parser.add_argument("--target-sets", type=int, default=20, help="target sets for move_to_absolute")
+    parser.add_argument("--targets", type=int, default=5, help="targets per set")
+    parser.add_argument("--sequence-runs", type=int, default=3, help="full shutdown sequence runs")
+    parser.add_argument("--skip-sequence", action="store_true", help="skip the full sequence (it includes menu waits)")
+    parser.add_argument("--site", type=int, default=1, metavar="N",
+                        help="also shut N simulated DVRs down in parallel from one controller")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for start positions and targets")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    if args.resolution:
+        width, height = args.resolution.lower().split("x")
+        dvr.SCREEN_RESOLUTION = (int(width), int(height))
+
+    if args.serve:
+        sys.exit(serve(args))
+    if args.benchmark:
+        sys.exit(run_benchmarks(args))
+    parser.print_help()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""
+# Hikvision IP Seurity DVR Shutdown Automation Script
+# Copyright (c) 2019 CFCS - C. Formeister, w/ assistance from G. Kessler & B. Stone
+# w/ HID information by Google Open Source results
+# for Chris Formeister Computer Svcs. Phoenix, AZ
+#
+# Version 1.1a
+# This script is for use for specific purposes of client of Chris Formeister Computer Services.
+# Reproduction or other use is prohibited without the express consent of Chris Formeister Computer Services
+"""
+
+#!/usr/bin/env python3
+
+# Cold-start entry point for hooks that start a fresh process on a power event
+# (UPS NOTIFYCMD, systemd units, udev rules) without a resident --daemon:
+#
+#   sudo python3 DVRTrigger.py [DVRAutomator.py options]
+#
+# Python never caches the bytecode of the script it is started with, so running
+# DVRAutomator.py directly compiles all of it before the first HID report. Imported
+# from here it loads from __pycache__ instead. Everything else - start-up order,
+# background checks, the first-report timing - is DVRAutomator.main()'s.
+
+import DVRAutomator
+
+if __name__ == "__main__":
+    DVRAutomator.main()
@@ -11,7 +11,20 @@
 
 #!/bin/bash
 GADGET_PATH="/sys/kernel/config/usb_gadget/mygadget"
-echo "Starting USB HID gadget setup..."
+
+# Pointer mode: relative boot mouse (default) or absolute tablet-style pointer
+# --keyboard adds a boot keyboard as a second function (composite gadget, /dev/hidg1)
+# Usage: create-gadget.sh [--absolute] [--keyboard]
+MODE="relative"
+KEYBOARD=0
+for ARG in "$@"; do
+    case "$ARG" in
+        --absolute) MODE="absolute" ;;
+        --keyboard) KEYBOARD=1 ;;
+    esac
+done
+
+echo "Starting USB HID gadget setup ($MODE pointer)..."
 
 # Ensure configfs is mounted
 if ! sudo mount | grep -q "/sys/kernel/config"; then
@@ -46,6 +59,10 @@ if [ -d "$GADGET_PATH" ]; then
         sudo find "$GADGET_PATH/functions/hid.usb0" -type f -exec sudo rm -f {} \; 2>/dev/null
         sudo rmdir "$GADGET_PATH/functions/hid.usb0" 2>/dev/null || true
     fi
+    if [ -d "$GADGET_PATH/functions/hid.usb1" ]; then
+        sudo find "$GADGET_PATH/functions/hid.usb1" -type f -exec sudo rm -f {} \; 2>/dev/null
+        sudo rmdir "$GADGET_PATH/functions/hid.usb1" 2>/dev/null || true
+    fi
 
     # 2. Remove string values (these are files, not directories)
     if [ -d "$GADGET_PATH/strings/0x409" ]; then
@@ -102,17 +119,41 @@ echo 120 | sudo tee configs/c.1/MaxPower > /dev/null
 
 # Create the HID function
 sudo mkdir -p functions/hid.usb0
-echo 2 | sudo tee functions/hid.usb0/protocol > /dev/null    # Mouse
-echo 1 | sudo tee functions/hid.usb0/subclass > /dev/null    # Boot Interface
 echo 8 | sudo tee functions/hid.usb0/report_length > /dev/null
 
-# Write the HID report descriptor for a standard 2-button mouse
-# This creates a compatible descriptor for Logitech/Microsoft mice
-echo -ne \\x05\\x01\\x09\\x02\\xa1\\x01\\x09\\x01\\xa1\\x00\\x05\\x09\\x19\\x01\\x29\\x03\\x15\\x00\\x25\\x01\\x95\\x03\\x75\\x01\\x81\\x02\\x95\\x01\\x75\\x05\\x81\\x03\\x05\\x01\\x09\\x30\\x09\\x31\\x15\\x81\\x25\\x7f\\x75\\x08\\x95\\x02\\x81\\x06\\xc0\\xc0 | sudo tee functions/hid.usb0/report_desc > /dev/null
+if [ "$MODE" = "absolute" ]; then
+    # Absolute pointers can't use the boot interface
+    echo 0 | sudo tee functions/hid.usb0/protocol > /dev/null    # None
+    echo 0 | sudo tee functions/hid.usb0/subclass > /dev/null    # No subclass
+
+    # 3 buttons + padding, then X/Y as 16-bit absolute positions (0..32767)
+    # Each report moves the pointer straight to a screen coordinate, no homing needed
+    echo -ne \\x05\\x01\\x09\\x02\\xa1\\x01\\x09\\x01\\xa1\\x00\\x05\\x09\\x19\\x01\\x29\\x03\\x15\\x00\\x25\\x01\\x95\\x03\\x75\\x01\\x81\\x02\\x95\\x01\\x75\\x05\\x81\\x03\\x05\\x01\\x09\\x30\\x09\\x31\\x15\\x00\\x26\\xff\\x7f\\x75\\x10\\x95\\x02\\x81\\x02\\xc0\\xc0 | sudo tee functions/hid.usb0/report_desc > /dev/null
+else
+    echo 2 | sudo tee functions/hid.usb0/protocol > /dev/null    # Mouse
+    echo 1 | sudo tee functions/hid.usb0/subclass > /dev/null    # Boot Interface
+
+    # Write the HID report descriptor for a standard 2-button mouse
+    # This creates a compatible descriptor for Logitech/Microsoft mice
+    echo -ne \\x05\\x01\\x09\\x02\\xa1\\x01\\x09\\x01\\xa1\\x00\\x05\\x09\\x19\\x01\\x29\\x03\\x15\\x00\\x25\\x01\\x95\\x03\\x75\\x01\\x81\\x02\\x95\\x01\\x75\\x05\\x81\\x03\\x05\\x01\\x09\\x30\\x09\\x31\\x15\\x81\\x25\\x7f\\x75\\x08\\x95\\x02\\x81\\x06\\xc0\\xc0 | sudo tee functions/hid.usb0/report_desc > /dev/null
+fi
 
 # Link the HID function to the configuration
 sudo ln -s functions/hid.usb0 configs/c.1/
 
+# Optional keyboard function for menu navigation by arrow keys/Enter
+if [ "$KEYBOARD" = "1" ]; then
+    sudo mkdir -p functions/hid.usb1
+    echo 1 | sudo tee functions/hid.usb1/protocol > /dev/null    # Keyboard
+    echo 1 | sudo tee functions/hid.usb1/subclass > /dev/null    # Boot Interface
+    echo 8 | sudo tee functions/hid.usb1/report_length > /dev/null
+
+    # Standard boot keyboard: modifiers, reserved, LEDs, 6 key slots
+    echo -ne \\x05\\x01\\x09\\x06\\xa1\\x01\\x05\\x07\\x19\\xe0\\x29\\xe7\\x15\\x00\\x25\\x01\\x75\\x01\\x95\\x08\\x81\\x02\\x95\\x01\\x75\\x08\\x81\\x03\\x95\\x05\\x75\\x01\\x05\\x08\\x19\\x01\\x29\\x05\\x91\\x02\\x95\\x01\\x75\\x03\\x91\\x03\\x95\\x06\\x75\\x08\\x15\\x00\\x25\\x65\\x05\\x07\\x19\\x00\\x29\\x65\\x81\\x00\\xc0 | sudo tee functions/hid.usb1/report_desc > /dev/null
+
+    sudo ln -s functions/hid.usb1 configs/c.1/
+fi
+
 # Find the UDC device
 UDC=$(ls /sys/class/udc | head -n1)
 if [ -z "$UDC" ]; then
@@ -0,0 +1,100 @@
+import struct
+
+import pytest
+
+import DVRAutomator as dvr
+import DVRRecorder as recorder
+
+# Interrupt-IN completions of a boot mouse on 1:3 and a keyboard on 1:4
+TRANSFERS = [
+    (1.0, "1:3", bytes([0, 5, 0xfb])),
+    (1.5, "1:3", bytes([1, 0, 0])),
+    (1.6, "1:4", bytes(8)),
+]
+
+def usbmon_packet(seconds, microseconds, data, transfer=recorder.TRANSFER_INTERRUPT, endpoint=0x81,
+                  device=3, bus=1):
+    # 64-byte usbmon header (link type 220) followed by the captured data
+    header = struct.pack("<" + recorder.USBMON_HEADER, 0, ord("C"), transfer, endpoint, device, bus,
+                         0, 0, seconds, microseconds, 0, len(data), len(data))
+    return header.ljust(64, b"\0") + data
+
+def pcap(packets):
+    data = struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, 220)
+    for packet in packets:
+        data += struct.pack("<IIII", 0, 0, len(packet), len(packet)) + packet
+    return data
+
+def pcapng_block(block_type, body):
+    body += b"\0" * (-len(body) % 4)
+    return struct.pack("<II", block_type, len(body) + 12) + body + struct.pack("<I", len(body) + 12)
+
+def pcapng(packets):
+    data = pcapng_block(0x0A0D0D0A, struct.pack("<IHHq", 0x1A2B3C4D, 1, 0, -1))
+    data += pcapng_block(1, struct.pack("<HHI", 220, 0, 65535))
+    for packet in packets:
+        data += pcapng_block(6, struct.pack("<IIIII", 0, 0, 0, len(packet), len(packet)) + packet)
+    return data
+
+CAPTURED = [
+    usbmon_packet(1, 0, bytes([0, 5, 0xfb])),
+    usbmon_packet(1, 500000, bytes([1, 0, 0])),
+    usbmon_packet(1, 600000, bytes(8), device=4),
+    usbmon_packet(2, 0, bytes([0, 1, 1]), transfer=3),   # bulk
+    usbmon_packet(2, 0, bytes([0, 1, 1]), endpoint=0x01),  # OUT
+]
+
+def test_usbmon_text_keeps_interrupt_in_completions(tmp_path):
+    capture = tmp_path / "mouse.txt"
+    capture.write_text(
+        "ffff8e2f5a4b0c00 1000000 S Ii:1:003:1 -115:8 4 <\n"
+        "ffff8e2f5a4b0c00 1000000 C Ii:1:003:1 0:8 3 = 0005fb\n"
+        "ffff8e2f5a4b0c00 1200000 C Bi:1:003:2 0 3 = 000101\n"
+        "ffff8e2f5a4b0c00 1500000 C Ii:1:003:1 0:8 3 = 010000\n"
+        "ffff8e2f5a4b0c00 1600000 C Ii:1:004:1 0:8 8 = 00000000 00000000\n")
+    assert list(recorder.parse_usbmon_text(capture)) == TRANSFERS
+
+def test_usbmon_text_timestamps_unwrap(tmp_path):
+    capture = tmp_path / "wrap.txt"
+    capture.write_text(
+        f"ffff8e2f5a4b0c00 {(1 << 32) - 1000} C Ii:1:003:1 0:8 3 = 000100\n"
+        "ffff8e2f5a4b0c00 1000 C Ii:1:003:1 0:8 3 = 000100\n")
+    first, second = recorder.parse_usbmon_text(capture)
+    assert second[0] - first[0] == pytest.approx(0.002)
+
+@pytest.mark.parametrize("build", [pcap, pcapng])
+def test_pcap_formats_keep_interrupt_in_completions(tmp_path, build):
+    capture = tmp_path / "mouse.cap"
+    capture.write_bytes(build(CAPTURED))
+    assert recorder.read_capture(capture) == TRANSFERS
+
+def test_unknown_capture_format_is_rejected():
+    with pytest.raises(ValueError):
+        list(recorder.read_pcap_packets(b"\x00" * 32))
+
+def test_decode_reports_takes_the_busiest_device():
+    transfers = TRANSFERS + [(1.7, "1:3", bytes([0, 0x80, 0x7f]))]
+    device, reports = recorder.decode_reports(transfers, recorder.REPORT_LAYOUTS["boot"])
+    assert device == "1:3"
+    assert reports == [(1.0, 0, 5, -5), (1.5, 1, 0, 0), (1.7, 0, -128, 127)]
+
+def test_decode_reports_wide_layout():
+    data = bytes([1, 0]) + (-300).to_bytes(2, "little", signed=True) + (2).to_bytes(2, "little", signed=True)
+    _, reports = recorder.decode_reports([(0.0, "1:3", data)], recorder.REPORT_LAYOUTS["wide16"], "1:3")
+    assert reports == [(0.0, 1, -300, 2)]
+
+def test_compact_reports_drops_idle_and_compresses_motion():
+    reports = [
+        (0.0, 0, 4, 0),
+        (0.2, 0, 0, 0),   # idle - dropped
+        (0.4, 0, 4, 0),   # motion: 0.4 s at speed 4
+        (0.5, 1, 0, 0),   # press
+        (5.0, 0, 0, 0),   # release after a pause cut to max_gap, not sped up
+    ]
+    assert recorder.compact_reports(reports, max_gap=1.0, speed=4) == [
+        [0.0, 0, 4, 0], [0.1, 0, 4, 0], [0.025, 1, 0, 0], [1.0, 0, 0, 0],
+    ]
+
+def test_compact_reports_releases_a_held_button():
+    events = recorder.compact_reports([(0.0, 1, 0, 0)])
+    assert events[-1] == [dvr.CLICK_PRESS_DELAY, 0, 0, 0]
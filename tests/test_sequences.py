@@ -0,0 +1,100 @@
+import copy
+
+import pytest
+
+import DVRAutomator as dvr
+
+MODEL = {
+    "resolution": [1920, 1080],
+    "method": "mouse",
+    "ui_states": {"confirm": [0.25, 0.25, 0.5, 0.5]},
+    "steps": [
+        {"target": [0.5, 0.5], "click": "right", "wait": 1.0, "expect": "menu"},
+        {"target": [0.25, 0.75], "expect": "confirm", "tolerance": [0.01, 0.02]},
+        {"target": [1.0, 1.0]},
+    ],
+}
+
+@pytest.fixture
+def library(monkeypatch):
+    """Installs models as the sequence library; every global the loader sets is restored after"""
+    for name in ("SCREEN_WIDTH", "SCREEN_HEIGHT", "SHUTDOWN_METHOD", "SHUTDOWN_STEPS", "SHUTDOWN_MACRO",
+                 "DISMISS_MACRO", "UI_STATES", "REPLAY_RECORDING", "current_x", "current_y", "cursor_error"):
+        monkeypatch.setattr(dvr, name, getattr(dvr, name))
+    monkeypatch.setattr(dvr, "SCREEN_RESOLUTION", None)
+    monkeypatch.setattr(dvr, "KEYBOARD_ENABLED", False)
+    monkeypatch.setattr(dvr, "dvr_profile", {})
+    monkeypatch.setattr(dvr, "log_message", lambda message, level="info": None)
+
+    def install(**models):
+        monkeypatch.setattr(dvr, "sequence_library", models)
+        monkeypatch.setattr(dvr, "DVR_MODEL", next(iter(models)))
+    return install
+
+def broken(change):
+    model = copy.deepcopy(MODEL)
+    change(model)
+    return dvr.validate_sequence_model(model)
+
+def test_shipped_models_are_valid(monkeypatch):
+    monkeypatch.setattr(dvr, "sequence_library", None)
+    for name, model in dvr.load_sequence_library().items():
+        assert dvr.validate_sequence_model(model) == [], name
+
+def test_valid_model_has_no_problems():
+    assert dvr.validate_sequence_model(MODEL) == []
+
+@pytest.mark.parametrize("change, problem", [
+    (lambda model: model["steps"][0].update(target=[1.5, 0]), "step 1: position must be [x, y] between 0 and 1"),
+    (lambda model: model["steps"][0].update(colour="red"), "step 1: unknown key 'colour'"),
+    (lambda model: model["steps"][1].update(expect="submenu"), "step 2: unknown UI state 'submenu'"),
+    (lambda model: model["steps"][2].update(click="double"), "step 3: click must be one of none, left, right, middle"),
+    (lambda model: model["steps"][2].update(timeout=0), "step 3: timeout must be a positive number of seconds"),
+    (lambda model: model.update(steps=[]), "steps must be a non-empty list"),
+    (lambda model: model.update(resolution=[1920]), "resolution must be [width, height] in pixels"),
+    (lambda model: model.update(method="voice"), "method must be 'mouse', 'macro' or 'replay', not 'voice'"),
+    (lambda model: model.update(method="macro"), "method 'macro' needs a macro"),
+    (lambda model: model.update(macro=[["key", "CTRL+FOO"]]), "macro action 1: unknown key 'FOO' in 'CTRL+FOO'"),
+    (lambda model: model.update(macro=[["key", "ENTER", 0]]), "macro action 1: key repeat must be a whole number from 1"),
+    (lambda model: model.update(macro=[["wait", 1.0, "submenu"]]), "macro action 1: unknown UI state 'submenu'"),
+    (lambda model: model.update(dismiss=[["click", "none"]]), "dismiss action 1: click needs left, right or middle"),
+])
+def test_invalid_models_are_reported(change, problem):
+    assert broken(change) == [problem]
+
+def test_model_is_scaled_to_the_screen(library, monkeypatch):
+    library(site=MODEL)
+    monkeypatch.setattr(dvr, "SCREEN_RESOLUTION", (1280, 1024))
+    assert dvr.load_sequence_model(required=True)
+
+    assert (dvr.SCREEN_WIDTH, dvr.SCREEN_HEIGHT) == (1280, 1024)
+    assert [step[1] for step in dvr.SHUTDOWN_STEPS] == [(640, 512), (320, 768), (1279, 1023)]
+    assert [step[2] for step in dvr.SHUTDOWN_STEPS] == [2, 1, 1]
+    assert dvr.SHUTDOWN_STEPS[1][6] == (13, 20)
+    assert dvr.UI_STATES["confirm"] == (320, 256, 640, 512)
+    assert (dvr.current_x, dvr.current_y, dvr.cursor_error) == (640, 512, None)
+
+def test_model_resolution_is_used_without_an_override(library):
+    library(site=dict(MODEL, resolution=[1024, 768]))
+    dvr.load_sequence_model()
+    assert dvr.SHUTDOWN_STEPS[0][1] == (512, 384)
+
+def test_missing_model(library, monkeypatch):
+    library(site=MODEL)
+    monkeypatch.setattr(dvr, "DVR_MODEL", "elsewhere")
+    assert dvr.load_sequence_model() is False
+    with pytest.raises(ValueError, match="No 'elsewhere' model"):
+        dvr.load_sequence_model(required=True)
+
+def test_invalid_model_is_refused(library):
+    library(site=dict(MODEL, steps=[{"target": [2, 2]}]))
+    with pytest.raises(ValueError, match="step 1: position"):
+        dvr.load_sequence_model()
+
+def test_key_macro_needs_the_keyboard(library, monkeypatch):
+    library(site=dict(MODEL, method="macro", macro=[["move", 0.5, 0.5], ["click", "left"], ["key", "ENTER"]]))
+    with pytest.raises(ValueError, match="KEYBOARD_ENABLED is off"):
+        dvr.load_sequence_model()
+    monkeypatch.setattr(dvr, "KEYBOARD_ENABLED", True)
+    assert dvr.load_sequence_model()
+    assert dvr.SHUTDOWN_MACRO == [("move", 960, 540), ("click", "left"), ("key", "ENTER")]